@@ -12,6 +12,8 @@ __all__ = [
     "umbrella",
     "dynamics",
     "algorithm",
+    "graph",
+    "neighborlist",
     "ff",
     # programs
     "cpptraj",
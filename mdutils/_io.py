@@ -0,0 +1,102 @@
+r"""
+Private helpers to read and write plain or compressed files and streams
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tempfile
+import typing as tp
+from contextlib import contextmanager
+from pathlib import Path
+
+# Compression is detected from the file suffix
+_COMPRESSED_OPENERS: tp.Dict[str, tp.Callable[..., tp.Any]] = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+    ".bz2": bz2.open,
+}
+
+PathOrStream = tp.Union[Path, str, tp.IO[str], tp.IO[bytes]]
+
+
+def is_compressed(path: Path) -> bool:
+    return Path(path).suffix in _COMPRESSED_OPENERS
+
+
+def file_digest(path: Path) -> str:
+    r"""Hash of the raw bytes of a file, read in chunks"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, mode="rb") as f:
+        while chunk := f.read(1 << 24):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def open_binary_reader(path: Path) -> tp.BinaryIO:
+    r"""Open a binary stream, decompressed on the fly if the suffix says so"""
+    opener = _COMPRESSED_OPENERS.get(Path(path).suffix, open)
+    return tp.cast(tp.BinaryIO, opener(path, mode="rb"))
+
+
+def open_text_reader(path: Path) -> tp.TextIO:
+    r"""Open a utf-8 text stream, decompressed on the fly if the suffix says so"""
+    opener = _COMPRESSED_OPENERS.get(Path(path).suffix, open)
+    return tp.cast(tp.TextIO, opener(path, mode="rt", encoding="utf-8"))
+
+
+@contextmanager
+def atomic_text_writer(path: Path) -> tp.Iterator[tp.TextIO]:
+    r"""
+    Open a text stream that atomically replaces ``path`` when it is closed
+
+    The data is written to a temporary file in the same directory, which is
+    renamed to ``path`` only if writing finishes without errors. Files with a
+    compressed suffix (.gz, .xz, .bz2) are compressed while writing.
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode="wb") as raw:
+            opener = _COMPRESSED_OPENERS.get(path.suffix)
+            if opener is not None:
+                stream = opener(raw, mode="wt", encoding="utf-8")
+            else:
+                stream = io.TextIOWrapper(raw, encoding="utf-8")
+            with stream:
+                yield stream
+        # mkstemp creates files readable only by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_name, 0o666 & ~umask)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def text_writer(dest: PathOrStream) -> tp.Iterator[tp.TextIO]:
+    r"""
+    Text stream that writes into a path or into a text or binary stream
+
+    Paths are written atomically. Streams are not closed, binary streams are
+    wrapped and written as utf-8.
+    """
+    if isinstance(dest, (str, os.PathLike)):
+        with atomic_text_writer(Path(dest)) as f:
+            yield f
+    elif isinstance(dest, io.TextIOBase):
+        yield tp.cast(tp.TextIO, dest)
+    else:
+        wrapper = io.TextIOWrapper(tp.cast(tp.BinaryIO, dest), encoding="utf-8")
+        try:
+            yield wrapper
+        finally:
+            wrapper.flush()
+            wrapper.detach()
@@ -0,0 +1,80 @@
+r"""
+Private helpers to pass dicts of arrays between processes through shared memory
+"""
+
+import typing as tp
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Offsets of the arrays inside a segment are aligned to this number of bytes
+_ALIGN = 64
+
+
+@dataclass
+class SharedArrays:
+    r"""
+    Handle to a dict of arrays packed in a single shared memory segment
+
+    Only the handle is pickled when it is sent to another process. The process
+    that receives it owns the segment, and must call `SharedArrays.unpack`.
+    """
+
+    shm_name: str
+    # key, dtype, shape and byte offset of each array
+    layout: tp.List[tp.Tuple[str, str, tp.Tuple[int, ...], int]]
+
+    @classmethod
+    def pack(cls, arrays: tp.Mapping[str, NDArray[tp.Any]]) -> "SharedArrays":
+        layout = []
+        size = 0
+        for k, v in arrays.items():
+            if v.dtype.hasobject:
+                raise ValueError(f"Arrays with object dtype can't be shared: {k}")
+            layout.append((k, v.dtype.str, v.shape, size))
+            size += -(-v.nbytes // _ALIGN) * _ALIGN
+        shm = SharedMemory(create=True, size=max(size, 1))
+        try:
+            for (k, dtype, shape, offset), v in zip(layout, arrays.values()):
+                dest: NDArray[tp.Any] = np.ndarray(
+                    shape, dtype=dtype, buffer=shm.buf, offset=offset
+                )
+                dest[...] = v
+                del dest
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        # Ownership is transferred to the receiving process, which unlinks the
+        # segment, so the resource tracker of this process must not do it. The
+        # tracker registers the private _name, which on POSIX has the leading
+        # slash that the public name strips
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+        shm.close()
+        return cls(shm.name, layout)
+
+    def unpack(self) -> tp.Dict[str, NDArray[tp.Any]]:
+        r"""Copy the arrays out of the segment and release it"""
+        shm = SharedMemory(name=self.shm_name)
+        try:
+            arrays = {}
+            for k, dtype, shape, offset in self.layout:
+                arrays[k] = np.ndarray(
+                    shape, dtype=dtype, buffer=shm.buf, offset=offset
+                ).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return arrays
+
+    def release(self) -> None:
+        r"""Release the segment without reading it, if it was not released yet"""
+        try:
+            shm = SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
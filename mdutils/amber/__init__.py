@@ -1,15 +1,27 @@
 from mdutils.amber.prmtop import Prmtop, PrmtopMeta
+from mdutils.amber.prmtop_cache import PrmtopCache
 from mdutils.amber.restart import Restart, RestartMeta
 from mdutils.amber.inpcrd import Inpcrd, InpcrdMeta
 from mdutils.amber.groupfile import write_groupfile_block, dump_groupfile
+from mdutils.amber.energy import (
+    BondedEnergies,
+    bonded_energies,
+    NonbondedEnergies,
+    nonbonded_energies,
+)
 
 __all__ = [
     "write_groupfile_block",
     "dump_groupfile",
     "Prmtop",
     "PrmtopMeta",
+    "PrmtopCache",
     "Restart",
     "RestartMeta",
     "Inpcrd",
     "InpcrdMeta",
+    "BondedEnergies",
+    "bonded_energies",
+    "NonbondedEnergies",
+    "nonbonded_energies",
 ]
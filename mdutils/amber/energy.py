@@ -0,0 +1,406 @@
+r"""
+Bonded and nonbonded energies and forces of Amber topologies, over batches of
+frames
+
+Coordinates are in Angstrom, energies in kcal/mol and forces in
+kcal/mol/Angstrom, as in Amber. All terms are evaluated at once for a chunk of
+frames, chunks are sized so that temporary arrays stay bounded.
+"""
+
+import typing as tp
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+
+from mdutils.amber.prmtop import Prmtop
+from mdutils.amber.prmtop_blocks import Flag
+from mdutils.geometry import BoxParams, NeighborlistKind
+from mdutils.neighborlist import iter_neighbor_pairs
+
+__all__ = [
+    "BondedEnergies",
+    "bonded_energies",
+    "NonbondedEnergies",
+    "nonbonded_energies",
+]
+
+# 1-4 scaling factors used by Amber if the prmtop doesn't have them
+_DEFAULT_SCEE = 1.2
+_DEFAULT_SCNB = 2.0
+
+# Max number of (frame, term) pairs evaluated at once
+_CHUNK_TERMS = 1 << 20
+
+
+@dataclass
+class BondedEnergies:
+    r"""
+    Energies of each frame, split by term, and optionally the per-atom forces
+
+    The 1-4 terms are the (scaled) nonbonded interactions between the ends of
+    the dihedrals
+    """
+
+    bond: NDArray[np.float64]
+    angle: NDArray[np.float64]
+    dihedral: NDArray[np.float64]
+    elec_14: NDArray[np.float64]
+    lj_14: NDArray[np.float64]
+    forces: tp.Optional[NDArray[np.float64]] = None  # (frames, atoms, 3)
+
+    @property
+    def total(self) -> NDArray[np.float64]:
+        return self.bond + self.angle + self.dihedral + self.elec_14 + self.lj_14
+
+
+def bonded_energies(
+    prmtop: Prmtop,
+    coords: NDArray[np.float64],
+    forces: bool = False,
+    chunk_frames: tp.Optional[int] = None,
+) -> BondedEnergies:
+    r"""
+    Bond, angle, dihedral and 1-4 energies of each frame
+
+    ``coords`` must have shape (frames, atoms, 3), or (atoms, 3) for a single
+    frame. Multi-term dihedrals are evaluated term by term, and dihedral angles
+    are signed. If ``chunk_frames`` is not given, it is chosen from the number of
+    terms.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim == 2:
+        coords = coords[None, :, :]
+    if coords.ndim != 3 or coords.shape[1:] != (prmtop.atoms.num, 3):
+        raise ValueError(
+            f"Coords must have shape (frames, {prmtop.atoms.num}, 3),"
+            f" but got {coords.shape}"
+        )
+    terms = _BondedTerms.from_prmtop(prmtop)
+    if chunk_frames is None:
+        chunk_frames = max(1, _CHUNK_TERMS // max(terms.num, 1))
+    if chunk_frames < 1:
+        raise ValueError("chunk_frames must be positive")
+
+    frames_num = coords.shape[0]
+    energies = np.zeros((5, frames_num), dtype=np.float64)
+    all_forces = np.zeros_like(coords) if forces else None
+    for start in range(0, frames_num, chunk_frames):
+        chunk = slice(start, start + chunk_frames)
+        grad = np.zeros_like(coords[chunk]) if forces else None
+        energies[:, chunk] = terms.energies(coords[chunk], grad)
+        if all_forces is not None and grad is not None:
+            all_forces[chunk] = -grad
+    bond, angle, dihedral, elec_14, lj_14 = energies
+    return BondedEnergies(bond, angle, dihedral, elec_14, lj_14, forces=all_forces)
+
+
+@dataclass
+class NonbondedEnergies:
+    r"""
+    Nonbonded energies of each frame, and optionally the per-atom forces
+
+    ``elec`` and ``lj`` are the energies of the non-excluded pairs within the
+    cutoff. ``elec_14`` and ``lj_14`` are the scaled 1-4 terms, the same ones
+    that `BondedEnergies` has.
+    """
+
+    elec: NDArray[np.float64]
+    lj: NDArray[np.float64]
+    elec_14: NDArray[np.float64]
+    lj_14: NDArray[np.float64]
+    forces: tp.Optional[NDArray[np.float64]] = None  # (frames, atoms, 3)
+
+    @property
+    def total(self) -> NDArray[np.float64]:
+        return self.elec + self.lj + self.elec_14 + self.lj_14
+
+
+def nonbonded_energies(
+    prmtop: Prmtop,
+    coords: NDArray[np.float64],
+    box: tp.Union[BoxParams, tp.Sequence[BoxParams], None] = None,
+    cutoff: float = 8.0,
+    forces: bool = False,
+    kind: tp.Union[NeighborlistKind, str] = NeighborlistKind.AUTO,
+) -> NonbondedEnergies:
+    r"""
+    Cutoff Coulomb and LJ energies of each frame, and the scaled 1-4 terms
+
+    ``coords`` must have shape (frames, atoms, 3), or (atoms, 3) for a single
+    frame. ``box`` can be a single box for all frames, or one box per frame.
+    Pairs in the exclusion list are skipped, the 1-4 terms are computed from the
+    dihedrals, without a cutoff.
+
+    Interactions are truncated at the cutoff, without Ewald sums or long-range
+    corrections, so energies are not comparable with those of PME runs.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim == 2:
+        coords = coords[None, :, :]
+    if coords.ndim != 3 or coords.shape[1:] != (prmtop.atoms.num, 3):
+        raise ValueError(
+            f"Coords must have shape (frames, {prmtop.atoms.num}, 3),"
+            f" but got {coords.shape}"
+        )
+    frames_num = coords.shape[0]
+    boxes: tp.Sequence[tp.Optional[BoxParams]]
+    if box is None or isinstance(box, BoxParams):
+        boxes = [box] * frames_num
+    else:
+        boxes = box
+        if len(boxes) != frames_num:
+            raise ValueError("There must be a single box, or one box per frame")
+
+    charge = prmtop.atoms.charge_amber_units.astype(np.float64)
+    pairs_14 = _Pairs14.from_prmtop(prmtop)
+    energies = np.zeros((4, frames_num), dtype=np.float64)
+    all_forces = np.zeros_like(coords) if forces else None
+    for f, frame_box in enumerate(boxes):
+        frame = coords[f]
+        grad = np.zeros_like(coords[f : f + 1]) if forces else None  # noqa
+        for pairs in iter_neighbor_pairs(frame, cutoff, frame_box, kind):
+            i, j = pairs.idxs[:, 0], pairs.idxs[:, 1]
+            is_included = ~prmtop.exclusions.is_excluded(i, j)
+            i, j = i[is_included], j[is_included]
+            diff = frame[j] - frame[i]
+            if frame_box is not None:
+                diff += pairs.shifts[is_included] @ frame_box.vectors
+            r = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+            acoef, bcoef = prmtop.lj_params(i, j)
+            elec, lj, de_dr = _pair_energies(r, charge[i] * charge[j], acoef, bcoef)
+            energies[0, f] += elec.sum()
+            energies[1, f] += lj.sum()
+            if grad is not None:
+                unit = diff / r[:, None]
+                _accumulate(
+                    grad,
+                    np.column_stack((i, j)),
+                    de_dr[None, :],
+                    np.stack((-unit, unit), axis=1)[None, :],
+                )
+        energies[2:, f] = pairs_14.energies(frame[None, :], grad)[:, 0]
+        if all_forces is not None and grad is not None:
+            all_forces[f] = -grad[0]
+    elec, lj, elec_14, lj_14 = energies
+    return NonbondedEnergies(elec, lj, elec_14, lj_14, forces=all_forces)
+
+
+@dataclass
+class _BondedTerms:
+    # Atom idxs and parameters of each term, in float64
+    bond_idxs: NDArray[np.int32]
+    bond_k: NDArray[np.float64]
+    bond_r0: NDArray[np.float64]
+    angle_idxs: NDArray[np.int32]
+    angle_k: NDArray[np.float64]
+    angle_theta0: NDArray[np.float64]
+    dihedral_idxs: NDArray[np.int32]
+    dihedral_k: NDArray[np.float64]
+    dihedral_n: NDArray[np.float64]
+    dihedral_phase: NDArray[np.float64]
+    pairs_14: "_Pairs14"
+
+    @classmethod
+    def from_prmtop(cls, prmtop: Prmtop) -> "_BondedTerms":
+        bonds = prmtop.bonds
+        angles = prmtop.angles
+        dihedrals = prmtop.dihedrals
+        dih_fftype = dihedrals.fftype_idx
+
+        def params(values: NDArray[tp.Any], fftype: NDArray[np.int32]) -> tp.Any:
+            return values.astype(np.float64)[fftype]
+
+        return cls(
+            bond_idxs=bonds.atom_idxs,
+            bond_k=params(bonds.fftype_force_const, bonds.fftype_idx),
+            bond_r0=params(bonds.fftype_equil_distance, bonds.fftype_idx),
+            angle_idxs=angles.atom_idxs,
+            angle_k=params(angles.fftype_force_const, angles.fftype_idx),
+            angle_theta0=params(angles.fftype_equil_angle, angles.fftype_idx),
+            dihedral_idxs=dihedrals.atom_idxs,
+            dihedral_k=params(dihedrals.fftype_force_const, dih_fftype),
+            dihedral_n=np.abs(params(dihedrals.fftype_periodicity, dih_fftype)),
+            dihedral_phase=params(dihedrals.fftype_phase, dih_fftype),
+            pairs_14=_Pairs14.from_prmtop(prmtop),
+        )
+
+    @property
+    def num(self) -> int:
+        return (
+            self.bond_idxs.shape[0]
+            + self.angle_idxs.shape[0]
+            + self.dihedral_idxs.shape[0]
+            + self.pairs_14.idxs.shape[0]
+        )
+
+    def energies(
+        self,
+        coords: NDArray[np.float64],
+        grad: tp.Optional[NDArray[np.float64]],
+    ) -> NDArray[np.float64]:
+        # (5, frames) energies of a chunk of frames. Gradients are accumulated
+        # into grad, if given
+        out = np.empty((5, coords.shape[0]), dtype=np.float64)
+
+        r, dr = _distances(coords, self.bond_idxs, grad is not None)
+        delta = r - self.bond_r0
+        out[0] = np.sum(self.bond_k * delta**2, axis=-1)
+        if grad is not None:
+            _accumulate(grad, self.bond_idxs, 2 * self.bond_k * delta, dr)
+
+        theta, dtheta = _angles(coords, self.angle_idxs, grad is not None)
+        delta = theta - self.angle_theta0
+        out[1] = np.sum(self.angle_k * delta**2, axis=-1)
+        if grad is not None:
+            _accumulate(grad, self.angle_idxs, 2 * self.angle_k * delta, dtheta)
+
+        phi, dphi = _dihedrals(coords, self.dihedral_idxs, grad is not None)
+        arg = self.dihedral_n * phi - self.dihedral_phase
+        out[2] = np.sum(self.dihedral_k * (1 + np.cos(arg)), axis=-1)
+        if grad is not None:
+            de_dphi = -self.dihedral_k * self.dihedral_n * np.sin(arg)
+            _accumulate(grad, self.dihedral_idxs, de_dphi, dphi)
+
+        out[3:] = self.pairs_14.energies(coords, grad)
+        return out
+
+
+@dataclass
+class _Pairs14:
+    # Ends of the dihedrals that compute 1-4 terms, with the coefs already scaled
+    idxs: NDArray[np.int32]
+    charge_prod: NDArray[np.float64]
+    acoef: NDArray[np.float64]
+    bcoef: NDArray[np.float64]
+
+    @classmethod
+    def from_prmtop(cls, prmtop: Prmtop) -> "_Pairs14":
+        dihedrals = prmtop.dihedrals
+        has_14 = ~dihedrals.skip_14
+        idxs = np.ascontiguousarray(dihedrals.atom_idxs[has_14][:, [0, 3]])
+        fftype = dihedrals.fftype_idx[has_14]
+        fftypes_num = dihedrals.fftype_num
+        scee = prmtop.blocks.get(
+            Flag.DIHEDRAL_FFTYPE_ELECTRO_ENDS_SCREEN,
+            np.full(fftypes_num, _DEFAULT_SCEE),
+        ).astype(np.float64)[fftype]
+        scnb = prmtop.blocks.get(
+            Flag.DIHEDRAL_FFTYPE_LJ_ENDS_SCREEN,
+            np.full(fftypes_num, _DEFAULT_SCNB),
+        ).astype(np.float64)[fftype]
+        i, j = idxs[:, 0], idxs[:, 1]
+        charge = prmtop.atoms.charge_amber_units.astype(np.float64)
+        acoef, bcoef = prmtop.lj_params(i, j)
+        return cls(idxs, charge[i] * charge[j] / scee, acoef / scnb, bcoef / scnb)
+
+    def energies(
+        self,
+        coords: NDArray[np.float64],
+        grad: tp.Optional[NDArray[np.float64]],
+    ) -> NDArray[np.float64]:
+        # (2, frames) electrostatic and LJ energies
+        r, dr = _distances(coords, self.idxs, grad is not None)
+        elec, lj, de_dr = _pair_energies(r, self.charge_prod, self.acoef, self.bcoef)
+        if grad is not None:
+            _accumulate(grad, self.idxs, de_dr, dr)
+        return np.stack((elec.sum(axis=-1), lj.sum(axis=-1)))
+
+
+def _pair_energies(
+    r: NDArray[np.float64],
+    charge_prod: NDArray[np.float64],
+    acoef: NDArray[np.float64],
+    bcoef: NDArray[np.float64],
+) -> tp.Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    # Coulomb and LJ energies of each pair, and the derivative of their sum wrt r
+    inv_r = 1 / r
+    inv_r6 = inv_r**6
+    elec = charge_prod * inv_r
+    lj_rep = acoef * inv_r6**2
+    lj_disp = bcoef * inv_r6
+    de_dr = -(elec + 12 * lj_rep - 6 * lj_disp) * inv_r
+    return elec, lj_rep - lj_disp, de_dr
+
+
+# The following functions return the value of an internal coordinate for each
+# (frame, term), with shape (frames, terms), and optionally its gradient wrt the
+# coords of the atoms of each term, with shape (frames, terms, atoms-per-term, 3)
+_MaybeGrad = tp.Optional[NDArray[np.float64]]
+
+
+def _distances(
+    coords: NDArray[np.float64], idxs: NDArray[np.int32], with_grad: bool
+) -> tp.Tuple[NDArray[np.float64], _MaybeGrad]:
+    d = coords[:, idxs[:, 1]] - coords[:, idxs[:, 0]]
+    r = np.sqrt(np.sum(d**2, axis=-1))
+    if not with_grad:
+        return r, None
+    unit = d / r[..., None]
+    return r, np.stack((-unit, unit), axis=2)
+
+
+def _angles(
+    coords: NDArray[np.float64], idxs: NDArray[np.int32], with_grad: bool
+) -> tp.Tuple[NDArray[np.float64], _MaybeGrad]:
+    u = coords[:, idxs[:, 0]] - coords[:, idxs[:, 1]]
+    v = coords[:, idxs[:, 2]] - coords[:, idxs[:, 1]]
+    w = np.cross(u, v)
+    w_norm = np.sqrt(np.sum(w**2, axis=-1))
+    # atan2 is accurate close to 0 and 180 deg, unlike arccos
+    theta = np.arctan2(w_norm, np.sum(u * v, axis=-1))
+    if not with_grad:
+        return theta, None
+    # Gradients are in the plane of the angle, and undefined for linear angles
+    w_norm = np.maximum(w_norm, np.finfo(np.float64).tiny)[..., None]
+    di = np.cross(u, w) / (np.sum(u**2, axis=-1)[..., None] * w_norm)
+    dk = -np.cross(v, w) / (np.sum(v**2, axis=-1)[..., None] * w_norm)
+    return theta, np.stack((di, -di - dk, dk), axis=2)
+
+
+def _dihedrals(
+    coords: NDArray[np.float64], idxs: NDArray[np.int32], with_grad: bool
+) -> tp.Tuple[NDArray[np.float64], _MaybeGrad]:
+    # Notation and gradients from Blondel and Karplus, J. Comput. Chem. 17:1132
+    # (1996), the angle is positive if clockwise when looking from j to k
+    f = coords[:, idxs[:, 0]] - coords[:, idxs[:, 1]]
+    g = coords[:, idxs[:, 1]] - coords[:, idxs[:, 2]]
+    h = coords[:, idxs[:, 3]] - coords[:, idxs[:, 2]]
+    a = np.cross(f, g)
+    b = np.cross(h, g)
+    g_norm = np.sqrt(np.sum(g**2, axis=-1))
+    sin = np.sum(np.cross(b, a) * g, axis=-1) / g_norm
+    cos = np.sum(a * b, axis=-1)
+    phi = np.arctan2(sin, cos)
+    if not with_grad:
+        return phi, None
+    a_sq = np.sum(a**2, axis=-1)
+    b_sq = np.sum(b**2, axis=-1)
+    fg = np.sum(f * g, axis=-1) / (a_sq * g_norm)
+    hg = np.sum(h * g, axis=-1) / (b_sq * g_norm)
+    da = a * (g_norm / a_sq)[..., None]
+    db = b * (g_norm / b_sq)[..., None]
+    di = -da
+    dl = db
+    dj = da + fg[..., None] * a - hg[..., None] * b
+    dk = hg[..., None] * b - fg[..., None] * a - db
+    return phi, np.stack((di, dj, dk, dl), axis=2)
+
+
+def _accumulate(
+    grad: NDArray[np.float64],
+    idxs: NDArray[np.int32],
+    de_dq: NDArray[np.float64],
+    dq: tp.Optional[NDArray[np.float64]],
+) -> None:
+    # Chain rule dE/dx = dE/dq dq/dx, summed into the atoms of each term
+    assert dq is not None
+    frames_num, atoms_num, _ = grad.shape
+    values = (de_dq[..., None, None] * dq).reshape(-1, 3)
+    flat_idxs = np.arange(frames_num)[:, None, None] * atoms_num + idxs[None, :, :]
+    flat_idxs = flat_idxs.reshape(-1)
+    flat_grad = grad.reshape(-1, 3)
+    for c in range(3):
+        flat_grad[:, c] += np.bincount(
+            flat_idxs, weights=values[:, c], minlength=frames_num * atoms_num
+        )
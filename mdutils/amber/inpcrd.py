@@ -3,6 +3,7 @@ Utilities to deal with Amber-style 'inpcrd' formatted ascii files and their meta
 """
 
 import typing_extensions as tpx
+import collections
 import itertools
 import typing as tp
 from dataclasses import dataclass
@@ -12,6 +13,7 @@ import os
 import numpy as np
 from numpy.typing import NDArray
 
+from mdutils._io import is_compressed, open_binary_reader, open_text_reader
 from mdutils.geometry import BoxParams
 from mdutils.amber.input_system import _BaseInputSystem
 
@@ -48,15 +50,22 @@ class InpcrdMeta:
         To correctly load the metadata, it *must* be known if the structure has
         a box or not, otherwise the whole file will have to be read, and
         whether the box is present or not can only be inferred from the number
-        of atoms.
+        of atoms. Compressed files (.gz, .xz, .bz2) are supported, but reading
+        the box of a compressed file requires decompressing all of it.
         """
         path = Path(path).resolve()
-        with open(path, mode="rb") as f:
+        with open_binary_reader(path) as f:
             f.seek(0)
             name, atoms_num = list(itertools.islice(f, 0, 2))
             if has_box:
-                f.seek(-80, os.SEEK_END)
-                box = f.readlines()[-1].decode("ascii").split()
+                if is_compressed(path):
+                    # Compressed streams can't seek from the end, only the last
+                    # line is kept while decompressing
+                    last_line = collections.deque(f, maxlen=1)[0]
+                else:
+                    f.seek(-80, os.SEEK_END)
+                    last_line = f.readlines()[-1]
+                box = last_line.decode("ascii").split()
                 box_params = BoxParams(
                     np.array(box[:3], dtype=np.float64),
                     np.array(box[3:], dtype=np.float64),
@@ -86,6 +95,7 @@ class Inpcrd(_BaseInputSystem):
 
         path = Path(path).resolve()
         name, atoms_num = _read_name_and_num_atoms(path)
+        # Compression is inferred from the suffix, and decompressed as a stream
         df = pandas.read_csv(path, skiprows=2, sep=r"\s+", header=None)
         floats = df.values.reshape(-1, 3)
         coordinates = floats[:atoms_num]
@@ -131,7 +141,7 @@ class Inpcrd(_BaseInputSystem):
 
 
 def _read_name_and_num_atoms(path: Path) -> tp.Tuple[str, int]:
-    with open(path, mode="r", encoding="utf-8") as f:
+    with open_text_reader(path) as f:
         for j, line in enumerate(f):
             if j == 0:
                 name = line.strip()
@@ -0,0 +1,373 @@
+r"""
+Parser and evaluator of Amber atom masks, as used by sander, ambmask and cpptraj
+
+Supported syntax:
+
+- ``:`` residue, ``@`` atom and ``^`` molecule selectors, followed by a comma
+  separated list of 1-based numbers, ranges (``1-10``) or names. Names can have
+  ``*`` or ``=`` (any number of chars) and ``?`` (a single char) wildcards.
+- ``@%`` atom type and ``@/`` element selectors.
+- Chained selectors, e.g. ``:1-10@CA,CB`` selects atoms CA or CB of resids 1-10.
+- ``*`` selects all atoms.
+- ``!``, ``&`` and ``|`` operators, in decreasing order of precedence, and
+  parentheses.
+- Distance selectors ``<@``, ``>@``, ``<:``, ``>:``, ``<^`` and ``>^``, followed
+  by a distance in Angstrom. They select atoms, resids or molecs with any atom
+  closer than (or with all atoms further than) the distance to the atoms of the
+  preceding expression, and need coordinates.
+
+Masks are compiled into boolean arrays with one entry per atom. Labels are
+matched once per unique label, and mapped back to the atoms.
+"""
+
+import functools
+import re
+import typing as tp
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+
+from mdutils.amber.prmtop_blocks import Flag
+from mdutils.constants import PERIODIC_TABLE
+from mdutils.geometry import BoxParams
+from mdutils.neighborlist import iter_neighbor_pairs
+
+if tp.TYPE_CHECKING:
+    from mdutils.amber.prmtop import Prmtop
+
+__all__ = ["AmberMask", "MaskError"]
+
+
+class MaskError(ValueError):
+    pass
+
+
+# Levels of the selectors
+_MOLEC = "^"
+_RESID = ":"
+_ATOM = "@"
+_ATOM_TYPE = "%"
+_ELEMENT = "/"
+
+_NUMBERS_RE = re.compile(r"^(\d+)(?:-(\d+))?$")
+_DIST_RE = re.compile(r"([<>])([:@^])\s*(\d+(?:\.\d*)?|\.\d+)")
+# Chars that end a selector
+_DELIMITERS = set(" \t()&|!<>")
+
+
+# Nodes of the parsed masks. They are hashable, and are used as cache keys
+@dataclass(frozen=True)
+class _All:
+    pass
+
+
+@dataclass(frozen=True)
+class _Select:
+    level: str
+    items: tp.Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class _Not:
+    operand: "_Node"
+
+
+@dataclass(frozen=True)
+class _And:
+    left: "_Node"
+    right: "_Node"
+
+
+@dataclass(frozen=True)
+class _Or:
+    left: "_Node"
+    right: "_Node"
+
+
+@dataclass(frozen=True)
+class _Within:
+    operand: "_Node"
+    level: str
+    distance: float
+    is_closer: bool
+
+
+_Node = tp.Union[_All, _Select, _Not, _And, _Or, _Within]
+
+
+@dataclass(frozen=True)
+class AmberMask:
+    r"""
+    A parsed Amber mask, which can be evaluated on any Prmtop
+
+    Use `Prmtop.select` to evaluate masks with caching.
+    """
+
+    text: str
+    root: _Node
+
+    @classmethod
+    def parse(cls, text: str) -> "AmberMask":
+        return _parse(text)
+
+    @property
+    def needs_coords(self) -> bool:
+        return _needs_coords(self.root)
+
+    def evaluate(
+        self,
+        prmtop: "Prmtop",
+        coords: tp.Optional[NDArray[np.float64]] = None,
+        box: tp.Optional[BoxParams] = None,
+    ) -> NDArray[np.bool_]:
+        r"""
+        Boolean array with the atoms selected by the mask
+
+        ``coords``, with shape (atoms, 3), and ``box`` are only used by
+        distance selectors
+        """
+        if coords is not None:
+            coords = np.asarray(coords, dtype=np.float64)
+            if coords.shape != (prmtop.atoms.num, 3):
+                raise ValueError(f"Coords must have shape ({prmtop.atoms.num}, 3)")
+        return _Evaluator(prmtop, coords, box).evaluate(self.root)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse(text: str) -> AmberMask:
+    parser = _Parser(_tokenize(text), text)
+    root = parser.parse_or()
+    if parser.pos != len(parser.tokens):
+        raise MaskError(f"Unexpected {parser.tokens[parser.pos]!r} in mask {text!r}")
+    return AmberMask(text, root)
+
+
+def _needs_coords(node: _Node) -> bool:
+    if isinstance(node, _Within):
+        return True
+    if isinstance(node, _Not):
+        return _needs_coords(node.operand)
+    if isinstance(node, (_And, _Or)):
+        return _needs_coords(node.left) or _needs_coords(node.right)
+    return False
+
+
+# Tokens are operators, parentheses, selectors and distance selectors
+_Token = tp.Union[str, _Node, tp.Tuple[str, str, float]]
+
+
+def _tokenize(text: str) -> tp.List[_Token]:
+    tokens: tp.List[_Token] = []
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char.isspace():
+            pos += 1
+        elif char in "()!&|":
+            tokens.append(char)
+            pos += 1
+        elif char in "<>":
+            match = _DIST_RE.match(text, pos)
+            if match is None:
+                raise MaskError(f"Invalid distance selector in mask {text!r}")
+            tokens.append((match[1], match[2], float(match[3])))
+            pos = match.end()
+        elif char in (_MOLEC, _RESID, _ATOM, "*"):
+            end = pos
+            while end < len(text) and text[end] not in _DELIMITERS:
+                end += 1
+            tokens.append(_parse_selector(text[pos:end], text))
+            pos = end
+        else:
+            raise MaskError(f"Unexpected {char!r} in mask {text!r}")
+    return tokens
+
+
+def _parse_selector(selector: str, text: str) -> _Node:
+    if selector == "*":
+        return _All()
+    # Chained selectors, such as ^1:2-3@CA, select the intersection
+    parts = re.findall(r"([:@^])([^:@^]*)", selector)
+    if "".join(level + body for level, body in parts) != selector:
+        raise MaskError(f"Invalid selector {selector!r} in mask {text!r}")
+    node: tp.Optional[_Node] = None
+    for level, body in parts:
+        if level == _ATOM and body[:1] in (_ATOM_TYPE, _ELEMENT):
+            level, body = body[0], body[1:]
+        items = tuple(body.split(","))
+        if not all(items):
+            raise MaskError(f"Empty selector {selector!r} in mask {text!r}")
+        is_number = [_NUMBERS_RE.match(item) is not None for item in items]
+        if level in (_ATOM_TYPE, _ELEMENT) and any(is_number):
+            raise MaskError(f"Types and elements can't be numbers in mask {text!r}")
+        if level == _MOLEC and not all(is_number):
+            raise MaskError(f"Molecs can only be selected by number in mask {text!r}")
+        selected: _Node = _Select(level, items)
+        node = selected if node is None else _And(node, selected)
+    assert node is not None
+    return node
+
+
+class _Parser:
+    # Recursive descent, with precedence: distance > ! > & > |
+    def __init__(self, tokens: tp.List[_Token], text: str) -> None:
+        self.tokens = tokens
+        self.text = text
+        self.pos = 0
+
+    def _peek(self) -> tp.Optional[_Token]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> _Token:
+        token = self._peek()
+        if token is None:
+            raise MaskError(f"Unexpected end of mask {self.text!r}")
+        self.pos += 1
+        return token
+
+    def parse_or(self) -> _Node:
+        node = self.parse_and()
+        while self._peek() == "|":
+            self.pos += 1
+            node = _Or(node, self.parse_and())
+        return node
+
+    def parse_and(self) -> _Node:
+        node = self.parse_not()
+        while self._peek() == "&":
+            self.pos += 1
+            node = _And(node, self.parse_not())
+        return node
+
+    def parse_not(self) -> _Node:
+        if self._peek() == "!":
+            self.pos += 1
+            return _Not(self.parse_not())
+        return self.parse_distance()
+
+    def parse_distance(self) -> _Node:
+        node = self.parse_primary()
+        while isinstance(self._peek(), tuple):
+            op, level, distance = tp.cast(tp.Tuple[str, str, float], self._next())
+            node = _Within(node, level, distance, is_closer=op == "<")
+        return node
+
+    def parse_primary(self) -> _Node:
+        token = self._next()
+        if token == "(":
+            node = self.parse_or()
+            if self._next() != ")":
+                raise MaskError(f"Unbalanced parentheses in mask {self.text!r}")
+            return node
+        if isinstance(token, (_All, _Select, _And)):
+            return token
+        raise MaskError(f"Unexpected {token!r} in mask {self.text!r}")
+
+
+class _Evaluator:
+    def __init__(
+        self,
+        prmtop: "Prmtop",
+        coords: tp.Optional[NDArray[np.float64]],
+        box: tp.Optional[BoxParams],
+    ) -> None:
+        self.prmtop = prmtop
+        self.coords = coords
+        self.box = box
+        self.atoms_num = prmtop.atoms.num
+
+    def evaluate(self, node: _Node) -> NDArray[np.bool_]:
+        if isinstance(node, _All):
+            return np.ones(self.atoms_num, dtype=bool)
+        if isinstance(node, _Select):
+            return self._select(node)
+        if isinstance(node, _Not):
+            return ~self.evaluate(node.operand)
+        if isinstance(node, _And):
+            return self.evaluate(node.left) & self.evaluate(node.right)
+        if isinstance(node, _Or):
+            return self.evaluate(node.left) | self.evaluate(node.right)
+        return self._within(node)
+
+    def _select(self, node: _Select) -> NDArray[np.bool_]:
+        if node.level == _ATOM_TYPE:
+            return _match_labels(self.prmtop.atoms.fftype, node.items)
+        if node.level == _ELEMENT:
+            elements = np.array(PERIODIC_TABLE)[self.prmtop.atoms.znum]
+            return _match_labels(np.char.upper(elements), node.items, upper=True)
+        # Numbers select 1-based idxs of the atoms, resids or molecs
+        if node.level == _ATOM:
+            owner = np.arange(self.atoms_num)
+            labels = self.prmtop.atoms.label
+        elif node.level == _RESID:
+            owner = self._owner(_RESID)
+            labels = self.prmtop.resids.label
+        else:
+            owner = self._owner(_MOLEC)
+            labels = np.array([], dtype=np.str_)
+        is_selected = np.zeros(int(owner.max(initial=-1)) + 1, dtype=bool)
+        names = []
+        for item in node.items:
+            match = _NUMBERS_RE.match(item)
+            if match is None:
+                names.append(item)
+                continue
+            first = int(match[1])
+            last = int(match[2]) if match[2] is not None else first
+            is_selected[max(first - 1, 0) : last] = True  # noqa
+        if names:
+            is_selected[: labels.shape[0]] |= _match_labels(labels, tuple(names))
+        return is_selected[owner]
+
+    def _owner(self, level: str) -> NDArray[np.int64]:
+        # Idx of the resid or molec of each atom
+        if level == _ATOM:
+            return np.arange(self.atoms_num)
+        if level == _RESID:
+            atoms_num = self.prmtop.resids.atoms_num
+        elif Flag.ATOMS_PER_MOLECULE in self.prmtop.blocks:
+            atoms_num = self.prmtop.molecs.atoms_num
+        else:
+            return self.prmtop.bond_graph.connected_components()
+        return np.repeat(np.arange(atoms_num.shape[0]), atoms_num)
+
+    def _within(self, node: _Within) -> NDArray[np.bool_]:
+        if self.coords is None:
+            raise MaskError("Distance selectors need coordinates")
+        is_origin = self.evaluate(node.operand)
+        is_close = is_origin.copy()
+        if node.distance > 0.0 and is_origin.any():
+            for pairs in iter_neighbor_pairs(self.coords, node.distance, self.box):
+                i, j = pairs.idxs[:, 0], pairs.idxs[:, 1]
+                is_close[i[is_origin[j]]] = True
+                is_close[j[is_origin[i]]] = True
+        # Whole resids or molecs are selected if any of their atoms is close
+        owner = self._owner(node.level)
+        has_close = np.zeros(int(owner.max(initial=-1)) + 1, dtype=bool)
+        has_close[owner[is_close]] = True
+        is_close = has_close[owner]
+        return is_close if node.is_closer else ~is_close
+
+
+def _match_labels(
+    labels: NDArray[np.str_], patterns: tp.Tuple[str, ...], upper: bool = False
+) -> NDArray[np.bool_]:
+    # Patterns are matched once per unique label
+    unique, inverse = np.unique(np.char.strip(labels), return_inverse=True)
+    is_match = np.zeros(unique.shape[0], dtype=bool)
+    for pattern in patterns:
+        if upper:
+            pattern = pattern.upper()
+        if any(c in pattern for c in "*=?"):
+            regex = re.compile(
+                "".join(
+                    ".*" if c in "*=" else "." if c == "?" else re.escape(c)
+                    for c in pattern
+                )
+                + "$"
+            )
+            is_match |= np.array([regex.match(u) is not None for u in unique], bool)
+        else:
+            is_match |= unique == pattern
+    return is_match[inverse.reshape(-1)]
@@ -1,18 +1,33 @@
+import functools
 import math
+import os
 import typing_extensions as tpx
-from collections import defaultdict
 import datetime
+import mmap
+import warnings
 import typing as tp
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
 import numpy as np
 from numpy.typing import NDArray
 
+from mdutils._io import (
+    PathOrStream,
+    text_writer,
+    is_compressed,
+    open_binary_reader,
+    file_digest,
+)
+from mdutils._shm import SharedArrays
 from mdutils.constants import PERIODIC_TABLE, FF19SB_ATOMIC_MASS, ATOMIC_MASS
-from mdutils.geometry import BoxKind, SolvCapKind
+from mdutils.geometry import BoxKind, BoxParams, SolvCapKind
+from mdutils.graph import CSRGraph
 from mdutils.units import AMBER_ATOM_CHARGE_SCALE_FACTOR
 from mdutils.ff import PolarizableKind
+from mdutils.amber.prmtop_cache import PrmtopCache
+from mdutils.amber.mask import AmberMask
 from mdutils.amber.prmtop_blocks import (
     Format,
     Flag,
@@ -34,6 +49,16 @@ class PrmtopError(ValueError):
     pass
 
 
+# Raw prmtop contents, either read into memory or memory-mapped
+_Buffer = tp.Union[bytes, mmap.mmap]
+
+# Bytes read by PrmtopMeta.load, enough for VERSION, TITLE and POINTERS
+_META_PREFIX_SIZE = 4096
+
+# Bytes decompressed at a time when streaming compressed prmtop files
+_STREAM_CHUNK_SIZE = 1 << 22
+
+
 # Meta is fetched from "POINTERS" and "TITLE" blocks in the prmtop file
 @dataclass
 class PrmtopMeta:
@@ -113,20 +138,44 @@ class PrmtopMeta:
 
         The metadata is the POINTERS block, together with the name (title), the
         version and date. Note that technically the order of the blocks in a prmtop
-        file can be arbitrary, and if the first blocks are not meta blocks, it may
-        be slow to read the metadata.
+        file can be arbitrary. Only a bounded prefix of the file is read, since the
+        meta blocks are normally at the top, and if POINTERS is not found there the
+        file is memory-mapped and the block is located through the %FLAG offsets.
+        Compressed files (.gz, .xz, .bz2) are decompressed only up to POINTERS.
         """
-        version = "V0001.000"
-        date_time = ""
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.startswith("%VERSION"):
-                    parts = line.split()[1:]
-                    version = parts[2]
-                    date_time = f"{parts[5]}  {parts[6]}"
-                    break
-
-        block = load_single_raw_prmtop_block(path, Flag.POINTERS)
+        if is_compressed(path):
+            # Decompression stops as soon as POINTERS is found
+            with open_binary_reader(path) as f:
+                version_and_date, found = _find_stream_section(f, Flag.POINTERS)
+            if found is None:
+                raise PrmtopError("POINTERS block not found in prmtop")
+            block = _parse_block_data(found[1].data(found[0]), found[1].fmt)
+            return cls._from_pointers(block.tolist(), *version_and_date)
+
+        with open(path, mode="rb") as f:
+            buf = f.read(_META_PREFIX_SIZE)
+            version, date_time = _find_version(buf)
+            if len(buf) == _META_PREFIX_SIZE:
+                # Only consider the sections that are complete in the prefix
+                buf = buf[: buf.rfind(b"\n%FLAG") + 1]
+            section = _find_section(buf, Flag.POINTERS)
+            if section is not None:
+                block = _parse_block_data(section.data(buf), section.fmt)
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    section = _find_section(mm, Flag.POINTERS)
+                    if section is None:
+                        raise PrmtopError("POINTERS block not found in prmtop")
+                    block = _parse_block_data(section.data(mm), section.fmt)
+        return cls._from_pointers(block.tolist(), version, date_time)
+
+    @classmethod
+    def _from_pointers(
+        cls,
+        block: tp.Sequence[int],
+        version: str,
+        date_time: str,
+    ) -> tpx.Self:
         # Check well-formedness of the POINTERS block
         if bool(block[8]):
             raise RuntimeError("NHPARM not supported, value should be 0")
@@ -170,6 +219,93 @@ class PrmtopMeta:
         )
 
 
+_T = tp.TypeVar("_T")
+
+
+class _VersionedBlocks(tp.MutableMapping[Flag, NDArray[tp.Any]]):
+    r"""
+    Mapping of blocks that tracks replacements, and caches derived values
+
+    The version is bumped, and the cache cleared, whenever a block is set or
+    deleted. Blocks are stored as read-only views, so that in-place
+    modifications, which can't be tracked, raise instead of silently leaving
+    stale cached values. Blocks must be replaced to modify them. The arrays
+    (and mappings) given by callers are not modified.
+    """
+
+    def __init__(self, blocks: tp.MutableMapping[Flag, NDArray[tp.Any]]) -> None:
+        if not isinstance(blocks, _LazyBlocks):
+            blocks = {flag: _read_only_view(b) for flag, b in blocks.items()}
+        self._blocks = blocks
+        self.version = 0
+        self._derived: tp.Dict[tp.Hashable, tp.Any] = {}
+
+    def __getitem__(self, flag: Flag) -> NDArray[tp.Any]:
+        block = self._blocks[flag]
+        # Lazy blocks are decoded on first access, into arrays they own
+        block.flags.writeable = False
+        return block
+
+    def __setitem__(self, flag: Flag, block: NDArray[tp.Any]) -> None:
+        self._blocks[flag] = _read_only_view(block)
+        self.mark_modified()
+
+    def __delitem__(self, flag: Flag) -> None:
+        del self._blocks[flag]
+        self.mark_modified()
+
+    def __contains__(self, flag: object) -> bool:
+        return flag in self._blocks
+
+    def __iter__(self) -> tp.Iterator[Flag]:
+        return iter(self._blocks)
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._blocks!r})"
+
+    def mark_modified(self) -> None:
+        self.version += 1
+        self._derived.clear()
+
+    def derived(self, key: tp.Hashable, compute: tp.Callable[[], _T]) -> _T:
+        r"""Value computed from the blocks, cached until they are modified"""
+        try:
+            return tp.cast(_T, self._derived[key])
+        except KeyError:
+            pass
+        value = compute()
+        if isinstance(value, np.ndarray):
+            # Shared by all callers
+            value.flags.writeable = False
+        self._derived[key] = value
+        return value
+
+
+def _read_only_view(block: NDArray[tp.Any]) -> NDArray[tp.Any]:
+    view = block.view()
+    view.flags.writeable = False
+    return view
+
+
+def _derived(method: tp.Callable[..., _T]) -> tp.Callable[..., _T]:
+    r"""
+    Cache the value of an accessor method until the blocks of its Prmtop change
+
+    Only for values that depend exclusively on the blocks. Arrays are returned
+    read-only.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self: "_Accessor", *args: tp.Hashable) -> _T:
+        key = (type(self).__name__, method.__name__, *args)
+        return self._prmtop._blocks_derived(key, lambda: method(self, *args))
+
+    return wrapper
+
+
 class _Accessor:
     r"""
     Indirectly manage properties of a Prmtop
@@ -189,6 +325,7 @@ class _InteractionAccessor(_Accessor):
     prefix: tp.ClassVar[str] = ""
     shape: tp.ClassVar[tp.Tuple[int, ...]] = (-1,)
 
+    @_derived
     def num(self, kind: tp.Literal["with-H", "without-H", "all"] = "all") -> int:
         if kind == "with-H":
             return (
@@ -210,6 +347,41 @@ class _InteractionAccessor(_Accessor):
             return self.num("with-H") + self.num("without-H")
         raise ValueError("Kind should be one of 'with-H', 'without-H', 'all'")
 
+    @property
+    @_derived
+    def atom_idxs(self) -> NDArray[np.int32]:
+        r"""
+        (N, k) array of the 0-based atom idxs of each term
+
+        Terms with H come first, followed by terms without H
+        """
+        k = self.shape[1] - 1
+        return np.ascontiguousarray(np.abs(self._merged_table()[:, :k]) // 3)
+
+    @property
+    @_derived
+    def fftype_idx(self) -> NDArray[np.int32]:
+        r"""0-based idx of the fftype (parameters) of each term"""
+        return self._merged_table()[:, -1] - 1
+
+    @property
+    @_derived
+    def has_hydrogen(self) -> NDArray[np.bool_]:
+        r"""Whether each term comes from the "with-H" block"""
+        return np.arange(self.num("all")) < self.num("with-H")
+
+    @_derived
+    def _merged_table(self) -> NDArray[np.int32]:
+        # Raw (N, k + 1) table, with the with-H block first. Cached, since all
+        # the column views are built from it
+        tables = [
+            self._prmtop.blocks.get(
+                Flag[f"{self.prefix}_{suffix}"], np.array([], dtype=np.int32)
+            ).reshape(self.shape)
+            for suffix in ("WITH_HYDROGEN", "WITHOUT_HYDROGEN")
+        ]
+        return np.concatenate(tables).astype(np.int32, copy=False)
+
     @property
     def fftype_num(self) -> int:
         return self.fftype_force_const.shape[0]
@@ -250,7 +422,25 @@ class DihedralsAccessor(_InteractionAccessor):
     prefix: tp.ClassVar[str] = "DIHEDRAL"
     shape: tp.ClassVar[tp.Tuple[int, ...]] = (-1, 5)  # i, j, k, l, idx-into-param-array
 
+    # Flags are encoded as negative idxs of the 3rd and 4th atoms
+    @property
+    @_derived
+    def skip_14(self) -> NDArray[np.bool_]:
+        r"""
+        Whether the 1-4 nonbonded terms of each dihedral must be skipped
+
+        True for the extra terms of multi-term dihedrals, dihedrals in rings, and
+        impropers
+        """
+        return self._merged_table()[:, 2] < 0
+
     @property
+    @_derived
+    def is_improper(self) -> NDArray[np.bool_]:
+        return self._merged_table()[:, 3] < 0
+
+    @property
+    @_derived
     def fftype_group_num(self) -> int:
         is_group_end = self._prmtop.blocks[Flag.DIHEDRAL_FFTYPE_PERIODICITY] >= 0.0
         return np.sum(is_group_end).item()
@@ -293,6 +483,7 @@ class SoltSolvAccessor(_Accessor):
         return np.arange(["SOLUTE", "SOLVENT"], dtype=np.str_)
 
     @property
+    @_derived
     def molecs_num(self) -> NDArray[np.int64]:
         r"""
         Number of molecs in solt and solv
@@ -319,6 +510,7 @@ class MoleculesAccessor(_Accessor):
 
     # Not standard in amber, thus, non-settable by default
     @property
+    @_derived
     def label(self) -> NDArray[np.str_]:
         r"""
         Labels associated with the molecs
@@ -326,35 +518,39 @@ class MoleculesAccessor(_Accessor):
         Mono-resid molecs are given a label equal to the residue. Poly-resid
         molecs are given a standard ``POLYRESID_MOLEC_<num>`` label.
         """
-        labels = []
-        cumu_resid_num = 0
-        for j, s in enumerate(self.resids_num):
-            cumu_resid_num += s.item()
-            if s == 1:
-                labels.append(self._prmtop.resids.label[cumu_resid_num])
-            else:
-                labels.append(f"POLYRESID_MOLEC_{j}")
-        return np.array([labels], dtype=np.str_)
+        resids_num = self.resids_num
+        is_mono = resids_num == 1
+        first_resid = np.cumsum(resids_num) - resids_num
+        resid_labels = self._prmtop.resids.label[first_resid[is_mono]]
+        poly_idxs = np.flatnonzero(~is_mono)
+        poly_labels = np.char.add("POLYRESID_MOLEC_", poly_idxs.astype(np.str_))
+        labels = np.zeros(self.num, dtype=np.result_type(resid_labels, poly_labels))
+        labels[is_mono] = resid_labels
+        labels[poly_idxs] = poly_labels
+        return labels
 
     # Not enforced in prmtop, but required
     @property
+    @_derived
     def resids_num(self) -> NDArray[np.int64]:
         r"""
         Number of resids in each molecule
         """
-        resid_iter = iter(self._prmtop.resids.atoms_num)
-        resid_nums = []
-        for size in self.atoms_num:
-            resid_num = 0
-            cumu_size = 0
-            while cumu_size < size:
-                cumu_size += next(resid_iter).item()
-                resid_num += 1
-            if cumu_size != size:
-                raise RuntimeError("Inconsistency found in prmtop resids")
-            resid_nums.append(resid_num)
+        # Atom idxs where resids start, and one past the end of the last one
+        resid_bounds = np.concatenate(([0], np.cumsum(self._prmtop.resids.atoms_num)))
+        molec_ends = np.cumsum(self.atoms_num)
+        # Num of resids up to the end of each molec
+        resids_cumu_num = np.searchsorted(resid_bounds, molec_ends)
+        # Molecs past the end of the last resid fall on the -1 sentinel
+        is_bound = np.append(resid_bounds, -1)[resids_cumu_num] == molec_ends
+        if not is_bound.all():
+            j = np.argmin(is_bound).item()
+            raise RuntimeError(
+                "Inconsistency found in prmtop resids:"
+                f" molec {j} ends at atom idx {molec_ends[j]}, which is not a resid end"
+            )
         # Sum of the resid nums must be equal to resids.num
-        return np.array(resid_nums, dtype=np.int64)
+        return np.diff(resids_cumu_num, prepend=0)
 
     @property
     def atoms_num(self) -> NDArray[np.int64]:
@@ -364,10 +560,29 @@ class MoleculesAccessor(_Accessor):
         return self._prmtop.blocks[Flag.ATOMS_PER_MOLECULE]
 
     @property
+    @_derived
+    def atoms_num_from_bonds(self) -> NDArray[np.int64]:
+        r"""
+        Number of atoms in each connected component of the bond graph
+
+        Can be compared with 'atoms_num' to verify ATOMS_PER_MOLECULE. Raises
+        `PrmtopError` if some component is not a contiguous range of atoms.
+        """
+        labels = self._prmtop.bond_graph.connected_components()
+        if (np.diff(labels) < 0).any():
+            j = np.argmax(np.diff(labels) < 0).item() + 1
+            raise PrmtopError(
+                f"The molec of atom idx {j} is not a contiguous range of atoms"
+            )
+        return np.bincount(labels)
+
+    @property
+    @_derived
     def max_resids_num(self) -> int:
         return np.max(self.resids_num).item()
 
     @property
+    @_derived
     def max_atoms_num(self) -> int:
         return np.max(self.atoms_num).item()
 
@@ -384,9 +599,10 @@ class ResiduesAccessor(_Accessor):
 
     @property
     def label(self) -> NDArray[np.str_]:
-        return self._prmtop.blocks[Flag.RESIDUE_LABEL]
+        return _as_str(self._prmtop.blocks[Flag.RESIDUE_LABEL])
 
     @property
+    @_derived
     def atoms_num(self) -> NDArray[np.int64]:
         # Sum of the resids sizes must be equal to atoms.num
         starting_atom_index = np.append(
@@ -396,6 +612,7 @@ class ResiduesAccessor(_Accessor):
         return np.diff(starting_atom_index)
 
     @property
+    @_derived
     def max_atoms_num(self) -> int:
         return np.max(self.atoms_num).item()
 
@@ -415,13 +632,14 @@ class AtomsAccessor(_Accessor):
 
     @property
     def label(self) -> NDArray[np.str_]:
-        return self._prmtop.blocks[Flag.ATOM_LABEL]
+        return _as_str(self._prmtop.blocks[Flag.ATOM_LABEL])
 
     @property
     def polarizability(self) -> tp.Optional[NDArray[np.float32]]:
         return self._prmtop.blocks.get(Flag.ATOM_POLARIZABILITY, None)
 
     @property
+    @_derived
     def charge(self) -> NDArray[np.float32]:
         return self._prmtop.blocks[Flag.ATOM_CHARGE] * np.float32(
             AMBER_ATOM_CHARGE_SCALE_FACTOR
@@ -446,17 +664,25 @@ class AtomsAccessor(_Accessor):
     # The fftype is given by a str
     @property
     def fftype(self) -> NDArray[np.str_]:
-        return self._prmtop.blocks[Flag.ATOM_FFTYPE]
+        return _as_str(self._prmtop.blocks[Flag.ATOM_FFTYPE])
 
     @property
+    @_derived
     def fftype_num(self) -> int:
-        return np.unique(self.fftype).shape[0]
+        return np.unique(self._prmtop.blocks[Flag.ATOM_FFTYPE]).shape[0]
 
     # The ljindex is given by an idx, which idxs into the ljindex array
     @property
     def ljindex(self) -> NDArray[np.int64]:
         return self._prmtop.blocks[Flag.ATOM_LJINDEX]
 
+    @property
+    @_derived
+    def extra_points_num(self) -> int:
+        fftype = self._prmtop.blocks[Flag.ATOM_FFTYPE]
+        extra_point = b"EP  " if fftype.dtype.kind == "S" else "EP  "
+        return np.sum(fftype == extra_point).item()
+
     @property
     def ljindex_num(self) -> int:
         return int(math.sqrt(self.ljindex_square))
@@ -477,7 +703,7 @@ class AtomsAccessor(_Accessor):
         # - blah: ' BLA' placeholder value that also seems to be allowed
         block = self._prmtop.blocks.get(Flag.ATOM_LEGACY_GRAPH_LABEL, None)
         if block is not None:
-            return block
+            return _as_str(block)
         return np.array(["BLA"] * self.num, dtype=np.str_)
 
     @property
@@ -493,12 +719,204 @@ class AtomsAccessor(_Accessor):
         return np.zeros(self.fftype_num, dtype=np.float32)
 
 
+class ExclusionsAccessor(_Accessor):
+    r"""
+    Manage the nonbonded exclusions of a Prmtop as a CSR neighborlist
+
+    The excluded atoms of atom ``i`` are ``idxs[offsets[i]:offsets[i + 1]]``,
+    with 0-based idxs. As in the prmtop, each excluded pair is listed only once,
+    for the lowest atom. The placeholder entries of atoms without exclusions are
+    dropped.
+    """
+
+    @property
+    def offsets(self) -> NDArray[np.int64]:
+        return self._csr()[0]
+
+    @property
+    def idxs(self) -> NDArray[np.int64]:
+        return self._csr()[1]
+
+    @property
+    def num(self) -> NDArray[np.int64]:
+        r"""
+        Number of atoms excluded by each atom (without placeholders)
+        """
+        return np.diff(self.offsets)
+
+    def neighbors(self, atom: int) -> NDArray[np.int64]:
+        offsets, idxs = self._csr()
+        return idxs[offsets[atom] : offsets[atom + 1]]  # noqa
+
+    @_derived
+    def pairs(self) -> NDArray[np.int64]:
+        r"""
+        (P, 2) array of the excluded atom pairs, in the prmtop order
+        """
+        offsets, idxs = self._csr()
+        rows = np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+        return np.column_stack((rows, idxs))
+
+    @_derived
+    def graph(self) -> CSRGraph:
+        r"""
+        Exclusions as an undirected graph, with both directions of each pair
+        """
+        return CSRGraph.from_edges(self.pairs(), self._prmtop.atoms.num)
+
+    def is_excluded(
+        self,
+        i: tp.Union[int, NDArray[np.int64]],
+        j: tp.Union[int, NDArray[np.int64]],
+    ) -> NDArray[np.bool_]:
+        r"""
+        Whether each atom pair (i, j) is excluded, in any order
+
+        ``i`` and ``j`` are 0-based atom idxs, broadcast against each other
+        """
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+        keys = self._sorted_keys()
+        query = np.minimum(i, j) * self._prmtop.atoms.num + np.maximum(i, j)
+        if not keys.size:
+            return np.zeros(query.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(keys, query), keys.shape[0] - 1)
+        return keys[pos] == query
+
+    @_derived
+    def _sorted_keys(self) -> NDArray[np.int64]:
+        pairs = self.pairs()
+        return np.sort(
+            np.min(pairs, axis=1) * self._prmtop.atoms.num + np.max(pairs, axis=1)
+        )
+
+    @_derived
+    def _csr(self) -> tp.Tuple[NDArray[np.int64], NDArray[np.int64]]:
+        counts = self._prmtop.blocks[Flag.NUMBER_EXCLUDED_ATOMS]
+        atoms_num = counts.shape[0]
+        rows = np.repeat(np.arange(atoms_num), counts)
+        # The list may be padded past the sum of the counts
+        excluded = self._prmtop.blocks[Flag.EXCLUDED_ATOMS_LIST][: rows.shape[0]]
+        idxs = excluded.astype(np.int64) - 1
+        # Placeholders are 0, which is -1 after shifting the idxs
+        is_real = idxs >= 0
+        offsets = np.zeros(atoms_num + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[is_real], minlength=atoms_num), out=offsets[1:])
+        idxs = idxs[is_real]
+        offsets.flags.writeable = False
+        idxs.flags.writeable = False
+        return offsets, idxs
+
+
+class LennardJonesAccessor(_Accessor):
+    r"""
+    Manage the Lennard-Jones parameters of a Prmtop as dense lookup tables
+
+    Tables are indexed by 0-based ljindex. The A and B coefficients of a pair of
+    atoms are ``A = 4 eps sigma^12`` and ``B = 4 eps sigma^6``.
+    """
+
+    @property
+    def ljindex_num(self) -> int:
+        return self._prmtop.atoms.ljindex_num
+
+    @property
+    @_derived
+    def param_idx(self) -> NDArray[np.int64]:
+        r"""
+        (ntypes, ntypes) array of 0-based idxs into the LJ coefficient blocks
+
+        Pairs that use the (10-12) hbond coefficients have negative idxs
+        """
+        ntypes = self.ljindex_num
+        idxs = self._prmtop.blocks[Flag.LJ_PARAM_INDEX].astype(np.int64)
+        idxs = idxs.reshape(ntypes, ntypes)
+        return np.where(idxs > 0, idxs - 1, idxs)
+
+    @property
+    @_derived
+    def acoef(self) -> NDArray[np.float64]:
+        r"""(ntypes, ntypes) array of LJ A coefficients, zero for hbond pairs"""
+        return self._coef_matrix(Flag.LJ_PARAM_A)
+
+    @property
+    @_derived
+    def bcoef(self) -> NDArray[np.float64]:
+        r"""(ntypes, ntypes) array of LJ B coefficients, zero for hbond pairs"""
+        return self._coef_matrix(Flag.LJ_PARAM_B)
+
+    @property
+    @_derived
+    def sigma(self) -> NDArray[np.float64]:
+        r"""
+        Sigma of each ljindex, zero for types without LJ interactions
+
+        Only available if all pairs follow the Lorentz-Berthelot combining rules
+        (e.g. no NBFIX modifications), since otherwise per-type parameters can't
+        reproduce the coefficients.
+        """
+        return self._lorentz_berthelot_params()[0]
+
+    @property
+    @_derived
+    def epsilon(self) -> NDArray[np.float64]:
+        r"""
+        Epsilon of each ljindex, zero for types without LJ interactions
+
+        Only available if all pairs follow the Lorentz-Berthelot combining rules
+        """
+        return self._lorentz_berthelot_params()[1]
+
+    def _coef_matrix(self, flag: Flag) -> NDArray[np.float64]:
+        param_idx = self.param_idx
+        coef = self._prmtop.blocks[flag].astype(np.float64)
+        return np.where(param_idx >= 0, coef[np.maximum(param_idx, 0)], 0.0)
+
+    @_derived
+    def _lorentz_berthelot_params(
+        self,
+    ) -> tp.Tuple[NDArray[np.float64], NDArray[np.float64]]:
+        acoef = self.acoef
+        bcoef = self.bcoef
+        a = np.diag(acoef)
+        b = np.diag(bcoef)
+        has_lj = (a > 0) & (b > 0)
+        if ((a > 0) != (b > 0)).any():
+            raise PrmtopError("Only LJ types with both A and B coefs > 0 have a sigma")
+        sigma = np.zeros_like(a)
+        epsilon = np.zeros_like(a)
+        sigma[has_lj] = (a[has_lj] / b[has_lj]) ** (1 / 6)
+        epsilon[has_lj] = b[has_lj] ** 2 / (4 * a[has_lj])
+        pair_sigma = (sigma[:, None] + sigma[None, :]) / 2
+        pair_epsilon = np.sqrt(epsilon[:, None] * epsilon[None, :])
+        # Coefs are stored with 9 significant digits
+        if not (
+            np.allclose(acoef, 4 * pair_epsilon * pair_sigma**12, rtol=1e-6)
+            and np.allclose(bcoef, 4 * pair_epsilon * pair_sigma**6, rtol=1e-6)
+        ):
+            raise PrmtopError(
+                "LJ coefs don't follow the Lorentz-Berthelot combining rules"
+            )
+        sigma.flags.writeable = False
+        epsilon.flags.writeable = False
+        return sigma, epsilon
+
+
 @dataclass
 class Prmtop:
+    r"""
+    Amber topology, stored as a mapping of %FLAG blocks
+
+    Blocks, and values derived from them by the accessors (e.g.
+    ``atoms.charge``), are read-only arrays shared by all callers. To modify a
+    block assign a new array, e.g. ``prmtop.blocks[flag] = new_block``, which
+    drops the cached derived values. Use ``.copy()`` to get writable arrays.
+    """
+
     date_time: tp.Optional[str] = None
     name: str = "default_name"
     version: str = "V0001.000"
-    blocks: tp.Dict[Flag, NDArray[tp.Any]] = field(default_factory=dict)
+    blocks: tp.MutableMapping[Flag, NDArray[tp.Any]] = field(default_factory=dict)
     box_kind: BoxKind = BoxKind.NO_BOX
     solv_cap_kind: SolvCapKind = SolvCapKind.NO_SOLV_CAP
     cmap_param_comments: tp.Dict[Flag, str] = field(default_factory=dict)
@@ -517,6 +935,349 @@ class Prmtop:
         self.angles = AnglesAccessor(self)
         self.dihedrals = DihedralsAccessor(self)
 
+        # Nonbonded interactions
+        self.exclusions = ExclusionsAccessor(self)
+        self.lj = LennardJonesAccessor(self)
+
+    def __setattr__(self, name: str, value: tp.Any) -> None:
+        # Values derived from the blocks are cached by the blocks mapping
+        if name == "blocks" and not isinstance(value, _VersionedBlocks):
+            value = _VersionedBlocks(value)
+        super().__setattr__(name, value)
+
+    def _blocks_derived(self, key: tp.Hashable, compute: tp.Callable[[], _T]) -> _T:
+        return tp.cast(_VersionedBlocks, self.blocks).derived(key, compute)
+
+    @property
+    def bond_graph(self) -> CSRGraph:
+        r"""
+        Graph of the bonds (with and without H), with 0-based atom idxs
+
+        Built on first access, and cached until the blocks are modified
+        """
+        return self._blocks_derived(("Prmtop", "bond_graph"), self._build_bond_graph)
+
+    def _build_bond_graph(self) -> CSRGraph:
+        return CSRGraph.from_edges(self.bonds.atom_idxs, self.atoms.num)
+
+    def lj_params(
+        self,
+        i: tp.Union[int, NDArray[np.integer[tp.Any]]],
+        j: tp.Union[int, NDArray[np.integer[tp.Any]]],
+    ) -> tp.Tuple[NDArray[np.float64], NDArray[np.float64]]:
+        r"""
+        LJ A and B coefficients of each atom pair (i, j)
+
+        ``i`` and ``j`` are 0-based atom idxs, broadcast against each other
+        """
+        ljindex = self.blocks[Flag.ATOM_LJINDEX]
+        ti = ljindex[np.asarray(i, dtype=np.int64)] - 1
+        tj = ljindex[np.asarray(j, dtype=np.int64)] - 1
+        return self.lj.acoef[ti, tj], self.lj.bcoef[ti, tj]
+
+    def select(
+        self,
+        mask: tp.Union[str, AmberMask],
+        coords: tp.Optional[NDArray[np.float64]] = None,
+        box: tp.Optional[BoxParams] = None,
+    ) -> NDArray[np.bool_]:
+        r"""
+        Boolean array with the atoms selected by an Amber mask
+
+        Masks are parsed once, and masks without distance selectors are cached
+        until the blocks are modified. ``coords``, with shape (atoms, 3), and
+        ``box`` are only used by distance selectors.
+        """
+        if isinstance(mask, str):
+            mask = AmberMask.parse(mask)
+        if mask.needs_coords:
+            return mask.evaluate(self, coords, box)
+        return self._blocks_derived(
+            ("Prmtop", "select", mask.root), lambda: mask.evaluate(self)
+        )
+
+    def select_idxs(
+        self,
+        mask: tp.Union[str, AmberMask],
+        coords: tp.Optional[NDArray[np.float64]] = None,
+        box: tp.Optional[BoxParams] = None,
+    ) -> NDArray[np.int64]:
+        r"""Sorted 0-based idxs of the atoms selected by an Amber mask"""
+        if isinstance(mask, str):
+            mask = AmberMask.parse(mask)
+        if mask.needs_coords:
+            return np.flatnonzero(mask.evaluate(self, coords, box))
+        return self._blocks_derived(
+            ("Prmtop", "select_idxs", mask.root),
+            lambda: np.flatnonzero(self.select(mask)),
+        )
+
+    def subset(
+        self,
+        selection: tp.Union[str, AmberMask, NDArray[tp.Any], tp.Sequence[int]],
+    ) -> tpx.Self:
+        r"""
+        New Prmtop with only the selected atoms, in their original order
+
+        ``selection`` is an Amber mask, a boolean array with one entry per atom,
+        or a sequence of 0-based atom idxs. Bonds, angles, dihedrals, CMAP terms
+        and exclusions of removed atoms are dropped, resids and molecs without
+        atoms are removed, and SOLVENT_POINTERS is updated. Unused bond, angle,
+        dihedral, CMAP and LJ types are pruned.
+        """
+        return self._subset(self._selection_mask(selection))
+
+    def strip(
+        self,
+        selection: tp.Union[str, AmberMask, NDArray[tp.Any], tp.Sequence[int]],
+    ) -> tpx.Self:
+        r"""
+        New Prmtop without the selected atoms, as cpptraj's ``parmstrip``
+
+        ``selection`` is interpreted as in `Prmtop.subset`
+        """
+        return self._subset(~self._selection_mask(selection))
+
+    def _selection_mask(
+        self,
+        selection: tp.Union[str, AmberMask, NDArray[tp.Any], tp.Sequence[int]],
+    ) -> NDArray[np.bool_]:
+        if isinstance(selection, (str, AmberMask)):
+            return self.select(selection)
+        selection = np.asarray(selection)
+        if selection.dtype == np.bool_:
+            if selection.shape != (self.atoms.num,):
+                raise ValueError(f"Boolean selection must have {self.atoms.num} atoms")
+            return selection
+        if selection.size == 0:
+            selection = selection.astype(np.int64)
+        if not np.issubdtype(selection.dtype, np.integer) or selection.ndim != 1:
+            raise ValueError("Selections must be masks, or 1D bool or int arrays")
+        if ((selection < 0) | (selection >= self.atoms.num)).any():
+            raise ValueError(f"Atom idxs must be in the range [0, {self.atoms.num})")
+        is_selected = np.zeros(self.atoms.num, dtype=bool)
+        is_selected[selection] = True
+        return is_selected
+
+    def _subset(self, keep: NDArray[np.bool_]) -> tpx.Self:
+        if self.has_solv_cap:
+            raise RuntimeError("Subsets of prmtops with a solv cap are not supported")
+        if Flag.LJ_PARAM_D in self.blocks or Flag.LJ_VALUE_D in self.blocks:
+            raise RuntimeError("Subsets of prmtops with LJ D coefs are not supported")
+        if not keep.any():
+            raise PrmtopError("At least 1 atom is required")
+        blocks: tp.Dict[Flag, NDArray[tp.Any]] = dict(self.blocks)
+        # New 0-based idx of each atom, -1 for removed atoms
+        new_idx = np.where(keep, np.cumsum(keep) - 1, -1)
+        for flag in _ATOM_FLAGS:
+            if flag in blocks:
+                blocks[flag] = blocks[flag][keep]
+
+        # Resids are kept if any of their atoms is, kept atoms are contiguous
+        resid = np.repeat(np.arange(self.resids.num), self.resids.atoms_num)[keep]
+        is_first = np.ones(resid.shape[0], dtype=bool)
+        is_first[1:] = resid[1:] != resid[:-1]
+        is_kept_resid = np.zeros(self.resids.num, dtype=bool)
+        is_kept_resid[resid[is_first]] = True
+        blocks[Flag.RESIDUE_LABEL] = blocks[Flag.RESIDUE_LABEL][is_kept_resid]
+        blocks[Flag.RESIDUE_FIRST_ATOM_IDX1] = (np.flatnonzero(is_first) + 1).astype(
+            blocks[Flag.RESIDUE_FIRST_ATOM_IDX1].dtype
+        )
+
+        if Flag.ATOMS_PER_MOLECULE in blocks:
+            molecs_atoms_num = self.molecs.atoms_num
+            molec = np.repeat(np.arange(molecs_atoms_num.shape[0]), molecs_atoms_num)
+            new_atoms_num = np.bincount(
+                molec[keep], minlength=molecs_atoms_num.shape[0]
+            )
+            is_kept_molec = new_atoms_num > 0
+            blocks[Flag.ATOMS_PER_MOLECULE] = new_atoms_num[is_kept_molec].astype(
+                blocks[Flag.ATOMS_PER_MOLECULE].dtype
+            )
+            if Flag.SOLVENT_POINTERS in blocks:
+                block = blocks[Flag.SOLVENT_POINTERS]
+                last_solt_resid, _, first_solv_molec = block.tolist()
+                blocks[Flag.SOLVENT_POINTERS] = np.array(
+                    [
+                        is_kept_resid[:last_solt_resid].sum(),
+                        is_kept_molec.sum(),
+                        is_kept_molec[: first_solv_molec - 1].sum() + 1,
+                    ],
+                    dtype=block.dtype,
+                )
+
+        for atoms_num, flags, fftype_flags in _INTERACTION_FLAGS:
+            _subset_interactions(blocks, atoms_num, flags, fftype_flags, new_idx)
+        if Flag.CMAP_INDEX in blocks:
+            cmap_param_comments = _subset_cmap(
+                blocks, new_idx, self.cmap_param_comments
+            )
+        else:
+            cmap_param_comments = dict(self.cmap_param_comments)
+
+        pairs = new_idx[self.exclusions.pairs()]
+        pairs = pairs[(pairs >= 0).all(axis=1)]
+        _set_exclusion_blocks(blocks, pairs, resid.shape[0])
+        _subset_lj_types(blocks, self.atoms.ljindex_num)
+        return type(self)(
+            name=self.name,
+            version=self.version,
+            date_time=self.date_time,
+            blocks=blocks,
+            box_kind=self.box_kind,
+            solv_cap_kind=self.solv_cap_kind,
+            cmap_param_comments=cmap_param_comments,
+            pimd_slices_num=self.pimd_slices_num,
+        )
+
+    def repartition_hydrogen_masses(
+        self,
+        hydrogen_mass: float = 3.024,
+        modify_waters: bool = False,
+    ) -> None:
+        r"""
+        Set the mass of all H, moving the added mass from their bonded heavy atoms
+
+        Equivalent to cpptraj's ``hmassrepartition``, so that the total mass of
+        each molec is conserved. Waters are skipped unless ``modify_waters=True``.
+        Waters are the molecs with one O, two H and no other atoms besides extra
+        points, so other solvents (e.g. methanol or DMSO) are always modified.
+        """
+        mass = self.atoms.mass.astype(np.float64)
+        is_h = self.atoms.znum == 1
+        bonds = self.bonds.atom_idxs
+        # Only bonds between an H and a heavy atom, H-H bonds of waters are skipped
+        bonds = bonds[is_h[bonds[:, 0]] != is_h[bonds[:, 1]]]
+        h_first = is_h[bonds[:, 0]]
+        hydrogens = np.where(h_first, bonds[:, 0], bonds[:, 1])
+        heavy = np.where(h_first, bonds[:, 1], bonds[:, 0])
+        if not modify_waters:
+            is_water = self._water_mask()[hydrogens]
+            hydrogens, heavy = hydrogens[~is_water], heavy[~is_water]
+        if (np.bincount(hydrogens) > 1).any():
+            raise PrmtopError("Some H are bonded to more than one heavy atom")
+
+        added_mass = hydrogen_mass - mass[hydrogens]
+        mass[hydrogens] = hydrogen_mass
+        mass -= np.bincount(heavy, weights=added_mass, minlength=mass.shape[0])
+        if (mass[heavy] <= 0.0).any():
+            raise PrmtopError("Repartitioning would make some heavy atom massless")
+        self.blocks[Flag.ATOM_MASS] = mass.astype(self.blocks[Flag.ATOM_MASS].dtype)
+
+    def _water_mask(self) -> NDArray[np.bool_]:
+        if Flag.ATOMS_PER_MOLECULE in self.blocks:
+            atoms_num = self.molecs.atoms_num
+            molec = np.repeat(np.arange(atoms_num.shape[0]), atoms_num)
+        else:
+            molec = self.bond_graph.connected_components()
+        znum = self.atoms.znum
+        molecs_num = molec.max() + 1
+        # Extra points have znum 0
+        o_num, h_num, other_num = (
+            np.bincount(molec[is_znum], minlength=molecs_num)
+            for is_znum in (znum == 8, znum == 1, (znum > 1) & (znum != 8))
+        )
+        is_water = (o_num == 1) & (h_num == 2) & (other_num == 0)
+        return is_water[molec]
+
+    def regenerate_molecules(self) -> None:
+        r"""
+        Set ATOMS_PER_MOLECULE and SOLVENT_POINTERS from the bond graph
+
+        Molecs are the connected components of the bond graph. If the prmtop has
+        SOLVENT_POINTERS, the solvent starts at the molec that contains the
+        first atom after the last solute resid.
+        """
+        atoms_num = self.molecs.atoms_num_from_bonds
+        self.blocks[Flag.ATOMS_PER_MOLECULE] = atoms_num.copy()
+        if Flag.SOLVENT_POINTERS not in self.blocks:
+            return
+        last_solt_resid = self.blocks[Flag.SOLVENT_POINTERS][0].item()
+        resid_first_atoms = self.blocks[Flag.RESIDUE_FIRST_ATOM_IDX1] - 1
+        if last_solt_resid < self.resids.num:
+            first_solv_atom = resid_first_atoms[last_solt_resid]
+            first_solv_molec = np.searchsorted(
+                np.cumsum(atoms_num), first_solv_atom, side="right"
+            ).item()
+        else:
+            first_solv_molec = atoms_num.shape[0]
+        self.blocks[Flag.SOLVENT_POINTERS] = np.array(
+            [last_solt_resid, atoms_num.shape[0], first_solv_molec + 1],
+            dtype=self.blocks[Flag.SOLVENT_POINTERS].dtype,
+        )
+
+    def regenerate_exclusions(self) -> None:
+        r"""
+        Set NUMBER_EXCLUDED_ATOMS and EXCLUDED_ATOMS_LIST from the bond graph
+
+        Each atom excludes the atoms after it that are up to 3 bonds away (1-2,
+        1-3 and 1-4 pairs), in increasing order. As in leap, atoms that don't
+        exclude any atom get a single placeholder 0. Extra points are not
+        treated specially.
+        """
+        pairs = self.bond_graph.pairs_within(3)
+        _set_exclusion_blocks(self.blocks, pairs, self.atoms.num)
+
+    def regenerate_angles_and_dihedrals(
+        self,
+        angle_fftype_idx: int = 1,
+        dihedral_fftype_idx: int = 1,
+    ) -> None:
+        r"""
+        Set the angle and (proper) dihedral blocks from the bond graph
+
+        All angles and dihedrals get the given 1-based fftype idxs, and are split
+        into the with-H and without-H blocks according to ATOM_ZNUM. Angles in
+        3-rings with an H-H bond (rigid waters) are skipped, as leap does, but
+        other angles in 3-rings (e.g. cyclopropane) are kept. The 1-4 terms of
+        dihedrals are skipped if the end atoms are closer than 3 bonds (3-, 4-
+        and 5-rings), or already counted by a previous dihedral. Impropers are
+        not generated.
+        """
+        graph = self.bond_graph
+        atoms_num = graph.nodes_num
+        is_h = self.atoms.znum == 1
+
+        all_angles = graph.angles()
+        # All atoms of a 3-ring are bonded, so 2 H imply an H-H bond
+        in_hh_ring = graph.has_edge(all_angles[:, 0], all_angles[:, 2]) & (
+            is_h[all_angles].sum(axis=1) >= 2
+        )
+        angles = all_angles[~in_hh_ring]
+        angles_block = np.column_stack(
+            (3 * angles, np.full(angles.shape[0], angle_fftype_idx))
+        )
+
+        dihedrals = graph.dihedrals()
+        ends = np.sort(dihedrals[:, [0, 3]], axis=1)
+        keys = ends[:, 0] * atoms_num + ends[:, 1]
+        angle_keys = np.sort(all_angles[:, 0] * atoms_num + all_angles[:, 2])
+        pos = np.minimum(np.searchsorted(angle_keys, keys), angle_keys.shape[0] - 1)
+        is_close = graph.has_edge(ends[:, 0], ends[:, 1])
+        if angle_keys.size:
+            is_close |= angle_keys[pos] == keys
+        # Only the first dihedral with each pair of ends computes the 1-4 terms
+        order = np.argsort(keys, kind="stable")
+        is_repeated = np.zeros(keys.shape[0], dtype=bool)
+        is_repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+        # Negative idxs can't flag atom 0, so those dihedrals are reversed
+        to_reverse = (dihedrals[:, 2] == 0) | (dihedrals[:, 3] == 0)
+        dihedrals[to_reverse] = dihedrals[to_reverse, ::-1]
+        dihedrals_block = np.column_stack(
+            (3 * dihedrals, np.full(dihedrals.shape[0], dihedral_fftype_idx))
+        )
+        dihedrals_block[is_close | is_repeated, 2] *= -1
+
+        for prefix, table, atoms in (
+            ("ANGLE", angles_block, angles),
+            ("DIHEDRAL", dihedrals_block, dihedrals),
+        ):
+            has_h = is_h[atoms].any(axis=1)
+            for suffix, mask in (("WITH", has_h), ("WITHOUT", ~has_h)):
+                flag = Flag[f"{prefix}_{suffix}_HYDROGEN"]
+                dtype = self.blocks[flag].dtype if flag in self.blocks else np.int64
+                self.blocks[flag] = table[mask].ravel().astype(dtype)
+
     @property
     def excluded_atoms_num(self) -> int:
         return self.blocks[Flag.EXCLUDED_ATOMS_LIST].shape[0]
@@ -531,7 +1292,7 @@ class Prmtop:
 
     @property
     def extra_points_num(self) -> int:
-        return np.sum(self.blocks[Flag.ATOM_FFTYPE] == "EP  ").item()
+        return self.atoms.extra_points_num
 
     # Boolean flags
     @property
@@ -628,45 +1389,90 @@ class Prmtop:
         )
 
     @classmethod
-    def load(cls, path: Path) -> tpx.Self:
-        r"""Construct from blocks in an Amber '*.prmtop' file"""
-        blocks: tp.Dict[Flag, NDArray[tp.Any]] = {}
+    def load(
+        cls,
+        path: Path,
+        lazy: bool = False,
+        cache: tp.Union[bool, PrmtopCache] = False,
+        compact: bool = False,
+    ) -> tpx.Self:
+        r"""
+        Construct from blocks in an Amber '*.prmtop' file
+
+        If ``lazy=True`` the file is memory-mapped and only an index of the byte
+        offsets of each %FLAG is built. Blocks are decoded the first time they
+        are accessed, and then cached. In this mode only the block sizes are
+        checked against the metadata, and the unused legacy blocks are skipped
+        without checking that they are zero-filled.
+
+        Compressed files (.gz, .xz, .bz2) are decompressed as a stream, and each
+        block is parsed as soon as it has been decompressed. Lazily loaded
+        compressed files are decompressed into memory instead of memory-mapped.
+
+        If ``cache`` is ``True`` or a `PrmtopCache`, the parsed blocks are
+        fetched from (or stored into) an on-disk binary cache. Stale or corrupt
+        entries fall back to parsing the file. ``cache=True`` uses the default
+        cache directory.
+
+        If ``compact=True`` the blocks are stored with compact dtypes: int32
+        for integers, float32 for floats and 4-byte strings ('S4') for labels.
+        The accessors return the same logical values, but floats written back by
+        `Prmtop.dump` only keep float32 precision.
+        """
+        if cache:
+            if lazy:
+                raise ValueError("Lazy loading can't be combined with a cache")
+            if not isinstance(cache, PrmtopCache):
+                cache = PrmtopCache()
+            arrays = cache.get(path)
+            if arrays is not None:
+                obj = cls._from_cache_arrays(arrays)
+            else:
+                # Entries are always stored with full precision
+                obj = cls.load(path)
+                try:
+                    cache.put(path, obj._to_cache_arrays())
+                except OSError as e:
+                    warnings.warn(f"Could not write prmtop cache entry: {e}")
+            if compact:
+                obj.compact_blocks()
+            return obj
+
+        blocks: tp.MutableMapping[Flag, NDArray[tp.Any]] = {}
         cmap_param_comments: tp.Dict[Flag, str] = {}
-        with open(path, mode="r", encoding="utf-8") as f:
-            raw_blocks: tp.Dict[Flag, tp.List[tp.Any]] = defaultdict(list)
-            flag = Flag.NAME
-            fmt = Format.STRING
-            for line in f:
-                if line.startswith("%COMMENT") and flag.value.startswith(
-                    "CMAP_PARAMETER"
-                ):
-                    cmap_param_comments[flag] = line[10:].strip()
-                if (
-                    not line
-                    or line.startswith("%COMMENT")
-                    or line.startswith("%VERSION")
-                ):
-                    continue
-                elif line.startswith("%FLAG"):
-                    flag = Flag(line.split()[-1])
-                elif line.startswith("%FORMAT"):
-                    if flag is Flag.NAME:
-                        # Override this format since it is incorrectly written in
-                        # the prmtops
-                        fmt = Format.STRING
-                    else:
-                        fmt_string = line.split("(")[-1].replace(")", "").strip()
-                        fmt = Format(fmt_string.upper())
+        # VERSION, TITLE and POINTERS are captured in the same scan as the
+        # blocks, so the file is read only once
+        version, date_time = "V0001.000", ""
+        pointers: tp.List[int] = []
+        sections: tp.Dict[Flag, _RawSection] = {}
+        buf: _Buffer = b""
+        for j, (buf, section) in enumerate(_iter_prmtop_sections(path, lazy)):
+            if j == 0:
+                version, date_time = _find_version(buf)
+            if section.comment is not None and section.flag.value.startswith(
+                "CMAP_PARAMETER"
+            ):
+                cmap_param_comments[section.flag] = section.comment
+            if section.flag in (Flag.POINTERS, Flag.NAME):
+                block = _parse_block_data(section.data(buf), section.fmt)
+                if section.flag is Flag.POINTERS:
+                    pointers = block.tolist()
                 else:
-                    if flag is Flag.POINTERS:
-                        continue
-                    raw_blocks[flag].extend(_read_line_with_format(line, fmt))
-
-            blocks = {flag: np.asarray(list_) for flag, list_ in raw_blocks.items()}
+                    name: str = block[0]
+            elif lazy:
+                if section.flag not in _LEGACY_FLAGS:
+                    sections[section.flag] = section
+            else:
+                # Blocks of compressed files are parsed as they are decompressed
+                blocks[section.flag] = _parse_block_data(
+                    section.data(buf), section.fmt, compact
+                )
 
+        if lazy:
+            # All sections of a lazily loaded file share the same buffer
+            blocks = _LazyBlocks(buf, sections, compact)
         _remove_legacy_blocks(blocks)
-        name: str = blocks.pop(Flag.NAME)[0]
-        meta = PrmtopMeta.load(path)
+        meta = PrmtopMeta._from_pointers(pointers, version, date_time)
         obj = cls(
             name=name,
             blocks=blocks,
@@ -679,9 +1485,162 @@ class Prmtop:
             pimd_slices_num=meta.pimd_slices_num,  # Only in POINTERS
         )
         # TODO check internal consistency with box, solv-cap and polarizability
-        obj.check_meta_consistency(meta)
+        if isinstance(blocks, _LazyBlocks):
+            _check_block_sizes(blocks, meta)
+        else:
+            obj.check_meta_consistency(meta)
         return obj
 
+    @tp.overload
+    @classmethod
+    def load_many(  # noqa: E704
+        cls,
+        paths: tp.Iterable[Path],
+        workers: tp.Optional[int] = None,
+        compact: bool = False,
+        return_exceptions: tp.Literal[False] = False,
+    ) -> tp.List[tpx.Self]: ...
+
+    @tp.overload
+    @classmethod
+    def load_many(  # noqa: E704
+        cls,
+        paths: tp.Iterable[Path],
+        workers: tp.Optional[int] = None,
+        compact: bool = False,
+        *,
+        return_exceptions: tp.Literal[True],
+    ) -> tp.List[tp.Union[tpx.Self, Exception]]: ...
+
+    @classmethod
+    def load_many(
+        cls,
+        paths: tp.Iterable[Path],
+        workers: tp.Optional[int] = None,
+        compact: bool = False,
+        return_exceptions: bool = False,
+    ) -> tp.Sequence[tp.Union[tpx.Self, Exception]]:
+        r"""
+        Construct from many Amber '*.prmtop' files, parsed in a process pool
+
+        Identical files (same content hash) are parsed only once, but a separate
+        object is returned for each path. Parsed blocks are sent back from the
+        workers through shared memory. Results are returned in input order.
+
+        If some files can't be loaded a `PrmtopError` that lists all failures
+        is raised. If ``return_exceptions=True`` the exception of each failed
+        file is returned in its place instead. ``workers`` defaults to the
+        number of CPUs, and ``workers=1`` loads all files in this process.
+        """
+        paths = [Path(p) for p in paths]
+        groups = _group_identical_files(paths)
+        workers = min(workers or os.cpu_count() or 1, len(groups))
+        loaded: tp.List[tp.Union[tp.Dict[str, NDArray[tp.Any]], Exception]] = []
+        if workers <= 1:
+            for group in groups:
+                try:
+                    loaded.append(
+                        cls.load(paths[group[0]], compact=compact)._to_cache_arrays()
+                    )
+                except Exception as e:
+                    loaded.append(e)
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [
+                    pool.submit(_load_shared_arrays, paths[group[0]], compact)
+                    for group in groups
+                ]
+                # Every segment must be released, since this process owns them
+                unpacked_num = 0
+                try:
+                    for future in futures:
+                        try:
+                            loaded.append(future.result().unpack())
+                        except Exception as e:
+                            loaded.append(e)
+                        unpacked_num += 1
+                finally:
+                    # Only if interrupted (e.g. by KeyboardInterrupt)
+                    for future in futures[unpacked_num:]:
+                        if future.cancel():
+                            continue
+                        try:
+                            future.result().release()
+                        except Exception:
+                            pass
+
+        results: tp.List[tp.Union[tpx.Self, Exception]] = [
+            PrmtopError("Not loaded")
+        ] * len(paths)
+        for group, arrays in zip(groups, loaded):
+            for j, idx in enumerate(group):
+                if isinstance(arrays, Exception):
+                    results[idx] = arrays
+                    continue
+                # Duplicates get their own copy of the blocks
+                if j > 0:
+                    arrays = {k: v.copy() for k, v in arrays.items()}
+                results[idx] = cls._from_cache_arrays(arrays)
+
+        failed = [(p, r) for p, r in zip(paths, results) if isinstance(r, Exception)]
+        if failed and not return_exceptions:
+            msg = "; ".join(f"{p}: {e!r}" for p, e in failed)
+            raise PrmtopError(f"Could not load {len(failed)} prmtop files: {msg}")
+        return results
+
+    def compact_blocks(self) -> None:
+        r"""
+        Convert all blocks in place to the dtypes used by ``load(compact=True)``
+        """
+        for flag, block in self.blocks.items():
+            self.blocks[flag] = block.astype(
+                _block_dtype(FLAG_FORMAT_MAP[flag], compact=True), copy=False
+            )
+
+    def _to_cache_arrays(self) -> tp.Dict[str, NDArray[tp.Any]]:
+        arrays = {f"block:{flag.value}": block for flag, block in self.blocks.items()}
+        arrays.update(
+            {
+                f"comment:{flag.value}": np.array(comment)
+                for flag, comment in self.cmap_param_comments.items()
+            }
+        )
+        pimd_slices_num = -1 if self.pimd_slices_num is None else self.pimd_slices_num
+        arrays.update(
+            name=np.array(self.name),
+            version=np.array(self.version),
+            # Empty for None, which is distinct from an empty date
+            date_time=np.array([] if self.date_time is None else [self.date_time]),
+            box_kind=np.array(self.box_kind.value),
+            solv_cap_kind=np.array(self.solv_cap_kind.value),
+            pimd_slices_num=np.array(pimd_slices_num),
+        )
+        return arrays
+
+    @classmethod
+    def _from_cache_arrays(cls, arrays: tp.Mapping[str, NDArray[tp.Any]]) -> tpx.Self:
+        blocks: tp.Dict[Flag, NDArray[tp.Any]] = {}
+        cmap_param_comments: tp.Dict[Flag, str] = {}
+        for k, v in arrays.items():
+            kind, _, flag_value = k.partition(":")
+            if kind == "block":
+                blocks[Flag(flag_value)] = v
+            elif kind == "comment":
+                cmap_param_comments[Flag(flag_value)] = str(v)
+        pimd_slices_num = arrays["pimd_slices_num"].item()
+        return cls(
+            name=str(arrays["name"]),
+            version=str(arrays["version"]),
+            date_time=(
+                str(arrays["date_time"][0]) if arrays["date_time"].size else None
+            ),
+            blocks=blocks,
+            box_kind=BoxKind(str(arrays["box_kind"])),
+            solv_cap_kind=SolvCapKind(str(arrays["solv_cap_kind"])),
+            cmap_param_comments=cmap_param_comments,
+            pimd_slices_num=None if pimd_slices_num == -1 else pimd_slices_num,
+        )
+
     def check_meta_consistency(self, meta: PrmtopMeta) -> None:
         if (
             self.version != meta.version
@@ -750,185 +1709,202 @@ class Prmtop:
 
     def dump(
         self,
-        path: Path,
+        path: PathOrStream,
         write_new_date: bool = True,
     ) -> None:
         r"""
         The block order and CMAP_PARAMETER comments are preserved
-        """
-        open(path, "w").close()  # truncate
-        _write_version_and_datetime(
-            path,
-            self.version,
-            date_time=None if write_new_date else self.date_time,
-        )
-        # The flag specifies the format in whih the appended block is written
-        for flag in list(Flag):
-            # These special flags don't come from blocks
-            if flag is Flag.NAME:
-                self._append_block(np.array([self.name]), path, flag)
-            elif flag is Flag.POINTERS:
-                self._append_block(self._create_raw_pointers_block(), path, flag)
-            elif flag is Flag.IPOL:
-                self._append_block(
-                    np.array([self.polarizable_params_kind.prmtop_idx]),
-                    path,
-                    Flag.IPOL,
-                )
 
-            # Unused legacy blocks that must be present
-            elif flag is Flag.ATOM_FFTYPE_LEGACY_SOLTY:
-                self._append_block(self.atoms.fftype_legacy_solty, path, flag)
-            elif flag is Flag.ATOM_LEGACY_GRAPH_JOIN_IDX:
-                self._append_block(self.atoms.legacy_graph_join_idx, path, flag)
-            elif flag is Flag.ATOM_LEGACY_ROTATION_IDX:
-                self._append_block(self.atoms.legacy_rotation_idx, path, flag)
-            elif flag is Flag.ATOM_LEGACY_GRAPH_LABEL:
-                self._append_block(self.atoms.legacy_graph_label, path, flag)
-
-            # Optional flags can be fully ommitted
-            elif flag in OPTIONAL_FLAGS:
-                if flag in self.blocks:
-                    if flag.value.startswith("CMAP_PARAMETER"):
-                        comment = self.cmap_param_comments.get(flag, None)
-                    else:
-                        comment = None
-                    self._append_block(self.blocks[flag], path, flag, comment=comment)
-
-            # All other flags must exist, but may be empty
-            else:
-                # TODO: double check which are actually required
-                self._append_block(self.blocks.get(flag, np.array([])), path, flag)
+        ``path`` may also be a writable text or binary stream, which is not
+        closed. Paths are written atomically, through a temporary file that is
+        renamed when the dump finishes, and are compressed if they have a .gz,
+        .xz or .bz2 suffix.
+        """
+        with text_writer(path) as f:
+            _write_version_and_datetime(
+                f,
+                self.version,
+                date_time=None if write_new_date else self.date_time,
+            )
+            # The flag specifies the format in whih the written block is formatted
+            for flag in list(Flag):
+                # These special flags don't come from blocks
+                if flag is Flag.NAME:
+                    self._write_block(np.array([self.name]), f, flag)
+                elif flag is Flag.POINTERS:
+                    self._write_block(self._create_raw_pointers_block(), f, flag)
+                elif flag is Flag.IPOL:
+                    self._write_block(
+                        np.array([self.polarizable_params_kind.prmtop_idx]),
+                        f,
+                        Flag.IPOL,
+                    )
+
+                # Unused legacy blocks that must be present
+                elif flag is Flag.ATOM_FFTYPE_LEGACY_SOLTY:
+                    self._write_block(self.atoms.fftype_legacy_solty, f, flag)
+                elif flag is Flag.ATOM_LEGACY_GRAPH_JOIN_IDX:
+                    self._write_block(self.atoms.legacy_graph_join_idx, f, flag)
+                elif flag is Flag.ATOM_LEGACY_ROTATION_IDX:
+                    self._write_block(self.atoms.legacy_rotation_idx, f, flag)
+                elif flag is Flag.ATOM_LEGACY_GRAPH_LABEL:
+                    self._write_block(self.atoms.legacy_graph_label, f, flag)
+
+                # Optional flags can be fully ommitted
+                elif flag in OPTIONAL_FLAGS:
+                    if flag in self.blocks:
+                        if flag.value.startswith("CMAP_PARAMETER"):
+                            comment = self.cmap_param_comments.get(flag, None)
+                        else:
+                            comment = None
+                        self._write_block(self.blocks[flag], f, flag, comment=comment)
+
+                # All other flags must exist, but may be empty
+                else:
+                    # TODO: double check which are actually required
+                    self._write_block(self.blocks.get(flag, np.array([])), f, flag)
 
     def add_intra_molecule_bonds(self) -> None:
+        r"""
+        Add zero-strength bonds between all unbonded atom pairs of each molec
+
+        The new bonds use a new fftype with zero force constant and equilibrium
+        distance, and are appended (ordered by atom pair) to the bonds without H
+        """
         current_bonds = self.blocks[Flag.BOND_WITHOUT_HYDROGEN]
         current_h_bonds = self.blocks[Flag.BOND_WITH_HYDROGEN]
-        current_bondconst = self.blocks[Flag.BOND_FFTYPE_FORCE_CONSTANT].tolist()
-        current_bonddist = self.blocks[Flag.BOND_FFTYPE_EQUIL_DISTANCE].tolist()
-        num_bond_types = len(current_bonddist)
+        num_bond_types = self.blocks[Flag.BOND_FFTYPE_EQUIL_DISTANCE].shape[0]
 
-        bonded_atoms = np.concatenate(
-            (current_bonds.reshape(-1, 3)[:, :2], current_h_bonds.reshape(-1, 3)[:, :2])
-        )
-        current_bonds_list = current_bonds.tolist()
-
-        extra_bonds = []
-        offset = 1
-        for num in self.molecs.atoms_num:
-            atom_i, atom_j = np.triu_indices(num.item(), 1)
-            atom_i += offset
-            atom_j += offset
-
-            # Convert to topology idx. Topologies index the values as if they were in an
-            # unravelled array
-            atom_i = 3 * (atom_i - 1)
-            atom_j = 3 * (atom_j - 1)
-
-            for i, j in zip(atom_i, atom_j):
-                in_array = np.all(bonded_atoms == np.array([i, j]), axis=1) | np.all(
-                    bonded_atoms == np.array([j, i]), axis=1
+        # Topologies index the values as if they were in an unravelled array
+        bonded_atoms = (
+            np.concatenate(
+                (
+                    current_bonds.reshape(-1, 3)[:, :2],
+                    current_h_bonds.reshape(-1, 3)[:, :2],
                 )
-                if not np.any(in_array):
-                    extra_bonds.extend([i, j, num_bond_types + 1])
-            offset += num.item()
-
-        current_bonds_list.extend(extra_bonds)
-        current_bondconst.append(0.0)
-        current_bonddist.append(0.0)
-        self.blocks[Flag.BOND_WITHOUT_HYDROGEN] = np.array(current_bonds_list)
-        self.blocks[Flag.BOND_FFTYPE_FORCE_CONSTANT] = np.array(current_bondconst)
-        self.blocks[Flag.BOND_FFTYPE_EQUIL_DISTANCE] = np.array(current_bonddist)
+            )
+            // 3
+        )
+        atoms_num = self.atoms.num
+        bonded_keys = np.min(bonded_atoms, axis=1).astype(
+            np.int64
+        ) * atoms_num + np.max(bonded_atoms, axis=1)
+        # Keys of the pairs are sorted in the same order as (molec, i, j)
+        pair_keys = _intra_molecule_pair_keys(self.molecs.atoms_num, atoms_num)
+        extra_keys = pair_keys[~np.isin(pair_keys, bonded_keys)]
+        extra_bonds = np.column_stack(
+            (
+                3 * (extra_keys // atoms_num),
+                3 * (extra_keys % atoms_num),
+                np.full_like(extra_keys, num_bond_types + 1),
+            )
+        )
+        self.blocks[Flag.BOND_WITHOUT_HYDROGEN] = np.concatenate(
+            (current_bonds, extra_bonds.ravel())
+        )
+        for flag in (
+            Flag.BOND_FFTYPE_FORCE_CONSTANT,
+            Flag.BOND_FFTYPE_EQUIL_DISTANCE,
+        ):
+            self.blocks[flag] = np.append(self.blocks[flag], 0.0)
 
     @staticmethod
-    def _append_block(
+    def _write_block(
         data: tp.Iterable[tp.Any],
-        path: Path,
+        f: tp.TextIO,
         flag: Flag,
         comment: tp.Optional[str] = None,
     ) -> None:
-        with open(path, mode="a", encoding="utf-8") as f:
-            # Left justification and padding needed to pedantically match leap
-            f.write("".join((f"%FLAG {flag.value}".ljust(80), "\n")))
-            if comment is not None:
-                f.write("".join((f"%COMMENT  {comment}".ljust(80), "\n")))
-            # Replace uppercase format with lowercase to pedantically match leap
-            fmt_str = FLAG_FORMAT_MAP[flag].value
-            fmt_str = fmt_str.replace("20A4", "20a4").replace("1A80", "1a80")
-            f.write("".join((f"%FORMAT({fmt_str})".ljust(80), "\n")))
-            fmt = FLAG_FORMAT_MAP[flag]
-            if fmt in LARGE_INTEGER_FORMATS:
-                num_per_line = 10
-                width = 8
-                specifier = "d"
-                decimals = ""
-                align = ">"
-            elif fmt is Format.CMAP_FLOAT_ARRAY:
-                num_per_line = 8
-                width = 9
-                decimals = ".5"
-                specifier = "f"
-                align = ">"
-            elif fmt is Format.SMALL_INT_ARRAY:
-                num_per_line = 20
-                width = 4
-                specifier = "d"
-                decimals = ""
-                align = ">"
-            elif fmt is Format.SIX_INTEGERS_ARRAY:
-                num_per_line = 6
-                width = 8
-                specifier = "d"
-                decimals = ""
-                align = ">"
-            elif fmt in LARGE_FLOAT_FORMATS:
-                num_per_line = 5
-                width = 16
-                specifier = "E"
-                decimals = ".8"
-                align = ">"
-            elif fmt is Format.SMALL_STRING_ARRAY:
-                num_per_line = 20
-                width = 4
-                specifier = "s"
-                decimals = ""
-                align = "<"
-            elif (fmt is Format.STRING) or (flag is Flag.NAME):
-                num_per_line = 1
-                width = 80
-                specifier = "s"
-                decimals = ""
-                align = "<"
-            line = [format(i, f"{align}{width}{decimals}{specifier}") for i in data]
-            if len(line) % num_per_line:
-                extra_data = (num_per_line - len(line) % num_per_line) * [" " * width]
-                line.extend(extra_data)
-            array: NDArray[np.str_] = np.array(line, dtype=np.str_).reshape(
-                -1, num_per_line
-            )
-            for j, row in enumerate(array):
-                str_line = "".join(row)
-                if j == array.shape[0] - 1:
-                    str_line = str_line.rstrip()
-                    if fmt is Format.SMALL_STRING_ARRAY and len(str_line) % 4:
-                        # Reintroduce right pad
-                        str_line = "".join((str_line, " " * (4 - len(str_line) % 4)))
-                    # Reproduce leap quirks
-                    elif fmt is Format.STRING or flag in (Flag.CMAP_COUNT, Flag.NAME):
-                        str_line = str_line.ljust(80)
-                f.write("".join((str_line, "\n")))
-
-            # Empty block
-            if array.shape[0] == 0:
-                f.write("\n")
-
-
-def _remove_legacy_blocks(blocks: tp.Dict[Flag, NDArray[tp.Any]]) -> None:
-    # Unused, if present must be filled with zeros
-    for flag in (
-        Flag.ATOM_FFTYPE_LEGACY_SOLTY,
-        Flag.ATOM_LEGACY_GRAPH_JOIN_IDX,
-        Flag.ATOM_LEGACY_ROTATION_IDX,
-    ):
+        # Left justification and padding needed to pedantically match leap
+        parts = ["".join((f"%FLAG {flag.value}".ljust(80), "\n"))]
+        if comment is not None:
+            parts.append("".join((f"%COMMENT  {comment}".ljust(80), "\n")))
+        # Replace uppercase format with lowercase to pedantically match leap
+        fmt_str = FLAG_FORMAT_MAP[flag].value
+        fmt_str = fmt_str.replace("20A4", "20a4").replace("1A80", "1a80")
+        parts.append("".join((f"%FORMAT({fmt_str})".ljust(80), "\n")))
+        parts.extend(_format_block_data(data, flag))
+        f.write("".join(parts))
+
+
+# Printf-style specifier of each field, used by the prmtop writer
+_FORMAT_FIELD_SPEC: tp.Dict[Format, str] = {
+    Format.INT_ARRAY: "%8d",
+    Format.ONE_INTEGER: "%8d",
+    Format.TWO_INTEGERS: "%8d",
+    Format.THREE_INTEGERS: "%8d",
+    Format.SIX_INTEGERS_ARRAY: "%8d",
+    Format.SMALL_INT_ARRAY: "%4d",
+    Format.STRING: "%-80s",
+    Format.SMALL_STRING_ARRAY: "%-4s",
+    Format.FLOAT_ARRAY: "%16.8E",
+    Format.ONE_FLOAT: "%16.8E",
+    Format.CMAP_FLOAT_ARRAY: "%9.5f",
+}
+
+_INTEGER_FORMATS = LARGE_INTEGER_FORMATS | {
+    Format.SMALL_INT_ARRAY,
+    Format.SIX_INTEGERS_ARRAY,
+}
+
+# Max number of lines formatted by a single printf-style operation
+_FORMAT_CHUNK_LINES = 65536
+
+
+def _format_block_data(data: tp.Iterable[tp.Any], flag: Flag) -> tp.List[str]:
+    r"""
+    Format the data lines of a block
+
+    Full lines are formatted in bulk, with a single printf-style operation per
+    chunk of lines. The last line reproduces the leap quirks.
+    """
+    fmt = FLAG_FORMAT_MAP[flag]
+    arr = np.asarray(data)
+    if arr.dtype.kind == "S":
+        arr = arr.astype(np.str_)
+    values = arr.tolist()
+    if not values:
+        # Empty block
+        return ["\n"]
+    # Printf-style int specs would silently truncate floats
+    if fmt in _INTEGER_FORMATS and arr.dtype.kind not in "iu":
+        raise PrmtopError(
+            f"Block {flag.value} must have integer values, got dtype {arr.dtype}"
+        )
+    num_per_line = _FORMAT_LAYOUT[fmt][0]
+    spec = _FORMAT_FIELD_SPEC[fmt]
+    last_num = len(values) % num_per_line or num_per_line
+    full_lines_num = (len(values) - last_num) // num_per_line
+
+    parts = []
+    line_spec = "".join((spec * num_per_line, "\n"))
+    for j in range(0, full_lines_num, _FORMAT_CHUNK_LINES):
+        lines_num = min(_FORMAT_CHUNK_LINES, full_lines_num - j)
+        start = j * num_per_line
+        chunk = values[start : start + lines_num * num_per_line]  # noqa
+        parts.append((line_spec * lines_num) % tuple(chunk))
+
+    str_line = ((spec * last_num) % tuple(values[-last_num:])).rstrip()
+    if fmt is Format.SMALL_STRING_ARRAY and len(str_line) % 4:
+        # Reintroduce right pad
+        str_line = "".join((str_line, " " * (4 - len(str_line) % 4)))
+    # Reproduce leap quirks
+    elif fmt is Format.STRING or flag in (Flag.CMAP_COUNT, Flag.NAME):
+        str_line = str_line.ljust(80)
+    parts.append("".join((str_line, "\n")))
+    return parts
+
+
+# Unused, if present must be filled with zeros
+_LEGACY_FLAGS = (
+    Flag.ATOM_FFTYPE_LEGACY_SOLTY,
+    Flag.ATOM_LEGACY_GRAPH_JOIN_IDX,
+    Flag.ATOM_LEGACY_ROTATION_IDX,
+)
+
+
+def _remove_legacy_blocks(blocks: tp.MutableMapping[Flag, NDArray[tp.Any]]) -> None:
+    for flag in _LEGACY_FLAGS:
         if flag in blocks:
             block = blocks.pop(flag)
             if (block != 0).any():
@@ -947,33 +1923,40 @@ def load_single_raw_prmtop_block(prmtop: Path, flag: Flag) -> tp.List[tp.Any]:
     Prmtop information is separated into blocks, which are delimited by "flags"
     Read one of these in a raw format and don't perform any extra post-processing.
     """
-    in_block = False
-    block = []
-    with open(prmtop, mode="r", encoding="utf-8") as f:
-        for line in f:
-            if (
-                not line
-                or line.startswith("%COMMENT")
-                or line.startswith("%VERSION")
-                or line.startswith("%FORMAT")
-            ):
-                continue
-            elif line.startswith("%FLAG"):
-                current_flag = Flag(line.split()[-1])
-                if current_flag is not flag:
-                    if in_block:
-                        break
-                    else:
-                        continue
-                else:
-                    in_block = True
-            elif in_block:
-                block.extend(_read_line_with_format(line, FLAG_FORMAT_MAP[flag]))
-        return block
+    if is_compressed(prmtop):
+        with open_binary_reader(prmtop) as f:
+            _, found = _find_stream_section(f, flag)
+        if found is None:
+            return []
+        buf, stream_section = found
+        block = _parse_block_data(stream_section.data(buf), FLAG_FORMAT_MAP[flag])
+        return block.tolist()
+
+    with open(prmtop, mode="rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            section = _find_section(mm, flag)
+            if section is None:
+                return []
+            return _parse_block_data(section.data(mm), FLAG_FORMAT_MAP[flag]).tolist()
+
+
+def _parse_version_line(line: str) -> tp.Tuple[str, str]:
+    parts = line.split()[1:]
+    return parts[2], f"{parts[5]}  {parts[6]}"
+
+
+def _find_version(buf: _Buffer) -> tp.Tuple[str, str]:
+    r"""Find the version and date in the %VERSION line that precedes the blocks"""
+    start = buf.find(b"%VERSION", 0, max(buf.find(b"%FLAG"), 0))
+    if start == -1:
+        return "V0001.000", ""
+    end = buf.find(b"\n", start)
+    end = len(buf) if end == -1 else end
+    return _parse_version_line(buf[start:end].decode("utf-8"))
 
 
 def _read_line_with_format(line: str, format_: Format) -> tp.List[tp.Any]:
-    line = line[:-1].rstrip()
+    line = line.rstrip()
     parsed_line: tp.List[tp.Any] = []
     if not line:
         return parsed_line
@@ -996,21 +1979,547 @@ def _read_line_with_format(line: str, format_: Format) -> tp.List[tp.Any]:
     return parsed_line
 
 
+# Fields per line and field width of each fixed-width format
+_FORMAT_LAYOUT: tp.Dict[Format, tp.Tuple[int, int]] = {
+    Format.INT_ARRAY: (10, 8),
+    Format.ONE_INTEGER: (1, 8),
+    Format.TWO_INTEGERS: (2, 8),
+    Format.THREE_INTEGERS: (3, 8),
+    Format.SIX_INTEGERS_ARRAY: (6, 8),
+    Format.SMALL_INT_ARRAY: (20, 4),
+    Format.STRING: (1, 80),
+    Format.SMALL_STRING_ARRAY: (20, 4),
+    Format.FLOAT_ARRAY: (5, 16),
+    Format.ONE_FLOAT: (1, 16),
+    Format.CMAP_FLOAT_ARRAY: (8, 9),
+}
+
+
+@dataclass
+class _RawSection:
+    flag: Flag
+    fmt: Format
+    comment: tp.Optional[str]
+    # Byte offsets of the data lines in the buffer
+    start: int
+    end: int
+
+    def data(self, buf: _Buffer) -> bytes:
+        return buf[self.start : self.end]  # noqa
+
+
+def _iter_raw_sections(buf: _Buffer) -> tp.Iterator[_RawSection]:
+    r"""
+    Split the raw bytes of a prmtop file into its %FLAG sections
+
+    The %FLAG, %FORMAT and %COMMENT header lines of each section are decoded,
+    only the byte offsets of the data lines are returned.
+    """
+    start = buf.find(b"%FLAG")
+    while start != -1:
+        end = buf.find(b"\n%FLAG", start)
+        end = len(buf) if end == -1 else end + 1
+        flag = Flag.NAME
+        fmt = Format.STRING
+        comment: tp.Optional[str] = None
+        pos = start
+        while pos < end and buf[pos : pos + 1] == b"%":  # noqa
+            eol = buf.find(b"\n", pos, end)
+            eol = end if eol == -1 else eol
+            line = buf[pos:eol].decode("utf-8")
+            if line.startswith("%FLAG"):
+                flag = Flag(line.split()[-1])
+            elif line.startswith("%FORMAT"):
+                # The TITLE format is incorrectly written in the prmtops
+                if flag is not Flag.NAME:
+                    fmt_string = line.split("(")[-1].replace(")", "").strip()
+                    fmt = Format(fmt_string.upper())
+            elif line.startswith("%COMMENT"):
+                comment = line[10:].strip()
+            pos = eol + 1
+        yield _RawSection(flag, fmt, comment, min(pos, end), end)
+        start = -1 if end == len(buf) else end
+
+
+class _LazyBlocks(tp.MutableMapping[Flag, NDArray[tp.Any]]):
+    r"""
+    Mapping of blocks that are decoded from a prmtop buffer on first access
+
+    The buffer (usually a memory-mapped file) is indexed by the byte offsets of
+    its sections. Each block is parsed the first time it is accessed, and the
+    parsed array replaces the section in the mapping.
+    """
+
+    def __init__(
+        self,
+        buf: _Buffer,
+        sections: tp.Dict[Flag, _RawSection],
+        compact: bool = False,
+    ) -> None:
+        self._buf = buf
+        self._compact = compact
+        self._entries: tp.Dict[Flag, tp.Union[NDArray[tp.Any], _RawSection]]
+        self._entries = dict(sections)
+
+    def __getitem__(self, flag: Flag) -> NDArray[tp.Any]:
+        entry = self._entries[flag]
+        if isinstance(entry, _RawSection):
+            entry = _parse_block_data(entry.data(self._buf), entry.fmt, self._compact)
+            self._entries[flag] = entry
+        return entry
+
+    def __setitem__(self, flag: Flag, block: NDArray[tp.Any]) -> None:
+        self._entries[flag] = block
+
+    def __delitem__(self, flag: Flag) -> None:
+        del self._entries[flag]
+
+    def __contains__(self, flag: object) -> bool:
+        return flag in self._entries
+
+    def __iter__(self) -> tp.Iterator[Flag]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_decoded(self, flag: Flag) -> bool:
+        return not isinstance(self._entries[flag], _RawSection)
+
+    def block_size(self, flag: Flag) -> int:
+        r"""Number of values in a block, without decoding it if possible"""
+        entry = self._entries[flag]
+        if isinstance(entry, _RawSection):
+            return _block_size(entry.data(self._buf), entry.fmt)
+        return entry.shape[0]
+
+
+def _load_shared_arrays(path: Path, compact: bool) -> SharedArrays:
+    # Runs in the workers of Prmtop.load_many
+    return SharedArrays.pack(Prmtop.load(path, compact=compact)._to_cache_arrays())
+
+
+def _group_identical_files(paths: tp.Sequence[Path]) -> tp.List[tp.List[int]]:
+    r"""
+    Indices of the paths grouped by file content, sorted by their first index
+
+    Only files with the same size are hashed. Files that can't be read are
+    left in their own group, so that loading them reports the error.
+    """
+    groups: tp.List[tp.List[int]] = []
+    by_size: tp.Dict[int, tp.List[int]] = {}
+    for j, path in enumerate(paths):
+        try:
+            by_size.setdefault(path.stat().st_size, []).append(j)
+        except OSError:
+            groups.append([j])
+    for idxs in by_size.values():
+        if len(idxs) == 1:
+            groups.append(idxs)
+            continue
+        by_digest: tp.Dict[str, tp.List[int]] = {}
+        for j in idxs:
+            try:
+                by_digest.setdefault(file_digest(paths[j]), []).append(j)
+            except OSError:
+                groups.append([j])
+        groups.extend(by_digest.values())
+    return sorted(groups)
+
+
+def _set_exclusion_blocks(
+    blocks: tp.MutableMapping[Flag, NDArray[tp.Any]],
+    pairs: NDArray[np.int64],
+    atoms_num: int,
+) -> None:
+    r"""
+    Set NUMBER_EXCLUDED_ATOMS and EXCLUDED_ATOMS_LIST from 0-based (i, j) pairs
+
+    Pairs must be grouped by increasing i. Atoms without pairs get a single
+    placeholder 0, as in leap.
+    """
+    counts = np.bincount(pairs[:, 0], minlength=atoms_num)
+    counts_with_placeholders = np.maximum(counts, 1)
+    offsets = np.cumsum(counts_with_placeholders) - counts_with_placeholders
+    # Pairs are grouped by i, so their rank inside each row is known
+    rank = np.arange(pairs.shape[0]) - (np.cumsum(counts) - counts)[pairs[:, 0]]
+    excluded = np.zeros(counts_with_placeholders.sum(), dtype=np.int64)
+    excluded[offsets[pairs[:, 0]] + rank] = pairs[:, 1] + 1
+    for flag, block in (
+        (Flag.NUMBER_EXCLUDED_ATOMS, counts_with_placeholders),
+        (Flag.EXCLUDED_ATOMS_LIST, excluded),
+    ):
+        dtype = blocks[flag].dtype if flag in blocks else np.int64
+        blocks[flag] = block.astype(dtype)
+
+
+# Atom-sized blocks
+_ATOM_FLAGS = (
+    Flag.ATOM_LABEL,
+    Flag.ATOM_CHARGE,
+    Flag.ATOM_ZNUM,
+    Flag.ATOM_MASS,
+    Flag.ATOM_LJINDEX,
+    Flag.ATOM_FFTYPE,
+    Flag.ATOM_LEGACY_GRAPH_LABEL,
+    Flag.ATOM_IMPLSV_RADII,
+    Flag.ATOM_IMPLSV_SCREEN,
+    Flag.ATOM_POLARIZABILITY,
+    Flag.DIPOLE_DAMP,
+)
+
+# Atoms per term, blocks of the terms with and without H, and blocks of the fftypes
+_INTERACTION_FLAGS = (
+    (
+        2,
+        (Flag.BOND_WITH_HYDROGEN, Flag.BOND_WITHOUT_HYDROGEN),
+        (Flag.BOND_FFTYPE_FORCE_CONSTANT, Flag.BOND_FFTYPE_EQUIL_DISTANCE),
+    ),
+    (
+        3,
+        (Flag.ANGLE_WITH_HYDROGEN, Flag.ANGLE_WITHOUT_HYDROGEN),
+        (Flag.ANGLE_FFTYPE_FORCE_CONSTANT, Flag.ANGLE_FFTYPE_EQUIL_ANGLE),
+    ),
+    (
+        4,
+        (Flag.DIHEDRAL_WITH_HYDROGEN, Flag.DIHEDRAL_WITHOUT_HYDROGEN),
+        (
+            Flag.DIHEDRAL_FFTYPE_FORCE_CONSTANT,
+            Flag.DIHEDRAL_FFTYPE_PERIODICITY,
+            Flag.DIHEDRAL_FFTYPE_PHASE,
+            Flag.DIHEDRAL_FFTYPE_ELECTRO_ENDS_SCREEN,
+            Flag.DIHEDRAL_FFTYPE_LJ_ENDS_SCREEN,
+        ),
+    ),
+)
+
+
+def _used_types(
+    types_idx1: NDArray[np.int64], types_num: int
+) -> tp.Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    r"""
+    0-based idxs of the used types, and new 1-based idx of each old 1-based idx
+    """
+    is_used = np.bincount(types_idx1, minlength=types_num + 1)[1:] > 0
+    new_idx1 = np.zeros(types_num + 1, dtype=np.int64)
+    new_idx1[1:] = np.cumsum(is_used)
+    return np.flatnonzero(is_used), new_idx1
+
+
+def _subset_interactions(
+    blocks: tp.MutableMapping[Flag, NDArray[tp.Any]],
+    atoms_num: int,
+    flags: tp.Tuple[Flag, Flag],
+    fftype_flags: tp.Tuple[Flag, ...],
+    new_idx: NDArray[np.int64],
+) -> None:
+    # Raw tables store 3x the 0-based atom idxs, and the sign of the 3rd and 4th
+    # atoms of dihedrals flags impropers and skipped 1-4 terms
+    tables = []
+    for flag in flags:
+        table = blocks.get(flag, np.zeros(0, dtype=np.int64))
+        table = table.reshape(-1, atoms_num + 1).astype(np.int64)
+        atoms = new_idx[np.abs(table[:, :-1]) // 3]
+        is_kept = (atoms >= 0).all(axis=1)
+        table, atoms = table[is_kept], atoms[is_kept]
+        sign = np.where(table[:, :-1] < 0, -1, 1)
+        if atoms_num == 4:
+            # Negative idxs can't flag atom 0, so those dihedrals are reversed
+            to_reverse = (atoms[:, 2:] == 0).any(axis=1) & (sign[:, 2:] < 0).any(axis=1)
+            atoms[to_reverse] = atoms[to_reverse, ::-1]
+        table[:, :-1] = 3 * atoms * sign
+        tables.append(table)
+
+    fftypes_num = blocks[fftype_flags[0]].shape[0]
+    used, new_idx1 = _used_types(
+        np.concatenate([t[:, -1] for t in tables]), fftypes_num
+    )
+    for flag, table in zip(flags, tables):
+        table[:, -1] = new_idx1[table[:, -1]]
+        dtype = blocks[flag].dtype if flag in blocks else np.int64
+        blocks[flag] = table.ravel().astype(dtype)
+    for flag in fftype_flags:
+        blocks[flag] = blocks[flag][used]
+
+
+def _subset_cmap(
+    blocks: tp.MutableMapping[Flag, NDArray[tp.Any]],
+    new_idx: NDArray[np.int64],
+    comments: tp.Mapping[Flag, str],
+) -> tp.Dict[Flag, str]:
+    r"""Subset the CMAP blocks, and return the comments of the kept CMAP types"""
+    table = blocks[Flag.CMAP_INDEX].reshape(-1, 6).astype(np.int64)
+    atoms = new_idx[table[:, :5] - 1]
+    is_kept = (atoms >= 0).all(axis=1)
+    table = np.column_stack((atoms[is_kept] + 1, table[is_kept, 5]))
+    types_num = int(blocks[Flag.CMAP_COUNT][1])
+    used, new_idx1 = _used_types(table[:, 5], types_num)
+    table[:, 5] = new_idx1[table[:, 5]]
+
+    params = {
+        j: blocks.pop(Flag(f"CMAP_PARAMETER_{j + 1:02d}")) for j in range(types_num)
+    }
+    new_comments: tp.Dict[Flag, str] = {}
+    if not table.size:
+        for flag in (Flag.CMAP_COUNT, Flag.CMAP_RESOLUTION, Flag.CMAP_INDEX):
+            blocks.pop(flag, None)
+        return new_comments
+    for new, old in enumerate(used.tolist()):
+        flag = Flag(f"CMAP_PARAMETER_{new + 1:02d}")
+        blocks[flag] = params[old]
+        old_flag = Flag(f"CMAP_PARAMETER_{old + 1:02d}")
+        if old_flag in comments:
+            new_comments[flag] = comments[old_flag]
+    blocks[Flag.CMAP_COUNT] = np.array(
+        [table.shape[0], used.shape[0]], dtype=blocks[Flag.CMAP_COUNT].dtype
+    )
+    blocks[Flag.CMAP_INDEX] = table.ravel().astype(blocks[Flag.CMAP_INDEX].dtype)
+    return new_comments
+
+
+def _subset_lj_types(
+    blocks: tp.MutableMapping[Flag, NDArray[tp.Any]], ljindex_num: int
+) -> None:
+    # Blocks must already have the ATOM_LJINDEX of the kept atoms
+    ljindex = blocks[Flag.ATOM_LJINDEX].astype(np.int64)
+    used, new_idx1 = _used_types(ljindex, ljindex_num)
+    blocks[Flag.ATOM_LJINDEX] = new_idx1[ljindex].astype(
+        blocks[Flag.ATOM_LJINDEX].dtype
+    )
+    param_idx = blocks[Flag.LJ_PARAM_INDEX].reshape(ljindex_num, ljindex_num)
+    param_idx = param_idx[np.ix_(used, used)].astype(np.int64)
+    # Pairs that use the hbond coefs (negative idxs) are left as they are
+    is_lj = param_idx > 0
+    used_coefs = np.unique(param_idx[is_lj])
+    param_idx[is_lj] = np.searchsorted(used_coefs, param_idx[is_lj]) + 1
+    blocks[Flag.LJ_PARAM_INDEX] = param_idx.ravel().astype(
+        blocks[Flag.LJ_PARAM_INDEX].dtype
+    )
+    for flag in (Flag.LJ_PARAM_A, Flag.LJ_PARAM_B, Flag.LJ_PARAM_C):
+        if flag in blocks:
+            blocks[flag] = blocks[flag][used_coefs - 1]
+
+
+def _intra_molecule_pair_keys(
+    molecs_atoms_num: NDArray[np.int64],
+    atoms_num: int,
+) -> NDArray[np.int64]:
+    r"""
+    Sorted ``i * atoms_num + j`` keys of all pairs i < j of atoms in the same molec
+
+    Molecs are consecutive ranges of atoms. Pairs are generated once for each
+    distinct molec size, and shifted to the first atom of each molec.
+    """
+    first_atoms = np.cumsum(molecs_atoms_num) - molecs_atoms_num
+    keys = [np.zeros(0, dtype=np.int64)]
+    for size in np.unique(molecs_atoms_num):
+        i, j = np.triu_indices(size, 1)
+        first = first_atoms[molecs_atoms_num == size].astype(np.int64)[:, None]
+        keys.append(((first + i) * atoms_num + (first + j)).ravel())
+    return np.sort(np.concatenate(keys))
+
+
+def _check_block_sizes(blocks: _LazyBlocks, meta: PrmtopMeta) -> None:
+    # Only the sizes implied by POINTERS are checked, to avoid decoding blocks
+    expect_sizes = {
+        Flag.ATOM_ZNUM: meta.atoms_num,
+        Flag.LJ_PARAM_INDEX: meta.atom_ljindex_num**2,
+        Flag.RESIDUE_LABEL: meta.resids_num,
+        Flag.EXCLUDED_ATOMS_LIST: meta.excluded_atoms_num,
+        Flag.BOND_WITH_HYDROGEN: 3 * meta.bond_with_hydrogen_num,
+        Flag.BOND_WITHOUT_HYDROGEN: 3 * meta.bond_without_hydrogen_num,
+        Flag.ANGLE_WITH_HYDROGEN: 4 * meta.angle_with_hydrogen_num,
+        Flag.ANGLE_WITHOUT_HYDROGEN: 4 * meta.angle_without_hydrogen_num,
+        Flag.DIHEDRAL_WITH_HYDROGEN: 5 * meta.dihedral_with_hydrogen_num,
+        Flag.DIHEDRAL_WITHOUT_HYDROGEN: 5 * meta.dihedral_without_hydrogen_num,
+        Flag.BOND_FFTYPE_FORCE_CONSTANT: meta.bond_fftype_num,
+        Flag.ANGLE_FFTYPE_FORCE_CONSTANT: meta.angle_fftype_num,
+        Flag.DIHEDRAL_FFTYPE_FORCE_CONSTANT: meta.dihedral_fftype_num,
+    }
+    for flag, size in expect_sizes.items():
+        if (blocks.block_size(flag) if flag in blocks else 0) != size:
+            raise PrmtopError("Prmtop is inconsistent with metadata")
+
+
+def _find_section(buf: _Buffer, flag: Flag) -> tp.Optional[_RawSection]:
+    for section in _iter_raw_sections(buf):
+        if section.flag is flag:
+            return section
+    return None
+
+
+def _iter_stream_sections(
+    f: tp.BinaryIO,
+    chunk_size: int = _STREAM_CHUNK_SIZE,
+) -> tp.Iterator[tp.Tuple[bytes, _RawSection]]:
+    r"""
+    Read a binary stream in chunks and split it into its %FLAG sections
+
+    Each section is yielded together with the buffer it indexes into, as soon
+    as the section is complete (i.e. the next %FLAG has been read). The first
+    buffer yielded starts at the beginning of the stream.
+    """
+    pending: tp.List[bytes] = []
+    while True:
+        chunk = f.read(chunk_size)
+        if chunk:
+            # Section boundaries can only be in the new chunk, or straddle it
+            window = b"".join((pending[-1][-5:] if pending else b"", chunk))
+            if window.find(b"\n%FLAG") == -1:
+                pending.append(chunk)
+                continue
+        buf = b"".join((*pending, chunk))
+        cut = buf.rfind(b"\n%FLAG") + 1 if chunk else len(buf)
+        head = buf[:cut]
+        pending = [buf[cut:]]
+        for section in _iter_raw_sections(head):
+            yield head, section
+        if not chunk:
+            return
+
+
+def _find_stream_section(
+    f: tp.BinaryIO,
+    flag: Flag,
+) -> tp.Tuple[tp.Tuple[str, str], tp.Optional[tp.Tuple[bytes, _RawSection]]]:
+    r"""
+    Find the version and date, and the section of a flag in a stream
+
+    Reading stops as soon as the section is found.
+    """
+    version_and_date = ("V0001.000", "")
+    for j, (buf, section) in enumerate(_iter_stream_sections(f, _META_PREFIX_SIZE)):
+        if j == 0:
+            version_and_date = _find_version(buf)
+        if section.flag is flag:
+            return version_and_date, (buf, section)
+    return version_and_date, None
+
+
+def _iter_prmtop_sections(
+    path: Path,
+    lazy: bool = False,
+) -> tp.Iterator[tp.Tuple[_Buffer, _RawSection]]:
+    r"""
+    Iterate over the sections of a prmtop file, together with their buffer
+
+    Plain files are read into memory, or memory-mapped if ``lazy=True``.
+    Compressed files are decompressed as a stream, or fully into memory if
+    ``lazy=True``.
+    """
+    buf: _Buffer
+    if is_compressed(path):
+        with open_binary_reader(path) as f:
+            if not lazy:
+                yield from _iter_stream_sections(f)
+                return
+            buf = f.read()
+    else:
+        with open(path, mode="rb") as f:
+            if lazy:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+    for section in _iter_raw_sections(buf):
+        yield buf, section
+
+
+def _split_fixed_width(data: bytes, fmt: Format) -> tp.Optional[tp.Tuple[int, bytes]]:
+    r"""
+    Locate the last line of a block that follows the fixed-width layout
+
+    Returns the offset where the last line starts and the last line with its
+    right pad reintroduced, or None if any other line is not full-width.
+    """
+    fields_num, width = _FORMAT_LAYOUT[fmt]
+    last_start = data.rfind(b"\n", 0, len(data) - 1) + 1
+    full_lines_num = data.count(b"\n", 0, last_start)
+    if last_start - full_lines_num != full_lines_num * fields_num * width:
+        return None
+    last = data[last_start:].rstrip()
+    return last_start, last.ljust(-(-len(last) // width) * width)
+
+
+def _block_size(data: bytes, fmt: Format) -> int:
+    r"""Number of values in the data lines of a block, without parsing them"""
+    if fmt is not Format.STRING:
+        split = _split_fixed_width(data, fmt)
+        if split is not None:
+            last_start, last = split
+            fields_num, width = _FORMAT_LAYOUT[fmt]
+            lines_num = data.count(b"\n", 0, last_start)
+            return lines_num * fields_num + len(last) // width
+    return _parse_block_data(data, fmt).shape[0]
+
+
+def _block_dtype(fmt: Format, compact: bool = False) -> np.dtype[tp.Any]:
+    r"""
+    Dtype of the parsed blocks with a given format
+
+    Compact dtypes hold the same values, since labels are ascii, 'I8' and 'I4'
+    integers fit in int32, and the float formats have at most float32 precision.
+    """
+    if fmt is Format.STRING:
+        return np.dtype(np.str_)
+    if fmt is Format.SMALL_STRING_ARRAY:
+        return np.dtype("S4" if compact else np.str_)
+    if fmt in (Format.CMAP_FLOAT_ARRAY, *LARGE_FLOAT_FORMATS):
+        return np.dtype(np.float32 if compact else np.float64)
+    return np.dtype(np.int32 if compact else np.int64)
+
+
+def _as_str(block: NDArray[tp.Any]) -> NDArray[np.str_]:
+    r"""Decode labels stored as bytes by compact blocks"""
+    if block.dtype.kind == "S":
+        return block.astype(np.str_)
+    return block
+
+
+def _parse_block_data(
+    data: bytes,
+    fmt: Format,
+    compact: bool = False,
+) -> NDArray[tp.Any]:
+    r"""
+    Parse all data lines of a block in one step
+
+    The full-width lines are concatenated and reinterpreted as an array of
+    fixed-width fields, which NumPy converts in bulk. Only the last line of a
+    block may be shorter than the full width, blocks that don't follow this
+    layout are parsed line by line.
+    """
+    if fmt is Format.STRING:
+        lines = (line.rstrip() for line in data.decode("utf-8").split("\n"))
+        return np.array([line for line in lines if line], dtype=np.str_)
+
+    dtype = _block_dtype(fmt, compact)
+    split = _split_fixed_width(data, fmt)
+    if split is None:
+        parsed = []
+        for line in data.decode("utf-8").splitlines():
+            parsed.extend(_read_line_with_format(line, fmt))
+        return np.array(parsed, dtype=dtype)
+
+    last_start, last = split
+    fields = np.frombuffer(
+        b"".join((data[:last_start].replace(b"\n", b""), last)),
+        dtype=f"S{_FORMAT_LAYOUT[fmt][1]}",
+    )
+    return fields.astype(dtype)
+
+
 def _write_version_and_datetime(
-    prmtop: Path,
+    f: tp.TextIO,
     version: str,
     date_time: tp.Optional[str] = None,
 ) -> None:
     if date_time is None:
         date_time = datetime.datetime.today().strftime("%m/%d/%y  %H:%M:%S")
-    with open(prmtop, "a", encoding="utf-8") as f:
-        f.write(
-            "".join(
-                (
-                    f"%VERSION  VERSION_STAMP = {version}  DATE = {date_time}".ljust(
-                        80
-                    ),
-                    "\n",
-                )
+    f.write(
+        "".join(
+            (
+                f"%VERSION  VERSION_STAMP = {version}  DATE = {date_time}".ljust(80),
+                "\n",
             )
         )
+    )
@@ -41,8 +41,8 @@ class Flag(Enum):
     DIHEDRAL_FFTYPE_LJ_ENDS_SCREEN = "SCNB_SCALE_FACTOR"  # Ends = 1-4 atoms
     ATOM_FFTYPE_LEGACY_SOLTY = "SOLTY"  # Unused, zeros, fftype-sized
     # Lennard Jones parameters
-    # lj_param_idx[i, j]
-    #  = lj_param_idx[num_ljtypes * ((atom_ljtype_idx[i] - 1) + atom_ljtype_idx[j])]
+    # With 1-based idxs, the coefs of the atom pair (i, j) are at
+    # lj_param_idx[num_ljtypes * (atom_ljtype_idx[i] - 1) + atom_ljtype_idx[j]]
     LJ_PARAM_A = "LENNARD_JONES_ACOEF"
     LJ_PARAM_B = "LENNARD_JONES_BCOEF"
     # Bonded interactions
@@ -0,0 +1,121 @@
+r"""
+On-disk cache of parsed prmtop blocks, stored as binary '*.npz' entries
+
+Entries are keyed by the resolved path, size, modification time and content
+hash of the source '*.prmtop' file, and live in a directory that can be shared
+by many processes. When the directory grows past a maximum size the least
+recently used entries are evicted.
+"""
+
+import hashlib
+import os
+import tempfile
+import typing as tp
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+
+from mdutils._io import file_digest
+
+__all__ = ["PrmtopCache"]
+
+# Bump if the layout of the cache entries changes
+_CACHE_FORMAT_VERSION = 2
+
+
+def _default_cache_dir() -> Path:
+    env_dir = os.environ.get("MDUTILS_PRMTOP_CACHE_DIR")
+    if env_dir:
+        return Path(env_dir)
+    xdg_dir = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg_dir) if xdg_dir else Path.home() / ".cache"
+    return base / "mdutils" / "prmtop"
+
+
+class PrmtopCache:
+    r"""
+    Directory of cached prmtop entries with size-bounded LRU eviction
+
+    Entries are written atomically, so the same directory can be used
+    concurrently by different processes. Stale or corrupt entries are treated
+    as misses and removed.
+    """
+
+    def __init__(
+        self,
+        root: tp.Optional[Path] = None,
+        max_size_bytes: int = 4 * 1024**3,
+    ) -> None:
+        self.root = Path(root) if root is not None else _default_cache_dir()
+        self.max_size_bytes = max_size_bytes
+        # Content digests already computed, keyed by path, size and mtime
+        self._digests: tp.Dict[tp.Tuple[str, int, int], str] = {}
+
+    def entry_path(self, path: Path) -> Path:
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = file_digest(path)
+        h = hashlib.blake2b(digest_size=16)
+        for part in (*map(str, key), self._digests[key]):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return self.root / f"{h.hexdigest()}.npz"
+
+    def get(self, path: Path) -> tp.Optional[tp.Dict[str, NDArray[tp.Any]]]:
+        r"""Arrays stored for a prmtop file, or None if there is no valid entry"""
+        entry = self.entry_path(path)
+        try:
+            with np.load(entry, allow_pickle=False) as npz:
+                arrays = {k: npz[k] for k in npz.files}
+            if arrays.pop("_format_version").item() != _CACHE_FORMAT_VERSION:
+                raise ValueError("Unsupported cache entry format")
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt or incompatible entry
+            entry.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(entry)  # Mark as recently used
+        except FileNotFoundError:
+            pass
+        return arrays
+
+    def put(self, path: Path, arrays: tp.Mapping[str, NDArray[tp.Any]]) -> None:
+        r"""Store the arrays of a prmtop file and evict old entries if needed"""
+        entry = self.entry_path(path)
+        payload: tp.Dict[str, tp.Any] = dict(arrays)
+        payload["_format_version"] = np.array(_CACHE_FORMAT_VERSION)
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                np.savez(f, **payload)
+            os.replace(tmp_name, entry)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        r"""Remove the least recently used entries until the size limit is met"""
+        entries = []
+        for entry in self.root.glob("*.npz"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        for entry in self.root.glob("*.npz"):
+            entry.unlink(missing_ok=True)
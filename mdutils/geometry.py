@@ -61,6 +61,27 @@ class BoxParams:
         default_factory=lambda: np.full(3, fill_value=90.0, dtype=np.float64)
     )
 
+    @property
+    def vectors(self) -> NDArray[np.float64]:
+        r"""
+        (3, 3) array with the box vectors a, b, c as rows
+
+        Follows the Amber convention, a is along x and b is in the xy plane. The
+        angles are (alpha, beta, gamma), in degrees.
+        """
+        a, b, c = np.asarray(self.lengths, dtype=np.float64)
+        cos_alpha, cos_beta, cos_gamma = np.cos(np.radians(self.angles))
+        sin_gamma = np.sin(np.radians(self.angles[2]))
+        cy = (cos_alpha - cos_beta * cos_gamma) / sin_gamma
+        cz = math.sqrt(1 - cos_beta**2 - cy**2)
+        return np.array(
+            [
+                [a, 0.0, 0.0],
+                [b * cos_gamma, b * sin_gamma, 0.0],
+                [c * cos_beta, c * cy, c * cz],
+            ]
+        )
+
 
 class SolvCapKind(Enum):
     NO_SOLV_CAP = "no-solv-cap"
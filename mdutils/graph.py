@@ -0,0 +1,220 @@
+r"""
+Undirected graphs over atoms, stored in compressed sparse row (CSR) form.
+
+All operations are vectorized over nodes and edges, python loops only run over
+BFS levels or (logarithmically many) label propagation rounds.
+"""
+
+import typing as tp
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+import typing_extensions as tpx
+
+__all__ = ["CSRGraph"]
+
+
+@dataclass
+class CSRGraph:
+    r"""
+    Immutable undirected graph in CSR form, with 0-based node indices
+
+    The neighbors of node ``i`` are ``indices[indptr[i]:indptr[i + 1]]``, sorted
+    in increasing order. Each edge is stored in both directions.
+    """
+
+    indptr: NDArray[np.int64]
+    indices: NDArray[np.int64]
+
+    def __post_init__(self) -> None:
+        self.indptr.flags.writeable = False
+        self.indices.flags.writeable = False
+
+    @classmethod
+    def from_edges(cls, edges: NDArray[np.integer[tp.Any]], nodes_num: int) -> tpx.Self:
+        r"""
+        Build from an (E, 2) array of node pairs
+
+        Duplicated edges (in any direction) and self-loops are dropped.
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if edges.size and (edges.min() < 0 or edges.max() >= nodes_num):
+            raise ValueError(f"Edges must connect nodes in the range [0, {nodes_num})")
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+        is_loop = src == dst
+        keys = _sorted_unique(src[~is_loop] * nodes_num + dst[~is_loop])
+        src, dst = np.divmod(keys, nodes_num)
+        indptr = np.zeros(nodes_num + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=nodes_num), out=indptr[1:])
+        return cls(indptr, dst)
+
+    @property
+    def nodes_num(self) -> int:
+        return self.indptr.shape[0] - 1
+
+    @property
+    def edges_num(self) -> int:
+        return self.indices.shape[0] // 2
+
+    @property
+    def degree(self) -> NDArray[np.int64]:
+        return np.diff(self.indptr)
+
+    def edges(self) -> NDArray[np.int64]:
+        r"""(E, 2) array of the edges (i, j) with i < j, sorted"""
+        src = np.repeat(np.arange(self.nodes_num), self.degree)
+        is_upper = src < self.indices
+        return np.column_stack((src[is_upper], self.indices[is_upper]))
+
+    def neighbors(self, node: int) -> NDArray[np.int64]:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]  # noqa
+
+    def has_edge(
+        self,
+        i: tp.Union[int, NDArray[np.int64]],
+        j: tp.Union[int, NDArray[np.int64]],
+    ) -> NDArray[np.bool_]:
+        r"""Whether nodes i and j are joined by an edge, broadcast over arrays"""
+        i = np.asarray(i, dtype=np.int64)
+        query = i * self.nodes_num + np.asarray(j, dtype=np.int64)
+        # Keys of the stored edges are sorted, since CSR rows are sorted
+        keys = np.repeat(np.arange(self.nodes_num), self.degree) * self.nodes_num
+        keys += self.indices
+        if not keys.size:
+            return np.zeros(query.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(keys, query), keys.shape[0] - 1)
+        return keys[pos] == query
+
+    def gather_neighbors(
+        self, nodes: NDArray[np.int64]
+    ) -> tp.Tuple[NDArray[np.int64], NDArray[np.int64]]:
+        r"""
+        Neighbors of many nodes, concatenated in the order of the nodes
+
+        Returns the flat neighbors, and the number of neighbors of each node
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        # Position of each neighbor inside self.indices
+        shifts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return self.indices[shifts + np.arange(shifts.shape[0])], counts
+
+    def angles(self) -> NDArray[np.int64]:
+        r"""
+        (A, 3) array of the paths (i, j, k) of 2 edges, centered on j, with i < k
+
+        Sorted by (j, i, k). Found by pairing the neighbors of each node.
+        """
+        src = np.repeat(np.arange(self.nodes_num), self.degree)
+        # Pairs of positions p < q in the same row of self.indices
+        p, local = _repeat_arange(self.indptr[src + 1] - np.arange(src.shape[0]) - 1)
+        return np.column_stack((self.indices[p], src[p], self.indices[p + 1 + local]))
+
+    def dihedrals(self) -> NDArray[np.int64]:
+        r"""
+        (D, 4) array of the paths (i, j, k, l) of 3 edges, with j < k and i != l
+
+        Sorted by the central edge (j, k), then by (i, l). Found by pairing the
+        neighbors of both ends of each edge.
+        """
+        degree = self.degree
+        edges = self.edges()
+        deg_k = degree[edges[:, 1]]
+        edge_idx, local = _repeat_arange(degree[edges[:, 0]] * deg_k)
+        j, k, deg_k = edges[edge_idx, 0], edges[edge_idx, 1], deg_k[edge_idx]
+        i = self.indices[self.indptr[j] + local // deg_k]
+        l = self.indices[self.indptr[k] + local % deg_k]  # noqa: E741
+        # Drop walks that go back over the edge, and 3-rings
+        is_path = (i != k) & (l != j) & (i != l)
+        return np.column_stack((i[is_path], j[is_path], k[is_path], l[is_path]))
+
+    def pairs_within(self, max_distance: int = 3) -> NDArray[np.int64]:
+        r"""
+        (P, 2) array of the node pairs (i, j), i < j, at most ``max_distance``
+        edges apart, sorted. Only distances up to 3 are supported.
+
+        Pairs are the ends of the edges (1-2), angles (1-3) and dihedrals (1-4).
+        """
+        if not 1 <= max_distance <= 3:
+            raise ValueError("Only max distances of 1, 2 or 3 are supported")
+        pairs = [self.edges()]
+        if max_distance >= 2:
+            pairs.append(self.angles()[:, [0, 2]])
+        if max_distance >= 3:
+            pairs.append(self.dihedrals()[:, [0, 3]])
+        keys = [
+            np.minimum(a, b) * self.nodes_num + np.maximum(a, b)
+            for a, b in (p.T for p in pairs)
+        ]
+        unique_keys = _sorted_unique(np.concatenate(keys))
+        return np.column_stack(np.divmod(unique_keys, self.nodes_num))
+
+    def connected_components(self) -> NDArray[np.int64]:
+        r"""
+        Label of the connected component of each node
+
+        Components are numbered in the order of their first (lowest) node. Found
+        by hooking the root of each node onto the lowest root among its
+        neighbors, followed by pointer jumping, until no edge joins two roots.
+        """
+        src = np.repeat(np.arange(self.nodes_num), self.degree)
+        dst = self.indices
+        parent = np.arange(self.nodes_num)
+        while True:
+            src_root = parent[src]
+            dst_root = parent[dst]
+            to_hook = dst_root < src_root
+            if not to_hook.any():
+                break
+            # Parents only decrease, so no cycles are created
+            np.minimum.at(parent, src_root[to_hook], dst_root[to_hook])
+            while True:
+                grandparent = parent[parent]
+                if (grandparent == parent).all():
+                    break
+                parent = grandparent
+        # Roots are the lowest node of each component
+        is_root = parent == np.arange(self.nodes_num)
+        return (np.cumsum(is_root) - 1)[parent]
+
+    def bfs_distances(
+        self,
+        sources: tp.Union[int, NDArray[np.int64]],
+        max_distance: tp.Optional[int] = None,
+    ) -> NDArray[np.int64]:
+        r"""
+        Number of edges from the closest source to each node
+
+        Nodes that are unreachable, or further than ``max_distance``, get -1.
+        The frontier of each BFS level is expanded in a single step.
+        """
+        dist = np.full(self.nodes_num, -1, dtype=np.int64)
+        frontier = _sorted_unique(np.asarray(sources, dtype=np.int64).reshape(-1))
+        dist[frontier] = 0
+        level = 0
+        while frontier.size and (max_distance is None or level < max_distance):
+            level += 1
+            nbrs, _ = self.gather_neighbors(frontier)
+            frontier = _sorted_unique(nbrs[dist[nbrs] == -1])
+            dist[frontier] = level
+        return dist
+
+
+def _sorted_unique(values: NDArray[np.int64]) -> NDArray[np.int64]:
+    # Faster than np.unique for large integer arrays
+    values = np.sort(values)
+    is_first = np.ones(values.shape[0], dtype=bool)
+    np.not_equal(values[1:], values[:-1], out=is_first[1:])
+    return values[is_first]
+
+
+def _repeat_arange(
+    counts: NDArray[np.int64],
+) -> tp.Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    # For each j, repeat j counts[j] times, together with 0, ..., counts[j] - 1
+    owner = np.repeat(np.arange(counts.shape[0]), counts)
+    starts = np.cumsum(counts) - counts
+    return owner, np.arange(owner.shape[0]) - starts[owner]
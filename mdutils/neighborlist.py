@@ -0,0 +1,460 @@
+r"""
+Neighborlists of the atom pairs within a cutoff, with optional periodic
+boundaries
+
+Implements the internal `mdutils.geometry.NeighborlistKind` variants. Cell lists
+scale linearly with the number of atoms, all-pairs searches are faster for small
+or sparse systems, and ``AUTO`` picks the cheapest of the two. Periodic boxes
+can be orthorhombic or triclinic, and are described with
+`mdutils.geometry.BoxParams`. Candidate pairs are checked in chunks of bounded
+size.
+"""
+
+import typing as tp
+from dataclasses import dataclass
+import itertools
+
+import numpy as np
+from numpy.typing import NDArray
+
+from mdutils.geometry import BoxParams, NeighborlistKind
+
+__all__ = [
+    "NeighborPairs",
+    "VerletList",
+    "neighbor_pairs",
+    "iter_neighbor_pairs",
+    "iter_frames_neighbor_pairs",
+]
+
+# Max number of candidate pairs checked at once, bounds temporary memory
+_CHUNK_CANDIDATES = 1 << 22
+
+# Cells are 1 / _CELLS_PER_CUTOFF times as wide as the cutoff. Smaller cells
+# fit a sphere more tightly, so fewer distances are checked
+_CELLS_PER_CUTOFF = 2
+
+# Cost of visiting a neighbor cell of an atom, relative to checking a distance
+_CELL_VISIT_COST = 4.0
+
+
+def _half_stencil(reach: int) -> tp.List[tp.Tuple[int, ...]]:
+    # Offsets to the neighbor cells, so that each pair of cells is visited once
+    steps = range(-reach, reach + 1)
+    return [o for o in itertools.product(steps, repeat=3) if o >= (0, 0, 0)]
+
+
+@dataclass
+class NeighborPairs:
+    r"""
+    Atom pairs (i, j) closer than a cutoff
+
+    In a half list each pair is listed once, with i < j. In a full list it is
+    also listed as (j, i). With a box, each pair is formed by atom i and the
+    periodic image of atom j displaced by ``shifts @ box.vectors``. Without a
+    box the shifts are zero.
+    """
+
+    idxs: NDArray[np.int64]  # (P, 2)
+    shifts: NDArray[np.int64]  # (P, 3)
+
+    @property
+    def num(self) -> int:
+        return self.idxs.shape[0]
+
+    def vectors(
+        self, coords: NDArray[np.float64], box: tp.Optional[BoxParams] = None
+    ) -> NDArray[np.float64]:
+        r"""(P, 3) array of the vectors from atom i to (the image of) atom j"""
+        diff = coords[self.idxs[:, 1]] - coords[self.idxs[:, 0]]
+        if box is not None:
+            diff += self.shifts @ box.vectors
+        return diff
+
+    def distances(
+        self, coords: NDArray[np.float64], box: tp.Optional[BoxParams] = None
+    ) -> NDArray[np.float64]:
+        diff = self.vectors(coords, box)
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    def select(self, mask: NDArray[tp.Any]) -> "NeighborPairs":
+        r"""Subset of the pairs, from a boolean mask or an array of idxs"""
+        return NeighborPairs(self.idxs[mask], self.shifts[mask])
+
+    def sorted(self, atoms_num: int) -> "NeighborPairs":
+        r"""Pairs sorted by (i, j)"""
+        order = np.argsort(self.idxs[:, 0] * atoms_num + self.idxs[:, 1])
+        return self.select(order)
+
+    def to_full(self, atoms_num: int) -> "NeighborPairs":
+        r"""Full list, sorted by (i, j), from a half list"""
+        full = NeighborPairs(
+            np.concatenate((self.idxs, self.idxs[:, ::-1])),
+            np.concatenate((self.shifts, -self.shifts)),
+        )
+        return full.sorted(atoms_num)
+
+    def to_csr(
+        self, atoms_num: int
+    ) -> tp.Tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.int64]]:
+        r"""
+        The pairs as a CSR neighborlist
+
+        Returns the offsets, neighbors and shifts. The neighbors of atom ``i``
+        are ``neighbors[offsets[i]:offsets[i + 1]]``. For half lists only the
+        neighbors j > i are listed.
+        """
+        order = np.argsort(self.idxs[:, 0], kind="stable")
+        offsets = np.zeros(atoms_num + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.idxs[:, 0], minlength=atoms_num), out=offsets[1:])
+        return offsets, self.idxs[order, 1], self.shifts[order]
+
+    @classmethod
+    def concatenate(cls, chunks: tp.Iterable["NeighborPairs"]) -> "NeighborPairs":
+        chunks = list(chunks)
+        if not chunks:
+            return cls(
+                np.empty((0, 2), dtype=np.int64), np.empty((0, 3), dtype=np.int64)
+            )
+        return cls(
+            np.concatenate([c.idxs for c in chunks]),
+            np.concatenate([c.shifts for c in chunks]),
+        )
+
+
+def neighbor_pairs(
+    coords: NDArray[np.float64],
+    cutoff: float,
+    box: tp.Optional[BoxParams] = None,
+    kind: tp.Union[NeighborlistKind, str] = NeighborlistKind.AUTO,
+    full: bool = False,
+) -> NeighborPairs:
+    r"""
+    All atom pairs closer than the cutoff, sorted by (i, j)
+
+    ``coords`` has shape (atoms, 3). With a box, coords don't need to be
+    wrapped, and the cutoff can't be larger than half the smallest width of the
+    box, so that each pair has at most one periodic image within the cutoff.
+    """
+    atoms_num = len(coords)
+    pairs = NeighborPairs.concatenate(iter_neighbor_pairs(coords, cutoff, box, kind))
+    return pairs.to_full(atoms_num) if full else pairs.sorted(atoms_num)
+
+
+def iter_neighbor_pairs(
+    coords: NDArray[np.float64],
+    cutoff: float,
+    box: tp.Optional[BoxParams] = None,
+    kind: tp.Union[NeighborlistKind, str] = NeighborlistKind.AUTO,
+    chunk_size: int = _CHUNK_CANDIDATES,
+) -> tp.Iterator[NeighborPairs]:
+    r"""
+    Same as `neighbor_pairs` for half lists, but yields unsorted chunks
+
+    At most ``chunk_size`` candidate pairs are checked at once
+    """
+    coords = _check_args(coords, cutoff, kind)
+    grid = _CellGrid(coords, cutoff, box, NeighborlistKind(kind))
+    for offset in _half_stencil(grid.reach):
+        yield from grid.pairs_with_offset(offset, chunk_size)
+
+
+def iter_frames_neighbor_pairs(
+    coords: NDArray[np.float64],
+    cutoff: float,
+    box: tp.Union[BoxParams, tp.Sequence[BoxParams], None] = None,
+    kind: tp.Union[NeighborlistKind, str] = NeighborlistKind.AUTO,
+    full: bool = False,
+    chunk_size: int = _CHUNK_CANDIDATES,
+) -> tp.Iterator[NeighborPairs]:
+    r"""
+    Sorted pairs of each frame of a batch, with shape (frames, atoms, 3)
+
+    ``box`` can be a single box for all frames, or one box per frame. For the
+    all-pairs search without a box or with orthorhombic boxes, the distances of
+    chunks of frames are checked at once. Otherwise frames are searched one by
+    one.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim != 3 or coords.shape[2] != 3:
+        raise ValueError("Coords must have shape (frames, atoms, 3)")
+    frames_num, atoms_num, _ = coords.shape
+    boxes: tp.Sequence[tp.Optional[BoxParams]]
+    if box is None or isinstance(box, BoxParams):
+        boxes = [box] * frames_num
+    else:
+        boxes = box
+        if len(boxes) != frames_num:
+            raise ValueError("There must be a single box, or one box per frame")
+    if not frames_num:
+        return
+    _check_args(coords[0], cutoff, kind)
+    kind = _CellGrid(coords[0], cutoff, boxes[0], NeighborlistKind(kind)).kind
+    is_batchable = kind is NeighborlistKind.INTERNAL_ALL_PAIRS and (
+        all(b is None for b in boxes)
+        or all(b is not None and np.allclose(b.angles, 90.0) for b in boxes)
+    )
+    if not is_batchable:
+        for frame, frame_box in zip(coords, boxes):
+            yield neighbor_pairs(frame, cutoff, frame_box, kind, full)
+        return
+    i, j = np.triu_indices(atoms_num, 1)
+    chunk_frames = max(1, chunk_size // max(i.shape[0], 1))
+    for start in range(0, frames_num, chunk_frames):
+        chunk = slice(start, start + chunk_frames)
+        diff = coords[chunk, j] - coords[chunk, i]
+        if boxes[0] is None:
+            shifts = np.zeros_like(diff, dtype=np.int64)
+        else:
+            lengths = np.stack([tp.cast(BoxParams, b).lengths for b in boxes[chunk]])[
+                :, None, :
+            ]
+            if (cutoff > lengths / 2).any():
+                raise ValueError(f"Cutoff {cutoff} is larger than half the box width")
+            # Minimum image, which is exact for orthorhombic boxes
+            shifts = -np.round(diff / lengths).astype(np.int64)
+            diff += shifts * lengths
+        is_close = np.einsum("fpk,fpk->fp", diff, diff) < cutoff**2
+        for frame_is_close, frame_shifts in zip(is_close, shifts):
+            pairs = NeighborPairs(
+                np.column_stack((i[frame_is_close], j[frame_is_close])),
+                frame_shifts[frame_is_close],
+            )
+            yield pairs.to_full(atoms_num) if full else pairs
+
+
+class VerletList:
+    r"""
+    Neighborlist that is rebuilt only when atoms have moved far enough
+
+    Pairs are searched with the cutoff extended by a skin. Until an atom moves
+    more than half the skin from its position at the last build, all pairs
+    within the cutoff are in the extended list, and are found by filtering it.
+    The list is also rebuilt when the box changes. Coords should not be
+    wrapped between updates, otherwise wrapped atoms trigger rebuilds.
+    """
+
+    def __init__(
+        self,
+        cutoff: float,
+        skin: float = 2.0,
+        kind: tp.Union[NeighborlistKind, str] = NeighborlistKind.AUTO,
+        full: bool = False,
+    ) -> None:
+        if skin < 0.0:
+            raise ValueError("Skin must be non-negative")
+        self.cutoff = cutoff
+        self.skin = skin
+        self.kind = NeighborlistKind(kind)
+        self.full = full
+        self.builds_num = 0
+        self._candidates: tp.Optional[NeighborPairs] = None
+        self._built_coords: tp.Optional[NDArray[np.float64]] = None
+        self._built_box: tp.Optional[BoxParams] = None
+
+    def update(
+        self, coords: NDArray[np.float64], box: tp.Optional[BoxParams] = None
+    ) -> NeighborPairs:
+        r"""Pairs within the cutoff for the given coords, sorted by (i, j)"""
+        coords = np.asarray(coords, dtype=np.float64)
+        if self._needs_build(coords, box):
+            self._candidates = neighbor_pairs(
+                coords, self.cutoff + self.skin, box, self.kind
+            )
+            self._built_coords = coords.copy()
+            self._built_box = (
+                None
+                if box is None
+                else BoxParams(np.array(box.lengths), np.array(box.angles))
+            )
+            self.builds_num += 1
+        assert self._candidates is not None
+        pairs = self._candidates.select(
+            self._candidates.distances(coords, box) < self.cutoff
+        )
+        return pairs.to_full(coords.shape[0]) if self.full else pairs
+
+    def _needs_build(
+        self, coords: NDArray[np.float64], box: tp.Optional[BoxParams]
+    ) -> bool:
+        built_coords = self._built_coords
+        built_box = self._built_box
+        if built_coords is None or built_coords.shape != coords.shape:
+            return True
+        if (box is None) != (built_box is None):
+            return True
+        if box is not None and built_box is not None:
+            if not (
+                np.array_equal(box.lengths, built_box.lengths)
+                and np.array_equal(box.angles, built_box.angles)
+            ):
+                return True
+        moved_sq = np.einsum("ij,ij->i", coords - built_coords, coords - built_coords)
+        return bool(moved_sq.max(initial=0.0) > (self.skin / 2) ** 2)
+
+
+def _check_args(
+    coords: NDArray[np.float64],
+    cutoff: float,
+    kind: tp.Union[NeighborlistKind, str],
+) -> NDArray[np.float64]:
+    if NeighborlistKind(kind) is NeighborlistKind.EXTERNAL:
+        raise ValueError("External neighborlists must be computed by the caller")
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim != 2 or coords.shape[1] != 3:
+        raise ValueError("Coords must have shape (atoms, 3)")
+    if cutoff <= 0.0:
+        raise ValueError("Cutoff must be positive")
+    return coords
+
+
+def _auto_kind(atoms_num: int, cells_num: int, periodic: bool) -> NeighborlistKind:
+    # Estimated costs of both searches, in number of distances checked
+    cell_list_cost = (
+        atoms_num
+        * len(_half_stencil(_CELLS_PER_CUTOFF))
+        * (atoms_num / cells_num + _CELL_VISIT_COST)
+    )
+    # With a box, the single cell is visited once per image
+    images_num = len(_half_stencil(1)) if periodic else 1
+    all_pairs_cost = atoms_num * images_num * (atoms_num + _CELL_VISIT_COST)
+    if all_pairs_cost <= cell_list_cost:
+        return NeighborlistKind.INTERNAL_ALL_PAIRS
+    return NeighborlistKind.INTERNAL_CELL_LIST
+
+
+class _CellGrid:
+    # Atoms sorted into a grid of cells at least as wide as a fraction of the
+    # cutoff, or into a single cell for all-pairs searches. With a box the grid
+    # spans the box, in fractional coords.
+    def __init__(
+        self,
+        coords: NDArray[np.float64],
+        cutoff: float,
+        box: tp.Optional[BoxParams],
+        kind: NeighborlistKind,
+    ) -> None:
+        atoms_num = coords.shape[0]
+        max_cells_num = 8 * max(atoms_num, 1)
+        self.cutoff = cutoff
+        self.periodic = box is not None
+        if box is not None:
+            vectors = box.vectors
+            inv = np.linalg.inv(vectors)
+            # Distance between opposite faces of the box
+            widths = 1 / np.linalg.norm(inv, axis=0)
+            if cutoff > widths.min() / 2:
+                raise ValueError(
+                    f"Cutoff {cutoff} is larger than half the box width {widths.min()}"
+                )
+            frac = coords @ inv
+            images = np.floor(frac)
+            frac -= images
+            # Coords with the atoms wrapped into the box
+            self.coords = frac @ vectors
+            self.images = images.astype(np.int64)
+            self.vectors = vectors
+            cells_num = np.floor(widths * _CELLS_PER_CUTOFF / cutoff).astype(np.int64)
+            # Sparse systems would otherwise have many empty cells
+            if np.prod(cells_num) > max_cells_num:
+                scale = (max_cells_num / np.prod(cells_num)) ** (1 / 3)
+                cells_num = np.maximum(np.floor(cells_num * scale), 1).astype(np.int64)
+        else:
+            self.coords = coords
+            lower = coords.min(axis=0, initial=np.inf) if atoms_num else np.zeros(3)
+            extent = coords.max(axis=0, initial=-np.inf) - lower if atoms_num else lower
+            cell_width = cutoff / _CELLS_PER_CUTOFF
+            while True:
+                cells_num = np.floor(extent / cell_width).astype(np.int64) + 1
+                if np.prod(cells_num) <= max_cells_num:
+                    break
+                cell_width *= 2
+        if kind is NeighborlistKind.AUTO:
+            kind = _auto_kind(atoms_num, int(np.prod(cells_num)), self.periodic)
+        self.kind = kind
+        if kind is NeighborlistKind.INTERNAL_ALL_PAIRS:
+            self.reach = 1
+            cells_num = np.ones(3, dtype=np.int64)
+            cell3 = np.zeros((atoms_num, 3), dtype=np.int64)
+        else:
+            self.reach = _CELLS_PER_CUTOFF
+            if box is not None:
+                cell3 = np.minimum((frac * cells_num).astype(np.int64), cells_num - 1)
+            else:
+                cell3 = np.floor((coords - lower) / cell_width).astype(np.int64)
+        self.cells_num = cells_num
+        cell = np.ravel_multi_index(tuple(cell3.T), tuple(cells_num))
+        self.order = np.argsort(cell, kind="stable")
+        self.cell3 = cell3[self.order]
+        self.sorted_coords = self.coords[self.order]
+        counts = np.bincount(cell, minlength=int(np.prod(cells_num)))
+        self.starts = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.starts[1:])
+
+    def pairs_with_offset(
+        self, offset: tp.Tuple[int, ...], chunk_size: int
+    ) -> tp.Iterator[NeighborPairs]:
+        atoms_num = self.order.shape[0]
+        nbr3 = self.cell3 + np.array(offset)
+        # Number of wraps around the box, i.e. the shift of the image
+        wraps = np.floor_divide(nbr3, self.cells_num)
+        nbr3 -= wraps * self.cells_num
+        if self.periodic:
+            is_valid = np.ones(atoms_num, dtype=bool)
+            # Moving atom i by -shift is the same as moving atom j by +shift
+            origins = self.sorted_coords - wraps @ self.vectors
+        else:
+            is_valid = ~wraps.any(axis=1)
+            origins = self.sorted_coords
+        nbr = np.ravel_multi_index(tuple(nbr3.T), tuple(self.cells_num))
+        if offset == (0, 0, 0):
+            # Only pairs of positions p < q inside the same cell
+            first = np.arange(1, atoms_num + 1)
+        else:
+            first = self.starts[nbr]
+        counts = np.where(is_valid, self.starts[nbr + 1] - first, 0)
+        # Split the atoms into chunks with a bounded number of candidates
+        bounds = np.cumsum(counts)
+        start = 0
+        while start < atoms_num:
+            base = bounds[start - 1] if start else 0
+            end = max(
+                int(np.searchsorted(bounds, base + chunk_size, side="right")), start + 1
+            )
+            chunk = slice(start, end)
+            start = end
+            chunk_counts = counts[chunk]
+            total = int(bounds[end - 1] - base)
+            if not total:
+                continue
+            # Candidates are all the positions q of the neighbor cell of each p.
+            # Values of p are repeated instead of gathered, since they are sorted
+            q = np.arange(total) + np.repeat(
+                first[chunk] - (bounds[chunk] - base - chunk_counts), chunk_counts
+            )
+            diff = self.sorted_coords[q] - np.repeat(
+                origins[chunk], chunk_counts, axis=0
+            )
+            is_close = np.einsum("ij,ij->i", diff, diff) < self.cutoff**2
+            if not is_close.any():
+                continue
+            p = np.repeat(np.arange(start - chunk_counts.shape[0], end), chunk_counts)
+            yield self._pairs(p[is_close], q[is_close], wraps)
+
+    def _pairs(
+        self,
+        p: NDArray[np.int64],
+        q: NDArray[np.int64],
+        wraps: NDArray[np.int64],
+    ) -> NeighborPairs:
+        i = self.order[p]
+        j = self.order[q]
+        if self.periodic:
+            # Shifts of the unwrapped coords
+            shifts = wraps[p] + self.images[i] - self.images[j]
+        else:
+            shifts = np.zeros((i.shape[0], 3), dtype=np.int64)
+        is_swapped = i > j
+        shifts[is_swapped] *= -1
+        idxs = np.column_stack((np.minimum(i, j), np.maximum(i, j)))
+        return NeighborPairs(idxs, shifts)
@@ -0,0 +1,148 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from mdutils.amber.energy import bonded_energies, nonbonded_energies
+from mdutils.amber.prmtop import Prmtop
+from mdutils.geometry import BoxParams, bond_angle, bond_dist, dih_angle
+
+
+def _random_coords(prmtop: Prmtop, frames_num: int) -> np.ndarray:
+    rng = np.random.default_rng(1234)
+    return rng.uniform(0.0, 12.0, size=(frames_num, prmtop.atoms.num, 3))
+
+
+def _lattice_coords(prmtop: Prmtop, frames_num: int, box: BoxParams) -> np.ndarray:
+    # Jittered lattice sites, so that no atoms clash
+    rng = np.random.default_rng(1234)
+    sites = np.stack(np.meshgrid(*(np.arange(13),) * 3, indexing="ij"), axis=-1)
+    sites = sites.reshape(-1, 3) * (box.lengths / 13)
+    frames = []
+    for _ in range(frames_num):
+        idxs = rng.permutation(sites.shape[0])[: prmtop.atoms.num]
+        frames.append(sites[idxs] + rng.normal(0.0, 0.2, size=(idxs.shape[0], 3)))
+    return np.stack(frames)
+
+
+@pytest.mark.fast
+def test_bonded_energies() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    coords = _random_coords(prmtop, 3)
+    energies = bonded_energies(prmtop, coords)
+    assert energies.forces is None
+    assert energies.total.shape == (3,)
+
+    # Reference, one frame and one term at a time
+    frame = coords[1]
+    bonds = prmtop.bonds
+    idxs = bonds.atom_idxs
+    r = bond_dist(frame[idxs[:, 0]], frame[idxs[:, 1]])
+    k = bonds.fftype_force_const[bonds.fftype_idx]
+    r0 = bonds.fftype_equil_distance[bonds.fftype_idx]
+    assert np.isclose(energies.bond[1], np.sum(k * (r - r0) ** 2))
+
+    angles = prmtop.angles
+    idxs = angles.atom_idxs
+    theta = np.radians(bond_angle(*(frame[idxs[:, c]] for c in range(3))))
+    k = angles.fftype_force_const[angles.fftype_idx]
+    theta0 = angles.fftype_equil_angle[angles.fftype_idx]
+    assert np.isclose(energies.angle[1], np.sum(k * (theta - theta0) ** 2))
+
+    # All phases are 0 or pi, so the sign of the angles doesn't matter
+    dihedrals = prmtop.dihedrals
+    idxs = dihedrals.atom_idxs
+    phi = np.radians(dih_angle(*(frame[idxs[:, c]] for c in range(4))))
+    fftype = dihedrals.fftype_idx
+    k = dihedrals.fftype_force_const[fftype]
+    n = dihedrals.fftype_periodicity[fftype]
+    phase = dihedrals.fftype_phase[fftype]
+    expect = np.sum(k * (1 + np.cos(n * phi - phase)))
+    assert np.isclose(energies.dihedral[1], expect)
+
+    pairs = idxs[~dihedrals.skip_14][:, [0, 3]]
+    r = bond_dist(frame[pairs[:, 0]], frame[pairs[:, 1]])
+    charge = prmtop.atoms.charge_amber_units.astype(np.float64)
+    scee = dihedrals.fftype_ends_electro_screen[fftype[~dihedrals.skip_14]]
+    elec = charge[pairs[:, 0]] * charge[pairs[:, 1]] / r / scee
+    assert np.isclose(energies.elec_14[1], np.sum(elec))
+    acoef, bcoef = prmtop.lj_params(pairs[:, 0], pairs[:, 1])
+    scnb = dihedrals.fftype_ends_lj_screen[fftype[~dihedrals.skip_14]]
+    assert np.isclose(energies.lj_14[1], np.sum((acoef / r**12 - bcoef / r**6) / scnb))
+
+    single = bonded_energies(prmtop, frame)
+    assert np.isclose(single.total[0], energies.total[1])
+    with pytest.raises(ValueError):
+        bonded_energies(prmtop, coords[:, :-1])
+
+
+@pytest.mark.fast
+def test_bonded_forces() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    coords = _random_coords(prmtop, 3)
+    energies = bonded_energies(prmtop, coords, forces=True)
+    assert energies.forces is not None
+    chunked = bonded_energies(prmtop, coords, forces=True, chunk_frames=2)
+    assert chunked.forces is not None
+    assert np.allclose(chunked.total, energies.total)
+    assert np.allclose(chunked.forces, energies.forces)
+
+    # Central finite differences
+    h = 1e-6
+    for atom in (0, 4, 8, 14, 1900):
+        for c in range(3):
+            plus = coords.copy()
+            plus[:, atom, c] += h
+            minus = coords.copy()
+            minus[:, atom, c] -= h
+            expect = -(
+                bonded_energies(prmtop, plus).total
+                - bonded_energies(prmtop, minus).total
+            ) / (2 * h)
+            assert np.allclose(energies.forces[:, atom, c], expect, rtol=1e-4)
+    # No net force
+    assert np.allclose(energies.forces.sum(axis=1), 0.0, atol=1e-3)
+
+
+@pytest.mark.fast
+def test_nonbonded_energies() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    box = BoxParams(np.array([29.0, 31.0, 27.0]))
+    coords = _lattice_coords(prmtop, 2, box)
+    cutoff = 8.0
+    energies = nonbonded_energies(prmtop, coords, box, cutoff, forces=True)
+    bonded = bonded_energies(prmtop, coords)
+    assert np.allclose(energies.elec_14, bonded.elec_14)
+    assert np.allclose(energies.lj_14, bonded.lj_14)
+
+    # Reference, with minimum image over all pairs
+    frame = coords[1]
+    i, j = np.triu_indices(prmtop.atoms.num, 1)
+    frac = (frame[j] - frame[i]) @ np.linalg.inv(box.vectors)
+    r = np.linalg.norm((frac - np.round(frac)) @ box.vectors, axis=-1)
+    is_included = (r < cutoff) & ~prmtop.exclusions.is_excluded(i, j)
+    i, j, r = i[is_included], j[is_included], r[is_included]
+    charge = prmtop.atoms.charge_amber_units.astype(np.float64)
+    assert np.isclose(energies.elec[1], np.sum(charge[i] * charge[j] / r))
+    acoef, bcoef = prmtop.lj_params(i, j)
+    assert np.isclose(energies.lj[1], np.sum(acoef / r**12 - bcoef / r**6))
+
+    # Central finite differences
+    assert energies.forces is not None
+    h = 1e-6
+    for atom in (5, 1000):
+        for c in range(3):
+            plus = frame.copy()
+            plus[atom, c] += h
+            minus = frame.copy()
+            minus[atom, c] -= h
+            expect = -(
+                nonbonded_energies(prmtop, plus, box, cutoff).total
+                - nonbonded_energies(prmtop, minus, box, cutoff).total
+            ) / (2 * h)
+            assert np.allclose(energies.forces[1, atom, c], expect, rtol=1e-4)
+
+    per_frame = nonbonded_energies(prmtop, coords, [box, box], cutoff)
+    assert np.allclose(per_frame.total, energies.total)
+    with pytest.raises(ValueError):
+        nonbonded_energies(prmtop, coords, [box], cutoff)
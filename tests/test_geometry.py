@@ -33,6 +33,19 @@ def test_box_params() -> None:
     assert expect_angles.dtype == np.float64
 
 
+@pytest.mark.fast
+def test_box_vectors() -> None:
+    params = BoxParams(np.array([10.0, 11.0, 12.0]))
+    assert np.allclose(params.vectors, np.diag([10.0, 11.0, 12.0]))
+    params = BoxParams(np.array([10.0, 11.0, 12.0]), np.array([70.0, 80.0, 100.0]))
+    a, b, c = params.vectors
+    assert np.allclose(np.linalg.norm(params.vectors, axis=1), params.lengths)
+    assert a[1] == a[2] == b[2] == 0.0
+    assert np.isclose(np.degrees(np.arccos(b @ c / 11.0 / 12.0)), 70.0)
+    assert np.isclose(np.degrees(np.arccos(a @ c / 10.0 / 12.0)), 80.0)
+    assert np.isclose(np.degrees(np.arccos(a @ b / 10.0 / 11.0)), 100.0)
+
+
 @pytest.mark.fast
 def test_box_and_plane_kinds() -> None:
     plane = Plane.XY
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from mdutils.graph import CSRGraph
+
+
+@pytest.mark.fast
+def test_csr_graph() -> None:
+    # Triangle 0-1-2, chain 3-4-5 with a duplicated edge, isolated node 6
+    edges = np.array([[1, 0], [1, 2], [2, 0], [3, 4], [5, 4], [4, 3], [6, 6]])
+    graph = CSRGraph.from_edges(edges, 7)
+    assert graph.nodes_num == 7
+    assert graph.edges_num == 5
+    assert_array_equal(graph.degree, [2, 2, 2, 1, 2, 1, 0])
+    assert_array_equal(graph.neighbors(4), [3, 5])
+    assert_array_equal(graph.edges(), [[0, 1], [0, 2], [1, 2], [3, 4], [4, 5]])
+    nbrs, counts = graph.gather_neighbors(np.array([4, 6, 0]))
+    assert_array_equal(nbrs, [3, 5, 1, 2])
+    assert_array_equal(counts, [2, 0, 2])
+    with pytest.raises(ValueError):
+        CSRGraph.from_edges(edges, 6)
+
+
+@pytest.mark.fast
+def test_csr_graph_components() -> None:
+    edges = np.array([[5, 0], [1, 4], [4, 2], [0, 3]])
+    graph = CSRGraph.from_edges(edges, 7)
+    assert_array_equal(graph.connected_components(), [0, 1, 1, 0, 1, 0, 2])
+
+    # Long chain with shuffled node labels
+    perm = np.random.default_rng(0).permutation(1000)
+    chain = np.column_stack((perm[:-1], perm[1:]))
+    graph = CSRGraph.from_edges(chain, 1000)
+    assert (graph.connected_components() == 0).all()
+    dist = graph.bfs_distances(perm[0])
+    assert_array_equal(dist[perm], np.arange(1000))
+    dist = graph.bfs_distances(perm[[0, -1]], max_distance=10)
+    assert_array_equal(dist[perm[:12]], [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, -1])
+    assert dist[perm[-1]] == 0
+
+
+@pytest.mark.fast
+def test_csr_graph_pairs_within() -> None:
+    # Chain 0-1-2-3-4 and 3-ring 5-6-7
+    edges = np.array([[0, 1], [1, 2], [2, 3], [3, 4], [5, 6], [6, 7], [7, 5]])
+    graph = CSRGraph.from_edges(edges, 8)
+    ring = [[5, 6], [5, 7], [6, 7]]
+    assert_array_equal(graph.pairs_within(1), graph.edges())
+    expect = [[0, 1], [0, 2], [1, 2], [1, 3], [2, 3], [2, 4], [3, 4], *ring]
+    assert_array_equal(graph.pairs_within(2), expect)
+    expect = [[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [1, 4], [2, 3], [2, 4]]
+    assert_array_equal(graph.pairs_within(3), [*expect, [3, 4], *ring])
+    with pytest.raises(ValueError):
+        graph.pairs_within(4)
+
+
+@pytest.mark.fast
+def test_csr_graph_angles_dihedrals() -> None:
+    # Butane-like chain 0-1-2-3 with a branch 1-4, and 3-ring 5-6-7
+    edges = np.array([[0, 1], [1, 2], [2, 3], [1, 4], [5, 6], [6, 7], [7, 5]])
+    graph = CSRGraph.from_edges(edges, 8)
+    assert_array_equal(graph.has_edge([0, 0, 7], [1, 2, 5]), [True, False, True])
+    assert_array_equal(
+        graph.angles(),
+        [[0, 1, 2], [0, 1, 4], [2, 1, 4], [1, 2, 3], [6, 5, 7], [5, 6, 7], [5, 7, 6]],
+    )
+    assert_array_equal(graph.dihedrals(), [[0, 1, 2, 3], [4, 1, 2, 3]])
@@ -1,8 +1,9 @@
+import lzma
 from pathlib import Path
 import tempfile
 import pytest
 
-from mdutils.amber.inpcrd import Inpcrd
+from mdutils.amber.inpcrd import Inpcrd, InpcrdMeta
 
 
 @pytest.mark.fast
@@ -13,3 +14,19 @@ def testReconstructInpcrd() -> None:
         result_inpcrd = Path(d) / "result.inpcrd"
         data.dump(result_inpcrd)
         assert result_inpcrd.read_text() == expect_inpcrd.read_text()
+
+
+@pytest.mark.fast
+def testLoadCompressedInpcrd() -> None:
+    expect_inpcrd = Path(Path(__file__).parent, "resources", "test.inpcrd")
+    with tempfile.TemporaryDirectory() as d:
+        compressed = Path(d) / "test.inpcrd.xz"
+        compressed.write_bytes(lzma.compress(expect_inpcrd.read_bytes()))
+        meta = InpcrdMeta.load(compressed, has_box=True)
+        expect_meta = InpcrdMeta.load(expect_inpcrd, has_box=True)
+        assert meta.atoms_num == expect_meta.atoms_num
+        assert (meta.box_lengths == expect_meta.box_lengths).all()
+        data = Inpcrd.load(compressed)
+        result_inpcrd = Path(d) / "result.inpcrd"
+        data.dump(result_inpcrd)
+        assert result_inpcrd.read_text() == expect_inpcrd.read_text()
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from mdutils.amber.mask import AmberMask, MaskError
+from mdutils.amber.prmtop import Prmtop
+from mdutils.geometry import BoxParams
+
+
+def _load() -> Prmtop:
+    return Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+
+
+@pytest.mark.fast
+def test_mask_selectors() -> None:
+    prmtop = _load()
+    atoms_num = prmtop.atoms.num
+    # ACE-ALA-NME followed by 630 TIP3P waters
+    assert prmtop.select("*").sum() == atoms_num
+    assert prmtop.select(":1-3").sum() == 22
+    assert prmtop.select(":WAT").sum() == 1890
+    assert prmtop.select(":WA?").sum() == 1890
+    assert np.array_equal(prmtop.select("!:WAT"), prmtop.select(":1-3"))
+    assert np.array_equal(prmtop.select(":ALA|:ACE"), prmtop.select(":1,2"))
+    assert prmtop.select_idxs("@CA").tolist() == [8]
+    assert prmtop.select_idxs(":2@CA,CB").tolist() == [8, 10]
+    assert (
+        prmtop.select_idxs(":2@CA,CB").tolist()
+        == prmtop.select_idxs(":2 & (@CA | @CB)").tolist()
+    )
+    assert prmtop.select_idxs("@1-3,5").tolist() == [0, 1, 2, 4]
+    assert prmtop.select("^1").sum() == 22
+    assert prmtop.select("^2-3").sum() == 6
+
+    is_h = prmtop.atoms.znum == 1
+    assert np.array_equal(prmtop.select("@/H"), is_h)
+    assert np.array_equal(prmtop.select("@H="), is_h)
+    assert np.array_equal(prmtop.select("!@/H"), ~is_h)
+    fftype = np.char.strip(prmtop.atoms.fftype)
+    assert np.array_equal(prmtop.select("@%CT"), fftype == "CT")
+    assert np.array_equal(prmtop.select(":1-3&!@H*"), ~is_h & prmtop.select(":1-3"))
+
+    # Cached until the blocks are modified
+    assert prmtop.select("@CA") is prmtop.select("@CA")
+    assert prmtop.select("@CA") is prmtop.select(" @CA ")
+
+    for bad in ("", ":", ":1-3&", "(:1", ":1)", "@%1", "^WAT", "#1", ":1 :2"):
+        with pytest.raises(MaskError):
+            prmtop.select(bad)
+
+
+@pytest.mark.fast
+def test_mask_distance() -> None:
+    prmtop = _load()
+    rng = np.random.default_rng(1234)
+    box = BoxParams(np.array([30.0, 30.0, 30.0]))
+    coords = rng.uniform(0.0, 30.0, size=(prmtop.atoms.num, 3))
+    mask = AmberMask.parse(":2<@4.5")
+    assert mask.needs_coords
+    with pytest.raises(MaskError):
+        prmtop.select(mask)
+
+    # Reference, with minimum image over all pairs
+    origin = prmtop.select(":2")
+    delta = coords[:, None, :] - coords[None, origin, :]
+    delta -= 30.0 * np.round(delta / 30.0)
+    is_close = (np.linalg.norm(delta, axis=-1) < 4.5).any(axis=1)
+    assert np.array_equal(prmtop.select(mask, coords, box), is_close)
+    assert np.array_equal(prmtop.select(":2>@4.5", coords, box), ~is_close)
+
+    # Whole resids are selected
+    resid = np.repeat(np.arange(prmtop.resids.num), prmtop.resids.atoms_num)
+    is_close_resid = np.isin(resid, resid[is_close])
+    selected = prmtop.select(":2<:4.5", coords, box)
+    assert np.array_equal(selected, is_close_resid)
+    selected = prmtop.select_idxs(":WAT & :2<:4.5", coords, box)
+    assert np.array_equal(selected, np.flatnonzero(is_close_resid & (resid > 2)))
@@ -0,0 +1,150 @@
+import itertools
+import typing as tp
+
+import numpy as np
+import pytest
+
+from mdutils.geometry import BoxParams, NeighborlistKind
+from mdutils.neighborlist import (
+    VerletList,
+    iter_frames_neighbor_pairs,
+    iter_neighbor_pairs,
+    neighbor_pairs,
+)
+
+
+def _brute_force_pairs(
+    coords: np.ndarray, cutoff: float, box: tp.Optional[BoxParams]
+) -> tp.Set[tp.Tuple[int, ...]]:
+    if box is None:
+        images = np.zeros((coords.shape[0], 3), dtype=np.int64)
+        shifts: tp.Iterable[tp.Tuple[int, ...]] = [(0, 0, 0)]
+    else:
+        images = np.floor(coords @ np.linalg.inv(box.vectors)).astype(np.int64)
+        coords = coords - images @ box.vectors
+        shifts = itertools.product(range(-2, 3), repeat=3)
+    pairs = set()
+    for shift in shifts:
+        displace = np.zeros(3) if box is None else np.array(shift) @ box.vectors
+        diff = coords[None, :, :] + displace - coords[:, None, :]
+        i, j = np.nonzero(np.sum(diff**2, axis=-1) < cutoff**2)
+        for a, b in zip(i, j):
+            if a < b:
+                pairs.add((a, b, *(np.array(shift) + images[a] - images[b])))
+    return pairs
+
+
+@pytest.mark.fast
+@pytest.mark.parametrize(
+    "angles",
+    [None, (90.0, 90.0, 90.0), (70.0, 80.0, 100.0), (109.4712206,) * 3],
+)
+def test_neighbor_pairs(angles: tp.Optional[tp.Tuple[float, ...]]) -> None:
+    rng = np.random.default_rng(0)
+    # Coords are not wrapped into the box
+    coords = rng.uniform(-10.0, 25.0, size=(150, 3))
+    box = None
+    if angles is not None:
+        box = BoxParams(np.array([10.0, 11.0, 12.0]), np.array(angles))
+    for cutoff in (1.5, 3.5):
+        expect = _brute_force_pairs(coords, cutoff, box)
+        for kind in (
+            NeighborlistKind.AUTO,
+            NeighborlistKind.INTERNAL_CELL_LIST,
+            NeighborlistKind.INTERNAL_ALL_PAIRS,
+        ):
+            pairs = neighbor_pairs(coords, cutoff, box, kind)
+            assert pairs.num == len(expect)
+            got = set(map(tuple, np.column_stack((pairs.idxs, pairs.shifts)).tolist()))
+            assert got == expect
+            keys = pairs.idxs[:, 0] * coords.shape[0] + pairs.idxs[:, 1]
+            assert (np.diff(keys) >= 0).all()
+            assert (pairs.distances(coords, box) < cutoff).all()
+        chunks = list(iter_neighbor_pairs(coords, cutoff, box, chunk_size=100))
+        assert sum(c.num for c in chunks) == len(expect)
+
+
+@pytest.mark.fast
+def test_neighbor_pairs_errors() -> None:
+    coords = np.zeros((3, 3))
+    box = BoxParams(np.array([10.0, 10.0, 10.0]))
+    assert neighbor_pairs(coords, 1.0).num == 3
+    assert neighbor_pairs(np.zeros((0, 3)), 1.0).num == 0
+    with pytest.raises(ValueError, match="half the box"):
+        neighbor_pairs(coords, 6.0, box)
+    with pytest.raises(ValueError):
+        neighbor_pairs(coords, 1.0, kind=NeighborlistKind.EXTERNAL)
+    with pytest.raises(ValueError):
+        neighbor_pairs(coords[:, :2], 1.0)
+
+
+@pytest.mark.fast
+def test_full_and_csr_neighbor_pairs() -> None:
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0.0, 10.0, size=(100, 3))
+    box = BoxParams(np.array([10.0, 10.0, 10.0]))
+    half = neighbor_pairs(coords, 3.0, box)
+    full = neighbor_pairs(coords, 3.0, box, full=True)
+    assert full.num == 2 * half.num
+    keys = full.idxs[:, 0] * 100 + full.idxs[:, 1]
+    assert (np.diff(keys) > 0).all()
+    assert np.allclose(
+        np.sort(full.distances(coords, box)),
+        np.sort(np.repeat(half.distances(coords, box), 2)),
+    )
+
+    offsets, neighbors, shifts = full.to_csr(100)
+    assert offsets.shape == (101,)
+    assert offsets[-1] == full.num
+    for atom in (0, 50, 99):
+        row = slice(offsets[atom], offsets[atom + 1])
+        is_atom = full.idxs[:, 0] == atom
+        assert (neighbors[row] == full.idxs[is_atom, 1]).all()
+        assert (shifts[row] == full.shifts[is_atom]).all()
+
+
+@pytest.mark.fast
+@pytest.mark.parametrize("angles", [None, (90.0, 90.0, 90.0), (80.0, 90.0, 100.0)])
+def test_frames_neighbor_pairs(angles: tp.Optional[tp.Tuple[float, ...]]) -> None:
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-5.0, 20.0, size=(5, 100, 3))
+    box = None
+    if angles is not None:
+        box = BoxParams(np.array([10.0, 11.0, 12.0]), np.array(angles))
+    for kind in (
+        NeighborlistKind.AUTO,
+        NeighborlistKind.INTERNAL_CELL_LIST,
+        NeighborlistKind.INTERNAL_ALL_PAIRS,
+    ):
+        # Small chunks, so that frames are split
+        frames = list(
+            iter_frames_neighbor_pairs(
+                coords, 3.0, box, kind, full=True, chunk_size=10000
+            )
+        )
+        assert len(frames) == 5
+        for pairs, frame in zip(frames, coords):
+            expect = neighbor_pairs(frame, 3.0, box, full=True)
+            assert (pairs.idxs == expect.idxs).all()
+            assert (pairs.shifts == expect.shifts).all()
+    with pytest.raises(ValueError):
+        list(iter_frames_neighbor_pairs(coords, 3.0, [BoxParams()]))
+
+
+@pytest.mark.fast
+def test_verlet_list() -> None:
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0.0, 12.0, size=(200, 3))
+    box = BoxParams(np.array([12.0, 12.0, 12.0]))
+    verlet = VerletList(3.0, skin=1.0)
+    for _ in range(10):
+        # Coords are not wrapped back into the box
+        coords += rng.normal(0.0, 0.05, size=coords.shape)
+        pairs = verlet.update(coords, box)
+        expect = neighbor_pairs(coords, 3.0, box)
+        assert (pairs.idxs == expect.idxs).all()
+        assert (pairs.shifts == expect.shifts).all()
+    assert 1 < verlet.builds_num < 10
+    builds_num = verlet.builds_num
+    verlet.update(coords, BoxParams(np.array([12.5, 12.0, 12.0])))
+    assert verlet.builds_num == builds_num + 1
@@ -1,8 +1,21 @@
+import gzip
+import io
 from pathlib import Path
+import numpy as np
 import pytest
 import tempfile
+import typing as tp
 
-from mdutils.amber.prmtop import Prmtop
+from mdutils.amber.prmtop import (
+    Prmtop,
+    PrmtopError,
+    PrmtopMeta,
+    load_single_raw_prmtop_block,
+)
+from mdutils.amber.prmtop_blocks import Flag
+from mdutils.amber.prmtop_cache import PrmtopCache
+from mdutils._shm import SharedArrays
+from mdutils.units import AMBER_ATOM_CHARGE_SCALE_FACTOR
 
 
 @pytest.mark.fast
@@ -25,3 +38,557 @@ def testDummyPrmtop() -> None:
         result = Path(d) / "result.prmtop"
         prmtop.dump(result, write_new_date=False)
         assert expect.read_text() == result.read_text()
+
+
+@pytest.mark.fast
+def testLazyPrmtop() -> None:
+    expect = (Path(__file__).parent / "resources") / "test.prmtop"
+    prmtop = Prmtop.load(expect, lazy=True)
+    eager = Prmtop.load(expect)
+    assert (prmtop.resids.label == eager.resids.label).all()
+    assert (prmtop.atoms.charge == eager.atoms.charge).all()
+    assert prmtop.bonds.num() == eager.bonds.num()
+    with tempfile.TemporaryDirectory() as d:
+        result = Path(d) / "result.prmtop"
+        prmtop.dump(result, write_new_date=False)
+        assert expect.read_text() == result.read_text()
+
+
+@pytest.mark.fast
+def testCompactPrmtop() -> None:
+    path = (Path(__file__).parent / "resources") / "test.prmtop"
+    prmtop = Prmtop.load(path, compact=True)
+    eager = Prmtop.load(path)
+    assert prmtop.blocks[Flag.ATOM_LABEL].dtype == np.dtype("S4")
+    assert prmtop.blocks[Flag.ATOM_CHARGE].dtype == np.float32
+    assert prmtop.blocks[Flag.BOND_WITH_HYDROGEN].dtype == np.int32
+    assert (prmtop.atoms.label == eager.atoms.label).all()
+    assert (prmtop.resids.label == eager.resids.label).all()
+    assert (prmtop.atoms.fftype == eager.atoms.fftype).all()
+    assert np.allclose(prmtop.atoms.charge, eager.atoms.charge)
+    bonds = prmtop.blocks[Flag.BOND_WITH_HYDROGEN]
+    assert (bonds == eager.blocks[Flag.BOND_WITH_HYDROGEN]).all()
+    prmtop.check_meta_consistency(PrmtopMeta.load(path))
+    with tempfile.TemporaryDirectory() as d:
+        result = Path(d) / "result.prmtop"
+        prmtop.dump(result, write_new_date=False)
+        reloaded = Prmtop.load(result)
+        assert reloaded.blocks.keys() == eager.blocks.keys()
+        assert (reloaded.atoms.label == eager.atoms.label).all()
+        assert np.allclose(reloaded.atoms.mass, eager.atoms.mass)
+
+
+@pytest.mark.fast
+def testPrmtopMeta() -> None:
+    path = (Path(__file__).parent / "resources") / "test.prmtop"
+    meta = PrmtopMeta.load(path)
+    assert meta.atoms_num == 1912
+    assert meta.date_time == "08/10/23  05:50:27"
+    Prmtop.load(path).check_meta_consistency(meta)
+
+    # POINTERS block after a block that doesn't fit in the read prefix
+    text = path.read_text()
+    start = text.index("%FLAG POINTERS")
+    end = text.index("%FLAG ATOM_NAME")
+    with tempfile.TemporaryDirectory() as d:
+        moved = Path(d) / "moved.prmtop"
+        moved.write_text("".join((text[:start], text[end:], text[start:end])))
+        assert PrmtopMeta.load(moved) == meta
+
+
+@pytest.mark.fast
+def testPrmtopCache() -> None:
+    expect = (Path(__file__).parent / "resources") / "test.prmtop"
+    with tempfile.TemporaryDirectory() as d:
+        cache = PrmtopCache(Path(d) / "cache")
+        Prmtop.load(expect, cache=cache)
+        entry = cache.entry_path(expect)
+        assert entry.is_file()
+        for _ in range(2):
+            prmtop = Prmtop.load(expect, cache=cache)
+            result = Path(d) / "result.prmtop"
+            prmtop.dump(result, write_new_date=False)
+            assert expect.read_text() == result.read_text()
+            # Corrupt entries fall back to the parser
+            entry.write_bytes(b"garbage")
+
+        # Dates are stored verbatim, including missing (empty) dates
+        for date_time in ("", None):
+            prmtop.date_time = date_time
+            loaded = Prmtop._from_cache_arrays(prmtop._to_cache_arrays())
+            assert loaded.date_time == date_time
+
+        # Entries above the size limit are evicted
+        PrmtopCache(cache.root, max_size_bytes=0).evict()
+        assert not entry.is_file()
+
+
+@pytest.mark.fast
+def testDumpPrmtopStreams() -> None:
+    expect = (Path(__file__).parent / "resources") / "test.prmtop"
+    prmtop = Prmtop.load(expect)
+    text_buf = io.StringIO()
+    prmtop.dump(text_buf, write_new_date=False)
+    assert text_buf.getvalue() == expect.read_text()
+    bytes_buf = io.BytesIO()
+    prmtop.dump(bytes_buf, write_new_date=False)
+    assert bytes_buf.getvalue() == expect.read_bytes()
+    with tempfile.TemporaryDirectory() as d:
+        result = Path(d) / "result.prmtop.gz"
+        prmtop.dump(result, write_new_date=False)
+        assert gzip.decompress(result.read_bytes()) == expect.read_bytes()
+        assert list(Path(d).iterdir()) == [result]
+
+    # Integer blocks with non-integer values can't be written
+    prmtop = Prmtop.load(expect)
+    atoms_num = prmtop.blocks[Flag.ATOMS_PER_MOLECULE].astype(np.float64)
+    atoms_num[0] += 0.5
+    prmtop.blocks[Flag.ATOMS_PER_MOLECULE] = atoms_num
+    with pytest.raises(PrmtopError, match="ATOMS_PER_MOLECULE"):
+        prmtop.dump(io.StringIO())
+
+
+@pytest.mark.fast
+def testLoadCompressedPrmtop() -> None:
+    expect = (Path(__file__).parent / "resources") / "test.prmtop"
+    with tempfile.TemporaryDirectory() as d:
+        compressed = Path(d) / "test.prmtop.gz"
+        compressed.write_bytes(gzip.compress(expect.read_bytes()))
+        assert PrmtopMeta.load(compressed) == PrmtopMeta.load(expect)
+        assert load_single_raw_prmtop_block(
+            compressed, Flag.SOLVENT_POINTERS
+        ) == load_single_raw_prmtop_block(expect, Flag.SOLVENT_POINTERS)
+        for lazy in (False, True):
+            prmtop = Prmtop.load(compressed, lazy=lazy)
+            result = Path(d) / "result.prmtop"
+            prmtop.dump(result, write_new_date=False)
+            assert expect.read_text() == result.read_text()
+
+
+@pytest.mark.fast
+def testLoadManyPrmtop() -> None:
+    resources = Path(__file__).parent / "resources"
+    expect = resources / "test.prmtop"
+    with tempfile.TemporaryDirectory() as d:
+        copy = Path(d) / "copy.prmtop"
+        copy.write_bytes(expect.read_bytes())
+        missing = Path(d) / "missing.prmtop"
+        paths = [expect, resources / "dummy.prmtop", copy, missing]
+        for workers in (1, 2):
+            prmtops = Prmtop.load_many(paths, workers=workers, return_exceptions=True)
+            assert isinstance(prmtops[3], FileNotFoundError)
+            for path, prmtop in zip(paths[:3], prmtops):
+                assert isinstance(prmtop, Prmtop)
+                result = Path(d) / "result.prmtop"
+                prmtop.dump(result, write_new_date=False)
+                assert path.read_text() == result.read_text()
+            # Identical files are parsed once, but don't share blocks
+            assert prmtops[0] is not prmtops[2]
+            assert prmtops[0].blocks[Flag.ATOM_MASS] is not (
+                prmtops[2].blocks[Flag.ATOM_MASS]
+            )
+        with pytest.raises(PrmtopError, match="missing.prmtop"):
+            Prmtop.load_many(paths, workers=2)
+
+
+@pytest.mark.fast
+def testLoadManyPrmtopInterrupted(monkeypatch: pytest.MonkeyPatch) -> None:
+    shm_dir = Path("/dev/shm")
+    if not shm_dir.is_dir():
+        pytest.skip("Needs POSIX shared memory")
+    resources = Path(__file__).parent / "resources"
+    paths = [resources / "test.prmtop", resources / "dummy.prmtop"]
+
+    def interrupt(self: SharedArrays) -> tp.NoReturn:
+        raise KeyboardInterrupt
+
+    # Segments that were not unpacked are released anyways
+    before = set(shm_dir.iterdir())
+    monkeypatch.setattr(SharedArrays, "unpack", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        Prmtop.load_many(paths, workers=2)
+    assert set(shm_dir.iterdir()) == before
+
+
+@pytest.mark.fast
+def testPrmtopDerivedCache() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    charge = prmtop.atoms.charge
+    assert prmtop.atoms.charge is charge
+    assert not charge.flags.writeable
+    bonds_num = prmtop.bonds.num("with-H")
+
+    # Replacing or deleting blocks drops the cached values
+    prmtop.blocks[Flag.ATOM_CHARGE] = prmtop.blocks[Flag.ATOM_CHARGE] * 2
+    assert (prmtop.atoms.charge == 2 * charge).all()
+    del prmtop.blocks[Flag.BOND_WITH_HYDROGEN]
+    assert prmtop.bonds.num("with-H") == 0 != bonds_num
+
+    # Blocks can't be mutated in place, since that can't be tracked
+    with pytest.raises(ValueError):
+        prmtop.blocks[Flag.ATOM_CHARGE][0] += 18.2223
+    with pytest.raises(ValueError):
+        prmtop.atoms.mass[0] = 1.0
+    new_charge = prmtop.blocks[Flag.ATOM_CHARGE].copy()
+    new_charge[0] += 18.2223
+    prmtop.blocks[Flag.ATOM_CHARGE] = new_charge
+    assert np.isclose(
+        prmtop.atoms.charge[0], new_charge[0] * AMBER_ATOM_CHARGE_SCALE_FACTOR
+    )
+    lazy = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop", lazy=True)
+    assert not lazy.blocks[Flag.ATOM_CHARGE].flags.writeable
+    # Arrays of the callers stay writable
+    assert new_charge.flags.writeable
+    blocks = {Flag.BOX_DIMENSIONS: np.arange(3.0)}
+    assert not Prmtop(blocks=blocks).blocks[Flag.BOX_DIMENSIONS].flags.writeable
+    blocks[Flag.BOX_DIMENSIONS][0] = 5.0
+
+    prmtop.blocks = {}
+    with pytest.raises(KeyError):
+        prmtop.atoms.charge
+
+
+@pytest.mark.fast
+def testMoleculesAccessor() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    resids_num = prmtop.molecs.resids_num
+    assert resids_num.sum() == prmtop.resids.num
+    assert resids_num[:3].tolist() == [3, 1, 1]
+    assert prmtop.molecs.max_resids_num == 3
+    assert prmtop.molecs.label.tolist()[:3] == ["POLYRESID_MOLEC_0", "WAT ", "WAT "]
+    assert prmtop.molecs.label.shape == (prmtop.molecs.num,)
+
+    # Molec boundaries that split a resid are reported
+    atoms_num = prmtop.molecs.atoms_num.copy()
+    atoms_num[1:3] += [1, -1]
+    prmtop.blocks[Flag.ATOMS_PER_MOLECULE] = atoms_num
+    with pytest.raises(RuntimeError, match="molec 1 ends"):
+        prmtop.molecs.resids_num
+
+
+@pytest.mark.fast
+def testAddIntraMoleculeBonds() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    bonds = prmtop.blocks[Flag.BOND_WITHOUT_HYDROGEN].reshape(-1, 3)
+    h_bonds = prmtop.blocks[Flag.BOND_WITH_HYDROGEN].reshape(-1, 3)
+    bonded = {
+        tuple(sorted(pair)) for pair in np.concatenate((bonds, h_bonds))[:, :2] // 3
+    }
+    num_bond_types = prmtop.bonds.fftype_num
+    prmtop.add_intra_molecule_bonds()
+
+    # Only the first molec (ACE-ALA-NME) has unbonded pairs, waters are rigid
+    size = prmtop.molecs.atoms_num[0]
+    expect = [
+        [3 * i, 3 * j, num_bond_types + 1]
+        for i in range(size)
+        for j in range(i + 1, size)
+        if (i, j) not in bonded
+    ]
+    result = prmtop.blocks[Flag.BOND_WITHOUT_HYDROGEN].reshape(-1, 3)
+    assert (result[: len(bonds)] == bonds).all()
+    assert result[len(bonds) :].tolist() == expect  # noqa
+    assert prmtop.bonds.fftype_num == num_bond_types + 1
+    assert prmtop.bonds.fftype_force_const[-1] == 0.0
+
+
+@pytest.mark.fast
+def testBondGraph() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    graph = prmtop.bond_graph
+    assert prmtop.bond_graph is graph
+    assert graph.nodes_num == prmtop.atoms.num
+    assert graph.edges_num == prmtop.bonds.num()
+    assert (prmtop.molecs.atoms_num_from_bonds == prmtop.molecs.atoms_num).all()
+
+    # Regenerate molecs after merging them
+    solvent_pointers = prmtop.blocks[Flag.SOLVENT_POINTERS].copy()
+    prmtop.blocks[Flag.ATOMS_PER_MOLECULE] = np.array([prmtop.atoms.num])
+    prmtop.regenerate_molecules()
+    assert (prmtop.molecs.atoms_num == prmtop.molecs.atoms_num_from_bonds).all()
+    assert prmtop.molecs.num == 631
+    assert (prmtop.blocks[Flag.SOLVENT_POINTERS] == solvent_pointers).all()
+
+
+@pytest.mark.fast
+def testExclusions() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    counts = prmtop.blocks[Flag.NUMBER_EXCLUDED_ATOMS]
+    raw = prmtop.blocks[Flag.EXCLUDED_ATOMS_LIST]
+    exclusions = prmtop.exclusions
+    # The last atom of each molec has no exclusions, only a placeholder
+    has_none = exclusions.num == 0
+    assert has_none.sum() == prmtop.molecs.num
+    assert (counts[has_none] == 1).all()
+    assert (exclusions.num[~has_none] == counts[~has_none]).all()
+    assert exclusions.offsets[-1] == exclusions.idxs.shape[0] == (raw != 0).sum()
+    assert exclusions.neighbors(0).tolist() == (raw[:6] - 1).tolist()
+
+    pairs = exclusions.pairs()
+    assert exclusions.is_excluded(pairs[:, 0], pairs[:, 1]).all()
+    assert exclusions.is_excluded(pairs[:, 1], pairs[:, 0]).all()
+    bonds = prmtop.blocks[Flag.BOND_WITHOUT_HYDROGEN].reshape(-1, 3)[:, :2] // 3
+    assert exclusions.is_excluded(bonds[:, 0], bonds[:, 1]).all()
+    assert exclusions.is_excluded(0, np.array([1, 21, 1911])).tolist() == [
+        True,
+        False,
+        False,
+    ]
+    assert exclusions.graph().edges_num == pairs.shape[0]
+
+
+@pytest.mark.fast
+def testRegenerateExclusions() -> None:
+    expect = (Path(__file__).parent / "resources") / "test.prmtop"
+    prmtop = Prmtop.load(expect)
+    prmtop.blocks[Flag.EXCLUDED_ATOMS_LIST] = np.array([], dtype=np.int64)
+    prmtop.regenerate_exclusions()
+    result = io.StringIO()
+    prmtop.dump(result, write_new_date=False)
+    assert result.getvalue() == expect.read_text()
+
+    # After adding bonds, all atoms of each molec exclude each other
+    prmtop.add_intra_molecule_bonds()
+    prmtop.regenerate_exclusions()
+    size = prmtop.molecs.atoms_num[0]
+    assert prmtop.exclusions.num[:size].tolist() == list(range(size - 1, 0, -1)) + [0]
+
+
+@pytest.mark.fast
+def testRegenerateAnglesAndDihedrals() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    expect = {
+        prefix: {
+            suffix: prmtop.blocks[Flag[f"{prefix}_{suffix}_HYDROGEN"]].copy()
+            for suffix in ("WITH", "WITHOUT")
+        }
+        for prefix in ("ANGLE", "DIHEDRAL")
+    }
+    prmtop.regenerate_angles_and_dihedrals()
+
+    def angles(block: np.ndarray) -> tp.Set[tp.Tuple[int, ...]]:
+        idxs = block.reshape(-1, 4)[:, :3] // 3
+        return {tuple(sorted(a[::2]) + [a[1]]) for a in idxs.tolist()}
+
+    def propers(block: np.ndarray) -> tp.Set[tp.Tuple[int, ...]]:
+        block = block.reshape(-1, 5)
+        # Impropers have a negative 4th idx, repeated terms a negative 3rd idx
+        idxs = np.abs(block[block[:, 3] >= 0, :4]) // 3
+        return {tuple(d if d[1] < d[2] else d[::-1]) for d in idxs.tolist()}
+
+    for suffix in ("WITH", "WITHOUT"):
+        result = prmtop.blocks[Flag[f"ANGLE_{suffix}_HYDROGEN"]]
+        assert angles(result) == angles(expect["ANGLE"][suffix])
+        result = prmtop.blocks[Flag[f"DIHEDRAL_{suffix}_HYDROGEN"]]
+        assert propers(result) == propers(expect["DIHEDRAL"][suffix])
+        assert (result.reshape(-1, 5)[:, 4] == 1).all()
+
+
+@pytest.mark.fast
+def testRegenerateAnglesInThreeRings() -> None:
+    # Cyclopropane, C-C-C angles are real terms, unlike the H-O-H of waters
+    prmtop = Prmtop.dummy_from_znums([6, 6, 6] + [1] * 6)
+    prmtop.blocks[Flag.BOND_WITHOUT_HYDROGEN] = np.array(
+        [0, 3, 1, 3, 6, 1, 0, 6, 1], dtype=np.int64
+    )
+    c_h_bonds = [(0, 3), (0, 4), (1, 5), (1, 6), (2, 7), (2, 8)]
+    prmtop.blocks[Flag.BOND_WITH_HYDROGEN] = np.array(
+        [[3 * c, 3 * h, 1] for c, h in c_h_bonds], dtype=np.int64
+    ).ravel()
+    prmtop.regenerate_angles_and_dihedrals()
+    angles = prmtop.angles.atom_idxs
+    assert angles.shape[0] == 18
+    ring_angles = {tuple(a) for a in angles.tolist() if max(a) < 3}
+    assert ring_angles == {(1, 0, 2), (0, 1, 2), (0, 2, 1)}
+    # Only the H-C-C-H dihedrals compute 1-4 terms
+    dihedrals = prmtop.dihedrals
+    assert dihedrals.num() == 24
+    ends = dihedrals.atom_idxs[~dihedrals.skip_14][:, [0, 3]]
+    assert ends.shape[0] == 12 and (ends >= 3).all()
+
+
+@pytest.mark.fast
+def testLennardJones() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    ntypes = prmtop.atoms.ljindex_num
+    acoef_block = prmtop.blocks[Flag.LJ_PARAM_A]
+    param_idx = prmtop.blocks[Flag.LJ_PARAM_INDEX]
+    ljindex = prmtop.atoms.ljindex
+    i = np.arange(30)
+    j = np.arange(1900, 1912)
+    acoef, bcoef = prmtop.lj_params(i[:, None], j[None, :])
+    assert acoef.shape == bcoef.shape == (30, 12)
+    for a, b in ((0, 1900), (5, 1911), (21, 22)):
+        expect = acoef_block[param_idx[ntypes * (ljindex[a] - 1) + ljindex[b] - 1] - 1]
+        assert prmtop.lj_params(a, b)[0] == expect
+    assert (prmtop.lj.acoef == prmtop.lj.acoef.T).all()
+
+    # TIP3P hydrogens have no LJ interactions
+    sigma = prmtop.lj.sigma
+    epsilon = prmtop.lj.epsilon
+    assert sigma[-1] == epsilon[-1] == 0.0
+    assert np.allclose(epsilon[:2], [0.0157, 0.1094])
+    pair_sigma = (sigma[:, None] + sigma) / 2
+    pair_epsilon = np.sqrt(epsilon[:, None] * epsilon)
+    assert np.allclose(prmtop.lj.bcoef, 4 * pair_epsilon * pair_sigma**6)
+
+    # NBFIX-style modifications break the combining rules
+    acoef_block = acoef_block.copy()
+    acoef_block[param_idx[1] - 1] *= 1.1
+    prmtop.blocks[Flag.LJ_PARAM_A] = acoef_block
+    with pytest.raises(PrmtopError, match="Lorentz-Berthelot"):
+        prmtop.lj.sigma
+
+
+@pytest.mark.fast
+def testInteractionTables() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    for accessor, prefix, k in (
+        (prmtop.bonds, "BOND", 2),
+        (prmtop.angles, "ANGLE", 3),
+        (prmtop.dihedrals, "DIHEDRAL", 4),
+    ):
+        with_h = prmtop.blocks[Flag[f"{prefix}_WITH_HYDROGEN"]].reshape(-1, k + 1)
+        without_h = prmtop.blocks[Flag[f"{prefix}_WITHOUT_HYDROGEN"]].reshape(-1, k + 1)
+        raw = np.concatenate((with_h, without_h))
+        atom_idxs = accessor.atom_idxs
+        assert atom_idxs.dtype == np.int32
+        assert atom_idxs.flags.c_contiguous and not atom_idxs.flags.writeable
+        assert atom_idxs.shape == (accessor.num(), k)
+        assert (atom_idxs == np.abs(raw[:, :k]) // 3).all()
+        assert (accessor.fftype_idx == raw[:, -1] - 1).all()
+        assert accessor.fftype_idx.max() < accessor.fftype_num
+        assert accessor.has_hydrogen.sum() == with_h.shape[0]
+        assert accessor.has_hydrogen[: with_h.shape[0]].all()
+        assert accessor.atom_idxs is atom_idxs
+        # The raw blocks are merged only once for all columns
+        assert accessor._merged_table() is accessor._merged_table()
+
+    dihedrals = prmtop.dihedrals
+    raw = np.concatenate(
+        (
+            prmtop.blocks[Flag.DIHEDRAL_WITH_HYDROGEN],
+            prmtop.blocks[Flag.DIHEDRAL_WITHOUT_HYDROGEN],
+        )
+    ).reshape(-1, 5)
+    assert dihedrals.is_improper.sum() == 4
+    assert (dihedrals.is_improper == (raw[:, 3] < 0)).all()
+    assert (dihedrals.skip_14 == (raw[:, 2] < 0)).all()
+    assert dihedrals.skip_14[dihedrals.is_improper].all()
+
+
+@pytest.mark.fast
+def testStripAndSubset(tmp_path: Path) -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    is_wat = prmtop.select(":WAT")
+    solute = prmtop.strip(":WAT")
+    assert solute.atoms.num == 22
+    assert solute.resids.num == 3
+    assert solute.molecs.atoms_num.tolist() == [22]
+    assert solute.blocks[Flag.CMAP_INDEX].tolist() == [5, 7, 9, 15, 17, 1]
+    assert not prmtop.strip(":1").has_cmap
+    assert solute.blocks[Flag.SOLVENT_POINTERS].tolist() == [3, 1, 2]
+    assert (solute.atoms.label == prmtop.atoms.label[~is_wat]).all()
+    # Water LJ types are pruned
+    assert solute.atoms.ljindex_num == 7
+    acoef, _ = solute.lj_params(*np.triu_indices(22))
+    expect, _ = prmtop.lj_params(*np.triu_indices(22))
+    assert (acoef == expect).all()
+    pairs = prmtop.exclusions.pairs()
+    expect_pairs = pairs[(pairs < 22).all(axis=1)]
+    assert (solute.exclusions.pairs() == expect_pairs).all()
+
+    water = prmtop.subset(np.flatnonzero(is_wat))
+    assert water.atoms.num == 1890
+    assert water.blocks[Flag.SOLVENT_POINTERS].tolist() == [0, 630, 1]
+    assert water.atoms.ljindex_num == 2
+    assert water.bonds.fftype_num == 2
+    assert water.angles.num() == 0 and water.dihedrals.num() == 0
+
+    # Terms of the kept atoms are preserved, with their parameters
+    is_kept = ~prmtop.select("@H* | :3")
+    stripped = prmtop.strip(~is_kept)
+    new_idx = np.cumsum(is_kept) - 1
+    for name, params in (
+        ("bonds", ("force_const", "equil_distance")),
+        ("angles", ("force_const", "equil_angle")),
+        ("dihedrals", ("force_const", "periodicity", "phase")),
+    ):
+        old, new = getattr(prmtop, name), getattr(stripped, name)
+        has_kept = is_kept[old.atom_idxs].all(axis=1)
+        expect = {
+            (
+                *sorted([tuple(a), tuple(a[::-1])])[0],
+                *(getattr(old, f"fftype_{p}")[t] for p in params),
+            )
+            for a, t in zip(new_idx[old.atom_idxs[has_kept]], old.fftype_idx[has_kept])
+        }
+        actual = {
+            (
+                *sorted([tuple(a), tuple(a[::-1])])[0],
+                *(getattr(new, f"fftype_{p}")[t] for p in params),
+            )
+            for a, t in zip(new.atom_idxs, new.fftype_idx)
+        }
+        assert actual == expect
+        assert new.fftype_num == np.unique(new.fftype_idx).shape[0]
+    kept_dihedrals = is_kept[prmtop.dihedrals.atom_idxs].all(axis=1)
+    for flag in ("is_improper", "skip_14"):
+        old_flag = getattr(prmtop.dihedrals, flag)[kept_dihedrals]
+        assert getattr(stripped.dihedrals, flag).sum() == old_flag.sum()
+
+    path = tmp_path / "stripped.prmtop"
+    stripped.dump(path)
+    assert Prmtop.load(path).atoms.num == is_kept.sum()
+    with pytest.raises(PrmtopError):
+        prmtop.strip("*")
+    assert prmtop.strip([]).atoms.num == prmtop.atoms.num
+    for bad in ([-1], [prmtop.atoms.num], [0.5], np.zeros(3, dtype=bool), [[0]]):
+        with pytest.raises(ValueError):
+            prmtop.subset(np.asarray(bad))
+
+
+@pytest.mark.fast
+def testRepartitionHydrogenMasses() -> None:
+    prmtop = Prmtop.load((Path(__file__).parent / "resources") / "test.prmtop")
+    mass = prmtop.atoms.mass.astype(np.float64)
+    is_h = prmtop.atoms.znum == 1
+    is_wat = prmtop.select(":WAT")
+    prmtop.repartition_hydrogen_masses()
+    new_mass = prmtop.atoms.mass.astype(np.float64)
+    assert np.allclose(new_mass[is_h & ~is_wat], 3.024)
+    assert (new_mass[is_wat] == mass[is_wat]).all()
+    # Methyl C of ACE, N and CA of ALA
+    assert np.allclose(new_mass[[1, 6, 8]], [12.01 - 3 * 2.016, 14.01 - 2.016, 9.994])
+    assert np.isclose(new_mass.sum(), mass.sum())
+
+    prmtop.repartition_hydrogen_masses(4.0, modify_waters=True)
+    new_mass = prmtop.atoms.mass.astype(np.float64)
+    assert np.allclose(new_mass[is_h], 4.0)
+    assert np.allclose(new_mass[is_wat & ~is_h], 16.0 - 2 * 2.992)
+    assert np.isclose(new_mass.sum(), mass.sum())
+    with pytest.raises(PrmtopError):
+        prmtop.repartition_hydrogen_masses(10.0)
+
+
+@pytest.mark.fast
+def testRepartitionHydrogenMassesSolvents() -> None:
+    # Methanol solvent box with a water, all molecs are solvent
+    prmtop = Prmtop.dummy_from_znums([6, 8, 1, 1, 1, 1] * 2 + [8, 1, 1])
+    # C-H and O-H bonds of both methanols, and the bonds of the rigid water
+    h_bonds = [(c + i, c + j) for c in (0, 6) for i, j in ((0, 2), (0, 3), (0, 4))]
+    h_bonds += [(1, 5), (7, 11), (12, 13), (12, 14), (13, 14)]
+    prmtop.blocks[Flag.BOND_WITH_HYDROGEN] = np.array(
+        [[3 * i, 3 * j, 1] for i, j in h_bonds]
+    ).ravel()
+    # C-O bonds
+    prmtop.blocks[Flag.BOND_WITHOUT_HYDROGEN] = np.array([0, 3, 1, 18, 21, 1])
+    prmtop.blocks[Flag.ATOMS_PER_MOLECULE] = np.array([6, 6, 3])
+    prmtop.blocks[Flag.SOLVENT_POINTERS] = np.array([0, 3, 1])
+    mass = prmtop.atoms.mass.astype(np.float64)
+    is_h = prmtop.atoms.znum == 1
+    prmtop.repartition_hydrogen_masses()
+    new_mass = prmtop.atoms.mass.astype(np.float64)
+    assert np.allclose(new_mass[:12][is_h[:12]], 3.024)
+    assert (new_mass[12:] == mass[12:]).all()
+    assert np.isclose(new_mass[:6].sum(), mass[:6].sum())